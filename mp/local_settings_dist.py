@@ -9,9 +9,21 @@ VIRTUAL_DISPLAY = False
 SELENIUM_SAVE_SCREENSHOT_ON_OK = True
 SELENIUM_SAVE_SCREENSHOT_ON_ERROR = True
 SELENIUM_WAIT_TO_LOAD = 30
+SELENIUM_SCREENSHOT_OK_RATE = 0.01  # доля успешных страниц со снимком при SELENIUM_SAVE_SCREENSHOT_ON_OK
+SELENIUM_SCREENSHOT_DIR = 'logs'
+SELENIUM_SCREENSHOT_MAX_FILES = 200
 PARSER_LIMIT = 2
 SERVER_NAME = "SOLOTONY_1"
 MIN_DESCRIPTION_LENGTH = 100
 MIN_INSTRUCTION_LENGTH = 20
 REQUESTS_CONNECTION_TIMEOUT = 30
 REQUESTS_DATA_TIMEOUT = 30
+ASYNC_MAX_CONNECTIONS = 20
+ASYNC_MAX_CONNECTIONS_PER_HOST = 4
+PROXY_CHECKER_URL = 'https://solotony.com/tools/proxy-checker/'  # страница <h1 id="ip">, можно указать локальную
+RESULTS_API_URL = 'https://epresentor.norobots.ru/asnf/api.php/result/save/'  # multiparser.uploader
+# магазины для manage.py supervise, см. multiparser.supervisor
+CRAWL_SHOPS = [
+    {'name': 'duim24', 'parser': 'multiparser.parsers.duim24_ru.ParserDuim24Ru', 'state': 'state/duim24.sqlite3',
+     'workers': 4, 'concurrency': 1, 'portion': 500, 'reset': True, 'upload': True, 'spool': 'state/spool'},
+]
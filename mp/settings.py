@@ -10,6 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+# значения по умолчанию для параметров, которых может не быть в local_settings
+ASYNC_MAX_CONNECTIONS = 20
+ASYNC_MAX_CONNECTIONS_PER_HOST = 4
+SELENIUM_SCREENSHOT_OK_RATE = 0.01
+SELENIUM_SCREENSHOT_DIR = 'logs'
+SELENIUM_SCREENSHOT_MAX_FILES = 200
+PROXY_CHECKER_URL = 'https://solotony.com/tools/proxy-checker/'
+RESULTS_API_URL = None
+CRAWL_SHOPS = []
+
 from .local_settings import *
 
 import os
@@ -173,4 +183,3 @@ LOGGING = {
         },
     }
 }
-
@@ -0,0 +1,240 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+асинхронный движок загрузки страниц.
+
+все запросы выполняются в одном event loop (в отдельном потоке) через общий
+aiohttp.ClientSession. синхронные http_get/http_post сохраняют контракт SimpleParser,
+поэтому parse_product/parse_category сайтовых парсеров не меняются - достаточно
+сменить базовый класс. параллельность дает parse_products/parse_categories,
+которые выполняют разбор нескольких ссылок одновременно, а количество запросов
+в полете ограничивается общим лимитом и лимитом на хост.
+'''
+
+from typing import List
+from time import monotonic
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import logging
+import aiohttp
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+from .base import Link, ProxyData, ParserException, format_proxy, PROXY_FAIL_STATUSES
+from .base import STATUS_CACHE_FRESH, STATUS_CACHE_VALIDATED
+from .simple_parser import SimpleParser
+
+
+class AsyncParser(SimpleParser):
+    '''
+    Парсер на aiohttp с тем же контрактом, что и SimpleParser.
+
+    * max_connections -- общее количество одновременных запросов
+    * max_connections_per_host -- количество одновременных запросов к одному хосту
+
+    По умолчанию лимиты берутся из settings.ASYNC_MAX_CONNECTIONS и
+    settings.ASYNC_MAX_CONNECTIONS_PER_HOST, сайтовый парсер может переопределить
+    их атрибутами класса MAX_CONNECTIONS и MAX_CONNECTIONS_PER_HOST.
+    '''
+
+    MAX_CONNECTIONS = None
+    MAX_CONNECTIONS_PER_HOST = None
+
+    def __init__(self, base_url, virtual_display=False, proxy:ProxyData=None,
+                 max_connections=None, max_connections_per_host=None):
+        super().__init__(base_url, virtual_display, proxy)
+        self._max_connections = max_connections or self.MAX_CONNECTIONS or settings.ASYNC_MAX_CONNECTIONS
+        self._max_connections_per_host = max_connections_per_host or self.MAX_CONNECTIONS_PER_HOST \
+                                         or settings.ASYNC_MAX_CONNECTIONS_PER_HOST
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+        self._host_semaphores = dict()
+
+    def _start_session(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='AsyncParserLoop', daemon=True)
+        self._thread.start()
+        self._run(self._open_session())
+        if not self._client:
+            raise ParserException("aiohttp.ClientSession failed")
+
+    def _stop_session(self):
+        if not self._loop:
+            return
+        if self._client:
+            self._run(self._client.close())
+        self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    async def _open_session(self):
+        self._semaphore = asyncio.Semaphore(self._max_connections)
+        self._host_semaphores = dict()
+        connector = None
+        if self._proxy and self._proxy.type in ('socks4', 'socks5'):
+            from aiohttp_socks import ProxyConnector
+            connector = ProxyConnector.from_url(format_proxy(self._proxy), limit=self._max_connections,
+                                                limit_per_host=self._max_connections_per_host)
+        else:
+            connector = aiohttp.TCPConnector(limit=self._max_connections,
+                                             limit_per_host=self._max_connections_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=settings.REQUESTS_CONNECTION_TIMEOUT,
+                                        sock_read=settings.REQUESTS_DATA_TIMEOUT)
+        self._client = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.mozilla_headers())
+
+    def _run(self, coro):
+        '''выполняет корутину в event loop парсера и ждет результат'''
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _host_semaphore(self, url) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self._max_connections_per_host)
+        return self._host_semaphores[host]
+
+    def _proxy_url(self, proxy: ProxyData = None) -> [str, None]:
+        '''
+        прокси запроса для aiohttp: из пула (next_proxy) или постоянный http-прокси.
+        постоянный socks-прокси подключается в connector, socks-прокси из пула не поддерживаются
+        '''
+        if proxy is None:
+            return None
+        if proxy.type in ('socks4', 'socks5'):
+            if self._proxy_pool is not None:
+                raise ParserException('AsyncParser does not support socks proxies from a pool: {}'.format(
+                    format_proxy(proxy)))
+            return None
+        if proxy.type == 'https':
+            proxy = proxy._replace(type='http')
+        return format_proxy(proxy)
+
+    async def async_http_text(self, method, url, referrer, form_data=None, encoding=None,
+                              proxy: ProxyData = None) -> (int, [str, None]):
+        '''
+        Выполняет запрос и возвращает пару (статус, текст).
+        При ошибках соединения статус 599, при таймауте 598, текст None.
+        proxy - прокси запроса (next_proxy), по умолчанию постоянный прокси парсера
+        '''
+        status, text, _ = await self._async_fetch(method, url, {'referer': referrer}, form_data, encoding, proxy)
+        return status, text
+
+    async def _async_fetch(self, method, url, headers: dict, form_data=None, encoding=None,
+                           proxy: ProxyData = None) -> (int, [str, None], dict):
+        '''запрос с заголовками headers: (статус, текст, заголовки ответа)'''
+        async with self._semaphore, self._host_semaphore(url):
+            try:
+                async with self._client.request(method, url, data=form_data, headers=headers,
+                                                 proxy=self._proxy_url(proxy or self._proxy)) as response:
+                    if response.status == STATUS_CACHE_VALIDATED and \
+                            ('if-none-match' in headers or 'if-modified-since' in headers):
+                        return response.status, None, response.headers  # страница в кеше не изменилась
+                    if response.status != 200:
+                        logging.error('URL failed status code=[{}] at [{}] '.format(response.status, url))
+                        return response.status, None, response.headers
+                    text = await response.text(encoding=encoding, errors='replace')
+                    return response.status, text, response.headers
+            except asyncio.TimeoutError as e:
+                logging.error('TimeoutError at [{}] {}'.format(url, e))
+                return 598, None, dict()
+            except aiohttp.ClientError as e:
+                logging.error('ClientError at [{}] {}'.format(url, e))
+                return 599, None, dict()
+
+    def _http_text(self, method, url, referrer, form_data=None, encoding=None, typ=None) -> [str, None]:
+        '''
+        Запрос из вызывающего потока. GET-запросы проходят через кеш (set_cache), как в SimpleParser
+        '''
+        self._status_code = 0
+        key, entry = self._cache_lookup(url, typ) if method == 'GET' else (None, None)
+        if entry and self._status_code == STATUS_CACHE_FRESH:
+            return entry.text
+        headers = {'referer': referrer}
+        headers.update(self._cache_headers(entry))
+        # выбор прокси и ожидание ограничителя частоты - в вызывающем потоке, цикл событий не блокируется
+        try:
+            proxy = self.next_proxy()
+        except ParserException as e:
+            self._status_code = 599
+            logging.error('{} at [{}]'.format(e, url))
+            return None
+        self.rate_limit(url)
+        started = monotonic()
+        status, text, response_headers = self._run(self._async_fetch(method, url, headers, form_data, encoding,
+                                                                     proxy))
+        self.report_proxy(proxy, status not in PROXY_FAIL_STATUSES and status not in (598, 599),
+                          monotonic() - started)
+        self._status_code = status
+        if status == STATUS_CACHE_VALIDATED and entry:
+            self._cache.touch(key)
+            return entry.text
+        if text is not None and key is not None:
+            self._cache_store(key, text, response_headers, typ)
+        return text
+
+    def _soup(self, text, url, builder=None, typ=None) -> [BeautifulSoup, None]:
+        if text is None:
+            return None
+        return self.make_soup(text, url, builder, typ)
+
+    def http_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
+        return self._http_text('GET', url, referrer, encoding=encoding, typ=typ)
+
+    def http_get(self, url, referrer, encoding=None, builder=None, typ=None)->[BeautifulSoup, None]:
+        logging.info("http_get({}) {}".format(url, self.__class__))
+        return self._soup(self._http_text('GET', url, referrer, encoding=encoding, typ=typ), url, builder, typ)
+
+    def http_post(self, url, referrer, form_data=None, builder=None, typ=None)->[BeautifulSoup, None]:
+        return self._soup(self._http_text('POST', url, referrer, form_data=form_data), url, builder, typ)
+
+    def start_session(self):
+        '''aiohttp сессия общая для всех потоков и открывается в __enter__'''
+        pass
+
+    def _map(self, func, links: List[Link]) -> dict:
+        '''выполняет func(link) для всех ссылок одновременно, в пределах max_connections'''
+        results = dict()
+        workers = min(len(links), self._max_connections)
+        if workers <= 1:
+            for link in links:
+                results[link] = func(link)
+            return results
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for link, result in zip(links, executor.map(func, links)):
+                results[link] = result
+        return results
+
+    def parse_products(self, links:[Link, List[Link]], fields: set) -> [dict, None]:
+        logging.info('parse_products')
+        if type(links) != list:
+            links = [links]
+        results = self._map(lambda link: self.parse_product_cached(link, fields), links)
+        return {link: result for link, result in results.items() if result}
+
+    def parse_categories(self, links:[Link, List[Link]], fields: set, product_fields: set = None) -> [dict, None]:
+        '''
+        Параллельный разбор категорий. Используется, если сайтовый парсер реализует parse_category.
+        '''
+        if type(links) != list:
+            links = [links]
+        if not hasattr(self, 'parse_category'):
+            return super().parse_categories(links, fields, product_fields)
+        results = self._map(lambda link: self.parse_category(link, fields, product_fields), links)
+        return {link: result for link, result in results.items() if result}
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop_session()
+        if exc_val:
+            raise
@@ -13,11 +13,21 @@
 '''
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List
-from time import sleep
+from time import sleep, time
+from urllib.parse import urlsplit
 import logging
+import queue
 import re
+import threading
 from bs4 import BeautifulSoup
+from django.conf import settings
+from .markup import make_soup, extract_regions, extract_links, BUILDER_LXML
+from .canonical import Canonicalizer
+from .ratelimit import RateLimiter
+from .retry import RetryQueue, DEFAULT_STATUSES
+from .extract import plan_for
 
 #  тип 'Link' - это описание ссылки
 #  type - тип ссылки ('C' сылка на категорию, 'G' сылка на страницу категории(для многостраничных),
@@ -31,6 +41,18 @@ re_ip = re.compile('^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
 Link = namedtuple('Link', 'type id')
 ProxyData = namedtuple('Proxy', 'type ip port auth', defaults=(None,None,None,None))
 
+#  статусы http_last_status для ответов из кеша. в результат (PARSED_STATUS) они не попадают:
+#  там 200 и отметка PARSED_CACHED, см. result_status
+STATUS_CACHE_FRESH = 296  # ответ взят из кеша без запроса, CACHE_TTL не истек
+STATUS_CACHE_VALIDATED = 304  # сервер ответил, что страница не изменилась, ответ взят из кеша
+CACHE_STATUSES = {STATUS_CACHE_FRESH, STATUS_CACHE_VALIDATED}
+
+#  смена прокси из пула (set_proxy_pool)
+ROTATE_SESSION = 'session'  # поток использует прокси, пока он не попал в карантин
+ROTATE_REQUEST = 'request'  # прокси выбирается для каждого запроса
+#  ответы, после которых прокси считается заблокированным сайтом
+PROXY_FAIL_STATUSES = {403, 407, 429}
+
 def format_proxy(proxy:ProxyData):
     if proxy.auth:
         s = '{}://{}@{}:{}'.format(proxy.type, proxy.auth, proxy.ip, proxy.port)
@@ -39,6 +61,17 @@ def format_proxy(proxy:ProxyData):
     return s
 
 
+def find_checker_ip(soup) -> [str, None]:
+    '''IP со страницы проверки прокси (settings.PROXY_CHECKER_URL): <h1 id="ip">'''
+    if not soup:
+        return None
+    tag = soup.find('h1', attrs={'id': 'ip'})
+    if not tag:
+        return None
+    text = tag.get_text(strip=True)
+    return text if re_ip.match(text) else None
+
+
 class ParserException(Exception):
     def __init__(self, msg, *args: object) -> None:
         super().__init__(*args)
@@ -47,9 +80,26 @@ class ParserException(Exception):
         return "ParserException({})".format(self._msg)
 
 
+class WalkStopped(Exception):
+    '''поднимается в on_product остановленного обхода: ссылка не отмечается обработанной'''
+    pass
+
+
 class BaseQueue:
     '''Базовый виртуальный класс для очереди на парсинг'''
 
+    canonicalizer = None  # Canonicalizer, приводит id ссылок к каноническому виду
+
+    def canonical(self, link: Link) -> Link:
+        '''приводит ссылку к каноническому виду, если задан canonicalizer'''
+        if self.canonicalizer:
+            return self.canonicalizer.link(link)
+        return link
+
+    def _found(self, link: Link, canonical: Link) -> None:
+        if self.canonicalizer:
+            self.canonicalizer.found(link, canonical)
+
     def reset(self):
         '''Очищает состояние очереди'''
         pass
@@ -71,6 +121,29 @@ class BaseQueue:
         '''выбирает из очереди требуемое количество объектов'''
         pass
 
+    def done(self, links:[Link, List[Link]]) -> None:
+        '''
+        Отмечает выбранные из очереди ссылки как обработанные.
+        Очередь, которая сохраняет состояние, до этого считает их "в работе"
+        и при restore возвращает в очередь.
+        '''
+        pass
+
+    def observe(self, link: Link, result: dict) -> [bool, None]:
+        '''
+        Получает результат разбора товара. Очередь с расписанием повторных посещений
+        (multiparser.revisit) учитывает по нему, как часто меняется товар.
+        False - результат не принят (общая очередь, multiparser.lease), on_product не вызывается
+        '''
+        pass
+
+    def forget(self, link: Link) -> None:
+        '''
+        Результат ссылки не принят (ошибка в on_product): очередь отбрасывает результат,
+        полученный в observe. Ссылка остается "в работе", walk_site_pool повторит ее или вызовет done.
+        '''
+        pass
+
     def save(self):
         pass
 
@@ -89,6 +162,18 @@ class BaseQueue:
 class BaseHistory:
     '''Базовый виртуальный класс для истории парсинга'''
 
+    canonicalizer = None  # Canonicalizer, приводит id ссылок к каноническому виду
+
+    def canonical(self, link: Link) -> Link:
+        '''приводит ссылку к каноническому виду, если задан canonicalizer'''
+        if self.canonicalizer:
+            return self.canonicalizer.link(link)
+        return link
+
+    def _found(self, link: Link, canonical: Link) -> None:
+        if self.canonicalizer:
+            self.canonicalizer.found(link, canonical)
+
     def __init__(self):
         super(BaseHistory).__init__()
 
@@ -124,6 +209,7 @@ class BaseParser():
     PARSED_URL = 'parsed_url'  # URL где был получен ответ
     PARSED_STATUS = 'parsed_status'  # Ответ сервера
     PARSED_PROXY = 'parsed_proxy'  # Ответ сервера
+    PARSED_CACHED = 'parsed_cached'  # страница взята из кеша ответов (set_cache)
     FIELD_URL = 'url'
     FIELD_NAME = 'name'
     FIELD_ARTICUL = 'articul'
@@ -142,6 +228,36 @@ class BaseParser():
     FIELD_SUBCATEGORIES = 'subcategories'  # список подкатегорий для рекуривного обхода
     FIELD_PRODUCTS = 'products' # товары (dict)
 
+    HTML_BUILDER = BUILDER_LXML  # построитель дерева страницы, см. multiparser.markup
+    # нужные парсеру области страниц по типу ссылки: {'C': [Region, ...], 'P': [Region, ...]}
+    # если для типа страницы области заданы, в дерево попадают только они
+    PARSE_REGIONS = {}
+    # описания полей товара (multiparser.extract.Field) для extract_fields
+    PRODUCT_FIELDS = []
+    # параметры Canonicalizer для ссылок сайта, например {'strip_params': ['asb', 'utm_*']}
+    # None - ссылки используются как есть
+    CANONICAL_URL = None
+    # сколько секунд страница типа 'C', 'P', ... из кеша считается свежей и не запрашивается,
+    # по умолчанию 0 - страница всегда проверяется условным запросом. см. set_cache
+    CACHE_TTL = {}
+    # регулярные выражения изменчивых фрагментов страницы товара (токены, счетчики),
+    # которые не учитываются в отпечатке содержимого. см. set_fingerprints
+    FINGERPRINT_STRIP = []
+    WORKERS = 1  # количество потоков в walk_site_pool
+    BATCH = None  # сколько ссылок держать в работе одновременно (по умолчанию WORKERS * 2)
+    # повторы ссылок, не разобранных из-за временной ошибки, см. multiparser.retry
+    RETRY_STATUSES = DEFAULT_STATUSES
+    RETRY_ATTEMPTS = 4  # попыток на ссылку
+    RETRY_BASE_DELAY = 5  # секунд до первого повтора, дальше удваивается
+    RETRY_MAX_DELAY = 300
+    RETRY_HOST_BUDGET = 200  # повторов на хост за обход
+    QUEUE_POLL = 1  # секунд между проверками очереди, когда свободных ссылок нет (multiparser.lease)
+    # ограничение частоты запросов, см. multiparser.ratelimit. None - без ограничения
+    RATE_LIMIT = None  # запросов в секунду к одному хосту
+    RATE_BURST = 1  # сколько запросов подряд можно сделать без ожидания
+    PROXY_RATE_LIMIT = None  # запросов в секунду через один прокси
+    ROBOTS_CRAWL_DELAY = True  # учитывать Crawl-delay и Request-rate из robots.txt, если они строже
+
     def __init__(self, base_url, virtual_display=False, proxy:ProxyData=None):
         super().__init__()
         self._base_url = base_url
@@ -149,6 +265,100 @@ class BaseParser():
         self._history = BaseHistory()
         self._queue = BaseQueue()
         self._proxy = proxy
+        self._cache = None
+        self._fingerprints = None
+        self._fingerprint_local = threading.local()
+        self._canonicalizer = None
+        if self.CANONICAL_URL is not None:
+            self._canonicalizer = Canonicalizer(base_url=base_url, **self.CANONICAL_URL)
+        self._proxy_pool = None
+        self._proxy_rotate = None
+        self._proxy_local = threading.local()
+        self._rate_limiter = None
+        if self.RATE_LIMIT or self.PROXY_RATE_LIMIT:
+            self._rate_limiter = RateLimiter(self.RATE_LIMIT, self.RATE_BURST, self.PROXY_RATE_LIMIT)
+
+    def set_state(self, queue: BaseQueue, history: BaseHistory):
+        '''заменяет очередь и историю парсера, например на сохраняемые (multiparser.sqlite)'''
+        self._queue = queue
+        self._history = history
+        self._queue.canonicalizer = self._canonicalizer
+        self._history.canonicalizer = self._canonicalizer
+
+    def set_cache(self, cache):
+        '''подключает кеш ответов (multiparser.cache.ResponseCache)'''
+        self._cache = cache
+
+    def set_fingerprints(self, store):
+        '''подключает хранилище отпечатков страниц товаров (multiparser.fingerprint.FingerprintStore)'''
+        self._fingerprints = store
+
+    def set_rate_limiter(self, limiter: [RateLimiter, None]):
+        '''
+        заменяет ограничитель частоты запросов. один RateLimiter можно передать
+        нескольким парсерам, тогда ограничение по хостам и прокси у них общее
+        '''
+        self._rate_limiter = limiter
+
+    def rate_limit(self, url: str):
+        '''
+        Вызывается перед каждым запросом: ждет, пока ограничитель разрешит запрос к хосту url.
+        При первом запросе к хосту загружает его robots.txt, остальные потоки
+        ждут, пока ограничение из robots.txt не будет применено
+        '''
+        limiter = self._rate_limiter
+        if not limiter:
+            return
+        host = urlsplit(url).netloc
+        if self.ROBOTS_CRAWL_DELAY and limiter.claim_robots(host):
+            try:
+                self._apply_robots(limiter, url, host)
+            finally:
+                limiter.release_robots(host)
+        limiter.wait(host, self.proxy_string())
+
+    def mozilla_headers(self):
+        return {
+            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
+            'accept-encoding': 'gzip, deflate, br',
+            'accept-language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
+            'cache-control': 'max-age=0',
+            'sec-fetch-dest': 'document',
+            'sec-fetch-mode': 'navigate',
+            'sec-fetch-site': 'none',
+            'upgrade-insecure-requests': '1',
+            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.121 Safari/537.36 OPR/71.0.3770.284',
+        }
+
+    def _apply_robots(self, limiter: RateLimiter, url: str, host: str):
+        '''
+        robots.txt загружается обычным HTTP-запросом с заголовками парсера, а не http_get_text:
+        браузерный парсер вернул бы HTML страницы, а не текст файла
+        '''
+        import requests
+        from .proxy_pool import requests_proxies
+        parts = urlsplit(url)
+        robots_url = '{}://{}/robots.txt'.format(parts.scheme, host)
+        proxy = self.current_proxy()
+        try:
+            headers = dict(self.mozilla_headers(), referer=url)
+            response = requests.get(robots_url, headers=headers,
+                                    proxies=requests_proxies(proxy) if proxy else None,
+                                    timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
+        except Exception as e:
+            logging.warning('failed to get [{}]: {}'.format(robots_url, e))
+            return
+        if response.status_code != 200 or not response.text:
+            return
+        rate = limiter.apply_robots(host, response.text)
+        if rate:
+            logging.info('rate limit for {} is {:.3f} requests/sec'.format(host, rate))
+
+    def cache_key(self, url: str) -> str:
+        '''ключ страницы в кеше - канонический URL'''
+        if self._canonicalizer:
+            return self._canonicalizer.url(url)
+        return url
 
     def base_url(self) -> str:
         '''возвращает корень сайта'''
@@ -202,10 +412,64 @@ class BaseParser():
 
         результат должен содержать все ключи, переданные в параметре fields
 
+        если http_get вернул None, parse_product возвращает None: так же
+        parse_product_cached узнает, что страница не изменилась (page_unchanged)
+
         * виртуальный метод.
         '''
         pass
 
+    def extract_fields(self, soup, fields: set, url: str = None) -> dict:
+        '''
+        Извлекает из страницы товара запрошенные поля, описанные в PRODUCT_FIELDS, за один проход по дереву.
+        Ненайденных полей в результате нет
+        '''
+        return plan_for(self.__class__, self.PRODUCT_FIELDS, fields).extract(soup, url)
+
+    def parse_product_cached(self, link: Link, fields: set) -> [dict, None]:
+        '''
+        Вызывает parse_product, но если подключено хранилище отпечатков и содержимое
+        страницы не изменилось с прошлого разбора, возвращает прошлый результат
+        со свежими PARSED_TIME и PARSED_STATUS, не строя дерево.
+
+        Отпечаток сверяется только для первой загруженной страницы, поэтому
+        товары, собираемые с нескольких страниц, всегда разбираются заново.
+        Если страница не изменилась, make_soup не строит дерево, http_get возвращает
+        None, и parse_product заканчивается как при ошибке загрузки.
+        '''
+        if not self._fingerprints:
+            return self.parse_product(link, fields)
+        from .fingerprint import fields_key
+
+        key = self.cache_key(self.url(link))
+        fields_str = fields_key(fields)
+        stored = self._fingerprints.get(key)
+        if stored and stored.fields != fields_str:
+            stored = None
+        context = {'stored': stored, 'digests': [], 'unchanged': False}
+        self._fingerprint_local.context = context
+        try:
+            result = self.parse_product(link, fields)
+        finally:
+            self._fingerprint_local.context = None
+        if context['unchanged']:
+            self._fingerprints.reused += 1
+            result = dict(stored.result)
+            # поля загрузки обновляются, поля страницы берутся из прошлого результата
+            if self.PARSED_TIME in fields:
+                result[self.PARSED_TIME] = time()
+            if self.PARSED_STATUS in fields:
+                result[self.PARSED_STATUS] = self.result_status()
+            if self.PARSED_CACHED in fields:
+                result[self.PARSED_CACHED] = self.result_cached()
+            if self.PARSED_PROXY in fields:
+                result[self.PARSED_PROXY] = self.proxy_string()
+            return result
+        self._fingerprints.parsed += 1
+        if result and context['digests']:
+            self._fingerprints.put(key, fields_str, ','.join(context['digests']), result)
+        return result
+
     def parse_categories(self, links:[Link, List[Link]], fields: set, product_fields: set = None) -> [dict, None]:
         '''
         Парсит список категорий, собирая список товаров
@@ -246,15 +510,54 @@ class BaseParser():
 
     def http_last_status(self):
         '''
-        Возвращает статус последней страницы
+        Возвращает статус последней страницы.
+        Для ответов из кеша STATUS_CACHE_FRESH или STATUS_CACHE_VALIDATED
 
         * виртуальный метод
         '''
         pass
 
+    def result_status(self) -> int:
+        '''статус последней страницы для результата (PARSED_STATUS): ответ из кеша - 200'''
+        status = self.http_last_status()
+        return 200 if status in CACHE_STATUSES else status
+
+    def result_cached(self) -> bool:
+        '''последняя страница взята из кеша ответов (PARSED_CACHED)'''
+        return self.http_last_status() in CACHE_STATUSES
+
+    def set_proxy_pool(self, pool, rotate: str = ROTATE_SESSION):
+        '''Подключает пул прокси (multiparser.proxy_pool.ProxyPool) вместо постоянного прокси'''
+        self._proxy_pool = pool
+        self._proxy_rotate = rotate
+
+    def current_proxy(self) -> [ProxyData, None]:
+        '''прокси последнего запроса текущего потока'''
+        if self._proxy_pool is not None:
+            return getattr(self._proxy_local, 'proxy', None)
+        return self._proxy
+
+    def next_proxy(self) -> [ProxyData, None]:
+        '''прокси для очередного запроса. из пула - по правилу rotate'''
+        if self._proxy_pool is None:
+            return self._proxy
+        proxy = getattr(self._proxy_local, 'proxy', None)
+        if self._proxy_rotate == ROTATE_REQUEST or proxy is None or not self._proxy_pool.available(proxy):
+            proxy = self._proxy_pool.acquire(exclude=proxy if self._proxy_rotate == ROTATE_REQUEST else None)
+            if proxy is None:
+                raise ParserException('no proxy available')
+            self._proxy_local.proxy = proxy
+        return proxy
+
+    def report_proxy(self, proxy: ProxyData, ok: bool, seconds: float = None):
+        '''сообщает пулу результат запроса через proxy'''
+        if self._proxy_pool is not None and proxy is not None:
+            self._proxy_pool.report(proxy, ok, seconds)
+
     def proxy_string(self):
-        if self._proxy:
-            return format_proxy(self._proxy)
+        proxy = self.current_proxy()
+        if proxy:
+            return format_proxy(proxy)
         return None
 
     def walk_site(self, reset=False):
@@ -282,6 +585,215 @@ class BaseParser():
         #     parsed = self.parse_categories(self.queue_pop_categories(), categories_fields, products_fields)
         pass
 
+    def walk_site_pool(self, categories_fields: set, categories_products_fields: set, products_fields: set,
+                       reset=False, workers: int = None, batch: int = None, on_product=None,
+                       stop: threading.Event = None):
+        '''
+        Обход сайта пулом потоков.
+
+        Ссылки выбираются из очереди пачками, сначала категории ('C'), затем товары ('P'),
+        и разбираются в workers потоках. Каждый поток открывает свою сессию (start_session).
+        С очередью и историей работает только вызывающий поток, поэтому они не обязаны
+        быть потокобезопасными.
+
+        * on_product -- вызывается в вызывающем потоке для каждого разобранного товара: on_product(link, result)
+        * stop -- если событие установлено, новые ссылки не выбираются, начатые дорабатываются
+
+        Возвращает ссылки, от которых пришлось отказаться после повторов (multiparser.retry.Failure)
+        '''
+        workers = workers or self.WORKERS
+        batch = batch or self.BATCH or workers * 2
+        self.set_workers(workers)
+
+        if reset:
+            self._queue.reset()
+            self._history.reset()
+            self.build_initial_list()
+        else:
+            self.restore()
+
+        def parse_category(link):
+            return self.parse_categories([link], categories_fields, categories_products_fields)
+
+        def parse_product(link):
+            return self.parse_products([link], products_fields)
+
+        def product_result(link, result):
+            if self._queue.observe(link, result) is False:
+                return  # результат уже принят от другого узла (multiparser.lease)
+            if on_product:
+                on_product(link, result)
+
+        retries = RetryQueue(self.RETRY_STATUSES, self.RETRY_ATTEMPTS, self.RETRY_BASE_DELAY,
+                             self.RETRY_MAX_DELAY, self.RETRY_HOST_BUDGET)
+        stop = stop or threading.Event()
+        if workers <= 1:
+            self._walk_links('C', parse_category, self._walk_category_result, None, batch, retries, stop)
+            self._walk_links('P', parse_product, product_result, None, batch, retries, stop)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, initializer=self.start_session) as executor:
+                self._walk_links('C', parse_category, self._walk_category_result, executor, batch, retries, stop)
+                self._walk_links('P', parse_product, product_result, executor, batch, retries, stop)
+
+        logging.info(str(retries))
+        if self._canonicalizer:
+            logging.info(str(self._canonicalizer))
+        if self._rate_limiter:
+            logging.info(str(self._rate_limiter))
+        return retries.failed
+
+    def iter_products(self, categories_fields: set, categories_products_fields: set, products_fields: set,
+                      reset=False, workers: int = None, batch: int = None, buffer: int = 100):
+        '''
+        Обход как в walk_site_pool, но результаты товаров возвращаются по мере разбора:
+
+            for link, result in parser.iter_products(...):
+
+        Обход идет в отдельном потоке и приостанавливается, если в буфере buffer
+        необработанных результатов. Если цикл прерван, обход останавливается:
+        начатые ссылки дорабатываются, остальные остаются в очереди
+        '''
+        items = queue.Queue(maxsize=buffer)
+        stop = threading.Event()
+        finished = object()
+        errors = []
+
+        def on_product(link, result):
+            while not stop.is_set():
+                try:
+                    items.put((link, result), timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+            raise WalkStopped()
+
+        def run():
+            try:
+                self.start_session()
+                self.walk_site_pool(categories_fields, categories_products_fields, products_fields, reset=reset,
+                                    workers=workers, batch=batch, on_product=on_product, stop=stop)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                items.put(finished)
+
+        walker = threading.Thread(target=run, name='walk_site_pool', daemon=True)
+        walker.start()
+        try:
+            while True:
+                item = items.get()
+                if item is finished:
+                    break
+                yield item
+        finally:
+            stop.set()
+            while walker.is_alive():
+                try:
+                    items.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+            walker.join()
+        if errors:
+            raise errors[0]
+
+    def stream_products(self, sinks: list, categories_fields: set, categories_products_fields: set,
+                        products_fields: set, reset=False, workers: int = None, batch: int = None,
+                        buffer: int = 100, stop: threading.Event = None) -> list:
+        '''
+        Обход, результаты которого записываются в приемники (multiparser.sinks) в отдельном потоке
+        по мере разбора. stop - как в walk_site_pool. Возвращает то же, что walk_site_pool
+        '''
+        from .sinks import SinkWriter
+        with SinkWriter(sinks, buffer) as writer:
+            return self.walk_site_pool(categories_fields, categories_products_fields, products_fields, reset=reset,
+                                       workers=workers, batch=batch, on_product=writer.put, stop=stop)
+
+    def _walk_links(self, typ, task, on_result, executor, batch, retries, stop):
+        '''
+        Выбирает из очереди ссылки типа typ, пока они есть, и передает результаты в on_result.
+        Ссылки с временной ошибкой откладываются в retries и остаются в очереди "в работе",
+        этап заканчивается, когда отложенных ссылок не осталось
+        '''
+        pending = dict()
+        while pending or not stop.is_set() and (self._queue.has(typ=typ) or retries.waiting(typ)):
+            links = [] if stop.is_set() else retries.due(typ, batch - len(pending))
+            if len(pending) + len(links) < batch and not stop.is_set() and self._queue.has(typ=typ):
+                popped = self._queue.pop(typ=typ, cnt=batch - len(pending) - len(links))
+                self._history.put(popped)
+                links += popped
+            for link in links:
+                if executor:
+                    pending[executor.submit(self._walk_task, task, link)] = link
+                else:
+                    self._walk_done(link, self._walk_task(task, link), on_result, retries)
+            if not pending:
+                if not links:
+                    # ждем повтора или, в общей очереди, ссылок, которые сейчас у других узлов
+                    wait_time = retries.wait_time(typ)
+                    stop.wait(self.QUEUE_POLL if wait_time is None else min(wait_time, self.QUEUE_POLL))
+                continue
+            if links and len(pending) < batch and not stop.is_set() and self._queue.has(typ=typ):
+                continue
+            done, _ = wait(pending, timeout=retries.wait_time(typ), return_when=FIRST_COMPLETED)
+            for future in done:
+                link = pending.pop(future)
+                self._walk_done(link, future.result(), on_result, retries)
+
+    def _walk_task(self, task, link):
+        '''
+        выполняется в воркере: возвращает результат и статус последней загрузки этого потока.
+        непредвиденное исключение считается ошибкой соединения (599), статус прошлой загрузки не берется
+        '''
+        try:
+            result = task(link)
+        except Exception as e:
+            logging.exception('failed to parse {}: {}'.format(link, e))
+            return None, 599
+        return result, self.http_last_status()
+
+    def _walk_done(self, link, outcome, on_result, retries):
+        result, status = outcome
+        if not result and retries.defer(link, status, self._walk_url(link)):
+            return
+        try:
+            self._walk_result(link, result, on_result)
+        except WalkStopped:
+            return  # результат не принят, ссылка остается "в работе" и вернется в очередь при restore
+        except Exception as e:
+            # результат не принят: он не сохраняется (forget), ссылка повторяется как при ошибке соединения.
+            # когда попытки исчерпаны, ссылка попадает в retries.failed и удаляется из очереди без результата
+            logging.exception('failed to parse {}: {}'.format(link, e))
+            self._queue.forget(link)
+            if retries.defer(link, 599, self._walk_url(link)):
+                return
+            self._queue.done(link)
+            return
+        if result:
+            retries.succeeded(link)
+        self._queue.done(link)
+
+    def _walk_url(self, link) -> [str, None]:
+        try:
+            return self.url(link)
+        except Exception:
+            return None
+
+    def _walk_result(self, link, result, on_result):
+        if not result or not on_result:
+            return
+        for parsed_link in result:
+            on_result(parsed_link, result[parsed_link])
+
+    def _walk_category_result(self, link: Link, result: dict):
+        '''ставит в очередь найденные на странице категории товары и страницы'''
+        if type(result) != dict:
+            return
+        links = [Link(type='P', id=url) for url in result.get(self.FIELD_PRODUCTS, ())]
+        links += [Link(type='C', id=url) for url in result.get(self.FIELD_PAGES, ())]
+        links = [x for x in links if x not in self._history and x not in self._queue]
+        if links:
+            self._queue.put(links)
+
     def save(self):
         self._history.save()
         self._queue.save()
@@ -293,27 +805,79 @@ class BaseParser():
     def start_session(self):
         pass
 
+    def set_workers(self, workers: int):
+        '''
+        вызывается в walk_site_pool до запуска потоков: парсер готовит ресурсы на workers потоков
+
+        * виртуальный метод.
+        '''
+        pass
+
     def sleep(self, x):
         sleep(x)
 
-    def http_get(self, url, referrer, encoding=None)->[BeautifulSoup, None]:
+    def http_get(self, url, referrer, encoding=None, builder=None, typ=None)->[BeautifulSoup, None]:
+        pass
+
+    def http_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
         pass
 
+    def http_get_links(self, url, referrer, typ, encoding=None) -> [dict, None]:
+        '''
+        Дешевый режим для страниц категорий и пагинации: дерево не строится,
+        возвращаются только ссылки из областей PARSE_REGIONS[typ] в виде
+        {region.key: [href, href, ...], ...}
+        '''
+        text = self.http_get_text(url, referrer, encoding, typ)
+        if text is None:
+            return None
+        return extract_links(text, self.PARSE_REGIONS.get(typ, []))
+
+    def make_soup(self, text, url=None, builder=None, typ=None) -> [BeautifulSoup, None]:
+        '''
+        Строит дерево страницы построителем builder, по умолчанию HTML_BUILDER класса.
+        Если для типа страницы typ заданы PARSE_REGIONS, в дерево попадают только эти области.
+        Если страница не разобралась, она разбирается html5lib.
+        '''
+        regions = self.PARSE_REGIONS.get(typ)
+        if regions:
+            fragment = extract_regions(text, regions)
+            if fragment is not None:
+                text = fragment
+            else:
+                logging.warning('regions for type {} not found at [{}]'.format(typ, url))
+        if self._check_fingerprint(text):
+            return None
+        return make_soup(text, builder or self.HTML_BUILDER, url)
+
+    def _check_fingerprint(self, text) -> bool:
+        '''внутри parse_product_cached: считает отпечаток, True - страница не изменилась и дерево не нужно'''
+        context = getattr(self._fingerprint_local, 'context', None)
+        if context is None:
+            return False
+        from .fingerprint import fingerprint
+
+        digest = fingerprint(text, self.FINGERPRINT_STRIP)
+        context['digests'].append(digest)
+        if context['stored'] and len(context['digests']) == 1 and context['stored'].digest == digest:
+            context['unchanged'] = True
+        return context['unchanged']
+
+    def page_unchanged(self) -> bool:
+        '''внутри parse_product_cached: make_soup не построил дерево, потому что страница не изменилась'''
+        context = getattr(self._fingerprint_local, 'context', None)
+        return bool(context and context['unchanged'])
+
     def get_ip(self):
-        url = 'https://solotony.com/tools/proxy-checker/'
+        url = settings.PROXY_CHECKER_URL
         soup = self.http_get(url, url)
         if not soup:
             logging.error('failed to get url=[{}]'.format(url))
             return None
-        tag = soup.find('h1', attrs={'id': 'ip'})
-        if not tag:
-            logging.error('failed to detect h1.id=ip at url=[{}]'.format(url))
-            return None
-
-        text = tag.get_text(strip=True)
-        if not re_ip.match(text):
-            logging.error('bad IP value {} at url=[{}]'.format(text, url))
+        text = find_checker_ip(soup)
+        if not text:
+            logging.error('failed to detect IP in h1.id=ip at url=[{}]'.format(url))
             return None
 
         logging.info('IP detected={} ({})'.format(text, self.__class__))
-        return text
\ No newline at end of file
+        return text
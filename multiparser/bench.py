@@ -0,0 +1,139 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+замеры скорости разбора на сохраненных страницах.
+
+    python -m multiparser.bench builders <каталог с .html> [-n повторов] [-b lxml,html5lib,...]
+    python -m multiparser.bench fields <каталог с .html> -p multiparser.parsers.duim24_ru.ParserDuim24Ru [-f name,price]
+
+каждый построитель замеряется в отдельном процессе, чтобы пиковый RSS
+одного не влиял на замер другого. fields сравнивает извлечение полей товара
+по PRODUCT_FIELDS за один проход (Plan.extract) с поиском find на каждое поле
+(Plan.extract_find) на уже построенных деревьях и проверяет, что результаты совпадают.
+'''
+
+from multiprocessing import get_context
+from importlib import import_module
+from time import perf_counter
+import argparse
+import logging
+import os
+import resource
+
+from .extract import Plan
+from .markup import make_soup, BUILDER_LXML, BUILDER_HTML_PARSER, BUILDER_HTML5LIB, BUILDER_LEXBOR
+
+BUILDERS = [BUILDER_HTML5LIB, BUILDER_HTML_PARSER, BUILDER_LXML, BUILDER_LEXBOR]
+
+
+def load_pages(path: str) -> list:
+    '''читает все .html файлы каталога (или один файл)'''
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(('.html', '.htm')))
+    pages = []
+    for name in files:
+        with open(name, encoding='utf-8', errors='replace') as f:
+            pages.append(f.read())
+    return pages
+
+
+def peak_rss_mb() -> float:
+    '''пиковый RSS текущего процесса, Мб (ru_maxrss в Linux в килобайтах)'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bench_builder(builder, path, repeat, queue):
+    pages = load_pages(path)
+    rss_before = peak_rss_mb()
+    started = perf_counter()
+    for _ in range(repeat):
+        for text in pages:
+            soup = make_soup(text, builder, fallback=None)
+            # деревья lexbor ленивые, поэтому для честного сравнения по дереву делается один поиск
+            if soup is not None:
+                soup.find('h1')
+    elapsed = perf_counter() - started
+    queue.put((builder, len(pages) * repeat / elapsed, peak_rss_mb(), peak_rss_mb() - rss_before))
+
+
+def bench_builders(path: str, builders: list = None, repeat: int = 3) -> list:
+    '''возвращает список (построитель, страниц/сек, пиковый RSS Мб, прирост RSS Мб)'''
+    ctx = get_context('spawn')
+    results = []
+    for builder in builders or BUILDERS:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_bench_builder, args=(builder, path, repeat, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+def load_class(path: str):
+    '''класс парсера по полному имени: multiparser.parsers.duim24_ru.ParserDuim24Ru'''
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+def bench_fields(path: str, specs: list, fields: set = None, builder: str = BUILDER_LXML, repeat: int = 3) -> dict:
+    '''
+    возвращает {'find': страниц/сек, 'plan': страниц/сек, 'mismatches': страниц с разными результатами}.
+    fields по умолчанию - все поля specs
+    '''
+    plan = Plan.compile(specs, fields or {x.key for x in specs})
+    soups = [soup for soup in (make_soup(text, builder) for text in load_pages(path)) if soup is not None]
+    logging.disable(logging.CRITICAL)  # ненайденные поля не выводятся
+    try:
+        mismatches = sum(1 for soup in soups if plan.extract(soup) != plan.extract_find(soup))
+        result = {'mismatches': mismatches}
+        for name, extract in (('find', plan.extract_find), ('plan', plan.extract)):
+            started = perf_counter()
+            for _ in range(repeat):
+                for soup in soups:
+                    extract(soup)
+            result[name] = len(soups) * repeat / (perf_counter() - started)
+    finally:
+        logging.disable(logging.NOTSET)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m multiparser.bench')
+    commands = parser.add_subparsers(dest='command', required=True)
+    builders = commands.add_parser('builders', help='сравнение построителей дерева')
+    builders.add_argument('path')
+    builders.add_argument('-n', '--repeat', type=int, default=3)
+    builders.add_argument('-b', '--builders', default=','.join(BUILDERS))
+    fields = commands.add_parser('fields', help='извлечение полей товара: один проход против find на поле')
+    fields.add_argument('path')
+    fields.add_argument('-p', '--parser', required=True, help='класс парсера с PRODUCT_FIELDS')
+    fields.add_argument('-f', '--fields', help='поля через запятую, по умолчанию все')
+    fields.add_argument('-n', '--repeat', type=int, default=3)
+    fields.add_argument('-b', '--builder', default=BUILDER_LXML)
+    args = parser.parse_args()
+
+    if args.command == 'builders':
+        print('{:<12} {:>12} {:>14} {:>14}'.format('builder', 'pages/sec', 'peak RSS, Mb', 'RSS delta, Mb'))
+        for builder, speed, rss, delta in bench_builders(args.path, args.builders.split(','), args.repeat):
+            print('{:<12} {:>12.1f} {:>14.1f} {:>14.1f}'.format(builder, speed, rss, delta))
+
+    if args.command == 'fields':
+        specs = load_class(args.parser).PRODUCT_FIELDS
+        wanted = set(args.fields.split(',')) if args.fields else None
+        result = bench_fields(args.path, specs, wanted, args.builder, args.repeat)
+        print('{:<12} {:>12}'.format('method', 'pages/sec'))
+        print('{:<12} {:>12.1f}'.format('find', result['find']))
+        print('{:<12} {:>12.1f}'.format('plan', result['plan']))
+        print('speedup {:.2f}x, mismatches {}'.format(result['plan'] / result['find'], result['mismatches']))
+
+
+if __name__ == '__main__':
+    main()
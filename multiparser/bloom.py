@@ -0,0 +1,118 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+история парсинга на фильтре Блума.
+
+занимает фиксированный объем памяти независимо от длины ссылок. ссылки не хранятся,
+поэтому с вероятностью error_rate непосещенная ссылка считается посещенной
+(и пропускается). посещенная ссылка никогда не считается непосещенной.
+'''
+
+from hashlib import blake2b
+from math import ceil, exp, log
+from typing import List
+import logging
+import os
+
+from .base import Link, BaseHistory
+
+
+class BloomHistory(BaseHistory):
+    '''
+    История парсинга на фильтре Блума.
+
+    * capacity -- ожидаемое количество ссылок
+    * error_rate -- допустимая доля ложных срабатываний при capacity ссылок
+    * max_bytes -- бюджет памяти. если задан, размер фильтра равен max_bytes,
+      а error_rate определяет только количество хеш-функций
+    * path -- файл для save/restore
+    '''
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.001, max_bytes: int = None, path: str = None):
+        super(BloomHistory).__init__()
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        if max_bytes:
+            self._bits = max_bytes * 8
+            self._hashes = max(1, round(-log(error_rate, 2)))
+        else:
+            self._bits = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+            self._hashes = max(1, round(self._bits / capacity * log(2)))
+        self._bits = (self._bits + 7) // 8 * 8
+        self._path = path
+        self._array = bytearray(self._bits // 8)
+        self._count = 0
+
+    def _positions(self, link: Link):
+        digest = blake2b('{}\0{}'.format(link.type, link.id).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def reset(self):
+        '''сбрасывает историю парсинга'''
+        self._array = bytearray(self._bits // 8)
+        self._count = 0
+
+    def put(self, links:[Link, List[Link]]) -> None:
+        '''добавляет в историю'''
+        if type(links) != list:
+            links = [links]
+        for link in links:
+            added = False
+            for position in self._positions(self.canonical(link)):
+                byte, bit = position >> 3, 1 << (position & 7)
+                if not self._array[byte] & bit:
+                    self._array[byte] |= bit
+                    added = True
+            if added:
+                self._count += 1
+
+    def contains(self, link: Link) -> bool:
+        '''проверяет наличие в истории, возможны ложные срабатывания'''
+        canonical = self.canonical(link)
+        for position in self._positions(canonical):
+            if not self._array[position >> 3] & (1 << (position & 7)):
+                return False
+        self._found(link, canonical)
+        return True
+
+    def memory_usage(self) -> int:
+        '''размер фильтра в байтах'''
+        return len(self._array)
+
+    def error_rate(self) -> float:
+        '''оценка текущей доли ложных срабатываний'''
+        return (1 - exp(-self._hashes * self._count / self._bits)) ** self._hashes
+
+    def save(self):
+        if not self._path:
+            return
+        with open(self._path + '.tmp', 'wb') as f:
+            f.write(self._bits.to_bytes(8, 'little'))
+            f.write(self._hashes.to_bytes(2, 'little'))
+            f.write(self._count.to_bytes(8, 'little'))
+            f.write(self._array)
+        os.replace(self._path + '.tmp', self._path)
+
+    def restore(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        with open(self._path, 'rb') as f:
+            bits = int.from_bytes(f.read(8), 'little')
+            hashes = int.from_bytes(f.read(2), 'little')
+            if bits != self._bits or hashes != self._hashes:
+                logging.error('bloom filter {} has other size, not restored'.format(self._path))
+                return
+            self._count = int.from_bytes(f.read(8), 'little')
+            self._array = bytearray(f.read())
+
+    def __str__(self):
+        return 'History: ~{} items, {} bytes, error rate {:.2e}'.format(self._count, self.memory_usage(),
+                                                                          self.error_rate())
@@ -0,0 +1,146 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+пул долгоживущих драйверов Firefox.
+
+запуск Firefox/geckodriver и прогрев главной страницы сайта - самая дорогая и
+ненадежная часть работы SeleniumParser. пул держит запущенные драйверы между
+обходами в одном процессе, по ключу парсера (прокси и стратегия загрузки).
+парсер берет драйвер в __enter__ и возвращает в __exit__. драйвер закрывается
+после max_pages страниц или max_errors ошибок, на его место создается новый.
+
+    with BrowserPool(max_pages=300) as pool:
+        pool.warm(ParserOzonRu(pool=pool), count=2)
+        for shop in shops:
+            with ParserOzonRu(pool=pool) as parser:
+                parser.walk_site()
+'''
+
+from time import time
+import logging
+import threading
+
+
+class Lease:
+    '''драйвер пула и его счетчики'''
+
+    def __init__(self, key, driver):
+        self.key = key
+        self.driver = driver
+        self.created = time()
+        self.pages = 0
+        self.errors = 0
+        self.warmed = set()  # сайты, главная страница которых уже открыта
+
+
+class BrowserPool:
+    '''
+    Пул драйверов, потокобезопасный.
+
+    * max_pages -- после скольких страниц драйвер пересоздается
+    * max_errors -- после скольких ошибок загрузки драйвер пересоздается
+    * max_idle -- сколько свободных драйверов держать на один ключ
+    * virtual_display -- запустить виртуальный дисплей для всех драйверов пула
+    '''
+
+    def __init__(self, max_pages: int = 500, max_errors: int = 3, max_idle: int = 4, virtual_display=False):
+        self._max_pages = max_pages
+        self._max_errors = max_errors
+        self._max_idle = max_idle
+        self._idle = dict()
+        self._lock = threading.Lock()
+        self._display = None
+        if virtual_display:
+            from pyvirtualdisplay import Display
+            self._display = Display(visible=0, size=(1920, 1080))
+            self._display.start()
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+
+    def expired(self, lease: Lease) -> bool:
+        return lease.pages >= self._max_pages or lease.errors >= self._max_errors
+
+    def lease(self, parser) -> Lease:
+        '''выдает свободный драйвер для parser (SeleniumParser) или создает новый'''
+        key = parser.browser_key()
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+        logging.info('start browser for {}'.format(key))
+        return Lease(key, parser.create_driver())
+
+    def release(self, lease: Lease, broken: bool = False) -> None:
+        '''возвращает драйвер в пул. отработавший свой срок или сломанный драйвер закрывается'''
+        if not broken and not self.expired(lease):
+            with self._lock:
+                idle = self._idle.setdefault(lease.key, [])
+                if len(idle) < self._max_idle:
+                    idle.append(lease)
+                    return
+        else:
+            with self._lock:
+                self.recycled += 1
+            logging.info('recycle browser for {} after {} pages, {} errors'.format(lease.key, lease.pages, lease.errors))
+        self._quit(lease)
+
+    def warm(self, parser, count: int = 1) -> None:
+        '''
+        Заранее запускает count драйверов для parser и открывает в них главную страницу сайта.
+        Драйверы, которые не удалось прогреть, закрываются
+        '''
+        leases = []
+        for _ in range(count):
+            lease = self.lease(parser)
+            leases.append(lease)
+            parser._lease = lease
+            parser._driver = lease.driver
+            try:
+                parser.warm_up()
+            except Exception as e:
+                logging.error('failed to warm browser for {}: {}'.format(lease.key, e))
+                lease.errors = self._max_errors
+        parser._lease = None
+        parser._driver = None
+        for lease in leases:
+            self.release(lease)
+
+    def _quit(self, lease: Lease):
+        try:
+            lease.driver.quit()
+        except Exception as e:
+            logging.error('failed to quit browser for {}: {}'.format(lease.key, e))
+
+    def close(self):
+        '''закрывает все свободные драйверы и виртуальный дисплей'''
+        with self._lock:
+            leases = [x for idle in self._idle.values() for x in idle]
+            self._idle = dict()
+        for lease in leases:
+            self._quit(lease)
+        if self._display:
+            self._display.stop()
+            self._display = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(x) for x in self._idle.values())
+        return {'created': self.created, 'reused': self.reused, 'recycled': self.recycled, 'idle': idle}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __str__(self):
+        return 'BrowserPool: ' + str(self.stats())
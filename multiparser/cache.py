@@ -0,0 +1,88 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+кеш ответов на диске для условных запросов.
+
+для каждой страницы (по каноническому URL) хранятся ETag, Last-Modified, время
+загрузки и текст. парсер отправляет If-None-Match/If-Modified-Since и на ответ 304
+берет текст из кеша, а в пределах CACHE_TTL для типа страницы не делает запрос вовсе.
+
+    parser.set_cache(ResponseCache('state/cache.sqlite3'))
+'''
+
+from collections import namedtuple
+from time import time
+import threading
+import zlib
+
+from .sqlite import SqliteDatabase
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS response (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    body BLOB NOT NULL
+);
+'''
+
+CacheEntry = namedtuple('CacheEntry', 'url etag last_modified fetched_at text')
+
+
+class ResponseCache:
+    '''Кеш ответов в файле SQLite, тексты хранятся сжатыми'''
+
+    def __init__(self, path: str):
+        self._db = SqliteDatabase(path, SCHEMA)
+        self._lock = threading.Lock()  # счетчики обновляются из потоков walk_site_pool
+        self.hits = 0
+        self.validated = 0
+        self.misses = 0
+
+    def hit(self) -> None:
+        '''страница взята из кеша без запроса'''
+        with self._lock:
+            self.hits += 1
+
+    def miss(self) -> None:
+        '''страница загружена заново'''
+        with self._lock:
+            self.misses += 1
+
+    def get(self, url: str) -> [CacheEntry, None]:
+        rows = self._db.execute('SELECT url, etag, last_modified, fetched_at, body FROM response WHERE url = ?', (url,))
+        if not rows:
+            return None
+        url, etag, last_modified, fetched_at, body = rows[0]
+        return CacheEntry(url, etag, last_modified, fetched_at, zlib.decompress(body).decode('utf-8'))
+
+    def put(self, url: str, text: str, etag: str = None, last_modified: str = None) -> None:
+        body = zlib.compress(text.encode('utf-8'), 6)
+        with self._db.transaction() as c:
+            c.execute('INSERT OR REPLACE INTO response (url, etag, last_modified, fetched_at, body) '
+                      'VALUES (?, ?, ?, ?, ?)', (url, etag, last_modified, time(), body))
+
+    def touch(self, url: str) -> None:
+        '''отмечает, что страница подтверждена сервером (ответ 304)'''
+        with self._db.transaction() as c:
+            c.execute('UPDATE response SET fetched_at = ? WHERE url = ?', (time(), url))
+        with self._lock:
+            self.validated += 1
+
+    def delete(self, url: str) -> None:
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM response WHERE url = ?', (url,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'validated': self.validated, 'misses': self.misses}
+
+    def __str__(self):
+        return 'ResponseCache: {hits} hits, {validated} validated (304), {misses} misses'.format(**self.stats())
@@ -0,0 +1,117 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+приведение ссылок к каноническому виду.
+
+одна и та же страница встречается как относительная ссылка, полный URL, со слешем
+в конце и без, с параметрами отслеживания (?asb=... у ozon, utm_*). очередь и история
+приводят id ссылок к одному виду, чтобы страница загружалась один раз.
+'''
+
+from fnmatch import fnmatchcase
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import re
+
+# только параметры отслеживания. параметры сайта (from, ref и т.д.) могут задавать страницу
+# или фильтр, их сайтовый парсер добавляет в CANONICAL_URL
+DEFAULT_STRIP_PARAMS = ('utm_*', 'gclid', 'yclid', 'fbclid', '_openstat')
+DEFAULT_TYPES = ('C', 'G', 'M', 'P')
+
+TRAILING_SLASH_KEEP = None
+TRAILING_SLASH_STRIP = 'strip'
+TRAILING_SLASH_ADD = 'add'
+
+re_slashes = re.compile('/{2,}')
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+class Canonicalizer:
+    '''
+    Настраиваемое приведение URL.
+
+    * base_url -- относительные ссылки разрешаются от него
+    * strip_params -- удаляемые параметры запроса, допускаются шаблоны ('utm_*')
+    * keep_params -- если задан, остаются только эти параметры
+    * sort_params -- сортировать параметры запроса
+    * lowercase_path -- приводить путь к нижнему регистру (для сайтов, где регистр не важен)
+    * trailing_slash -- None (не менять), 'strip' (убирать), 'add' (добавлять к путям без расширения)
+    * types -- типы ссылок, id которых являются URL
+
+    Считает, сколько ссылок переписано (rewritten) и сколько раз ссылка нашлась
+    в очереди или истории по каноническому виду, хотя записана иначе, чем при
+    первой встрече страницы (saved) - это загрузки, которых удалось избежать.
+    Повтор той же относительной ссылки нашелся бы и без приведения и не считается.
+    '''
+
+    def __init__(self, base_url: str = None, strip_params=DEFAULT_STRIP_PARAMS, keep_params=None,
+                 sort_params=True, lowercase_path=False, trailing_slash=TRAILING_SLASH_KEEP, types=DEFAULT_TYPES):
+        self._base_url = base_url
+        self._strip_params = tuple(strip_params or ())
+        self._keep_params = tuple(keep_params) if keep_params is not None else None
+        self._sort_params = sort_params
+        self._lowercase_path = lowercase_path
+        self._trailing_slash = trailing_slash
+        self._types = set(types)
+        self.rewritten = 0
+        self.saved = 0
+        self._first = dict()  # канонический id: id, под которым страница встретилась впервые
+
+    def _keep(self, param: str) -> bool:
+        name = param.split('=', 1)[0]
+        if not name:
+            return False
+        if self._keep_params is not None:
+            return any(fnmatchcase(name, x) for x in self._keep_params)
+        return not any(fnmatchcase(name, x) for x in self._strip_params)
+
+    def url(self, url: str) -> str:
+        '''возвращает канонический вид URL'''
+        url = url.strip()
+        if self._base_url:
+            url = urljoin(self._base_url, url)
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        if scheme in DEFAULT_PORTS and netloc.endswith(DEFAULT_PORTS[scheme]):
+            netloc = netloc[:-len(DEFAULT_PORTS[scheme])]
+        path = re_slashes.sub('/', parts.path) or '/'
+        if self._lowercase_path:
+            path = path.lower()
+        if self._trailing_slash == TRAILING_SLASH_STRIP and path != '/':
+            path = path.rstrip('/')
+        elif self._trailing_slash == TRAILING_SLASH_ADD and not path.endswith('/') \
+                and '.' not in path.rsplit('/', 1)[-1]:
+            path += '/'
+        # параметры не декодируются и не кодируются заново, чтобы не изменить их значения
+        params = [x for x in parts.query.split('&') if self._keep(x)]
+        if self._sort_params:
+            params.sort()
+        return urlunsplit((scheme, netloc, path, '&'.join(params), ''))
+
+    def link(self, link):
+        '''возвращает ссылку с каноническим id'''
+        if link.type not in self._types or type(link.id) != str:
+            return link
+        canonical = self.url(link.id)
+        self._first.setdefault((link.type, canonical), link.id)
+        if canonical == link.id:
+            return link
+        self.rewritten += 1
+        return link._replace(id=canonical)
+
+    def found(self, link, canonical) -> None:
+        '''отмечает, что ссылка нашлась в очереди или истории по каноническому виду'''
+        if self._first.get((canonical.type, canonical.id), link.id) != link.id:
+            self.saved += 1
+
+    def stats(self) -> dict:
+        return {'rewritten': self.rewritten, 'saved': self.saved}
+
+    def __str__(self):
+        return 'Canonicalizer: {} rewritten, {} fetches saved'.format(self.rewritten, self.saved)
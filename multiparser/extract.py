@@ -0,0 +1,177 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+извлечение полей по описанию.
+
+парсер перечисляет поля товара в PRODUCT_FIELDS: тег и атрибуты как в
+BeautifulSoup.find, откуда взять значение (текст или атрибут) и обработку.
+для набора запрошенных полей описание один раз на класс превращается в план
+(Plan): для каждого имени тега - список ожидаемых полей. plan.extract проходит
+дерево один раз и останавливается, когда все поля найдены, вместо отдельного
+soup.find на каждое поле. plan.extract_find делает то же через find - для
+деревьев без обхода (lexbor) и для сравнения в multiparser.bench.
+
+    PRODUCT_FIELDS = [
+        Field('name', 'h1', {'itemprop': 'name'}, process=[clean_text]),
+        Field('tobasket', 'div', {'class': 'popup-tobasket'}),
+        Field('price', 'span', {'itemprop': 'price'}, attr='content', process=[parse_price], requires='tobasket'),
+    ]
+    result.update(self.extract_fields(soup, fields, url))
+'''
+
+from collections import namedtuple
+import logging
+import re
+
+from bs4 import Tag
+
+re_price = re.compile('[^0-9,.]')
+
+#  тип 'Field' - описание поля
+#  key - имя поля в результате
+#  name, attrs - тег и атрибуты как в BeautifulSoup.find ({'class': 'popup-tobasket'})
+#  attr - значение берется из атрибута тега, None - текст тега
+#  process - функции, которые по очереди применяются к значению. ValueError - значение None
+#  requires - поле ищется только если найдено поле requires (которое при этом может быть не запрошено)
+#  label - как поле называется в сообщении об ошибке, по умолчанию строится из name и attrs
+Field = namedtuple('Field', 'key name attrs attr process requires label', defaults=(None, None, (), None, None))
+
+
+def clean_text(value: str) -> str:
+    '''текст без крайних пробелов, ';' заменяется на '.', как в выгрузке CSV'''
+    return value.strip().replace(';', '.')
+
+
+def parse_price(value: str) -> float:
+    '''цена "1 200,50 руб." -> 1200.5'''
+    return float(re_price.sub('', value.strip()).replace(',', '.'))
+
+
+def _label(field: Field) -> str:
+    values = [v for v in (field.attrs or {}).values() if v is not True]
+    return '{}.{}'.format(field.name, values[0]) if values else field.name
+
+
+def _matcher(attrs: dict):
+    '''проверка атрибутов тега, как в BeautifulSoup.find: class совпадает с одним из классов или со всеми сразу'''
+    attrs = list((attrs or {}).items())
+
+    def match(tag: Tag) -> bool:
+        for key, value in attrs:
+            actual = tag.attrs.get(key)
+            if actual is None:
+                return False
+            if value is True:
+                continue
+            if isinstance(actual, list):
+                if value not in actual and value != ' '.join(actual):
+                    return False
+            elif actual != value:
+                return False
+        return True
+    return match
+
+
+class Plan:
+    '''
+    План извлечения набора полей.
+
+    * fields -- описания (Field) всех полей, которые нужно найти, включая поля из requires
+    * wanted -- имена полей, которые попадают в результат
+    '''
+
+    def __init__(self, fields: list, wanted: set):
+        self.fields = fields
+        self.wanted = wanted
+        self._by_name = dict()
+        for index, field in enumerate(fields):
+            self._by_name.setdefault(field.name, []).append((index, field, _matcher(field.attrs)))
+
+    @classmethod
+    def compile(cls, specs: list, wanted: set) -> 'Plan':
+        '''выбирает из specs запрошенные поля и поля, от которых они зависят'''
+        by_key = {x.key: x for x in specs}
+        keys = set()
+        todo = [x for x in wanted if x in by_key]
+        while todo:
+            key = todo.pop()
+            if key in keys:
+                continue
+            keys.add(key)
+            requires = by_key[key].requires
+            if requires:
+                if requires not in by_key:
+                    raise ValueError('field {} requires unknown field {}'.format(key, requires))
+                todo.append(requires)
+        return cls([x for x in specs if x.key in keys], set(wanted) & keys)
+
+    def extract(self, soup, url: str = None) -> dict:
+        '''все поля за один проход по дереву'''
+        if not isinstance(soup, Tag):
+            return self.extract_find(soup, url)
+        found = dict()
+        waiting = {name: list(items) for name, items in self._by_name.items()}
+        left = len(self.fields)
+        for tag in soup.descendants:
+            items = waiting.get(tag.name)
+            if not items:
+                continue
+            for item in list(items):
+                if item[2](tag):
+                    found[item[1].key] = tag
+                    items.remove(item)
+                    left -= 1
+            if not left:
+                break
+        return self._values(found, url)
+
+    def extract_find(self, soup, url: str = None) -> dict:
+        '''поля через soup.find, по одному поиску на поле'''
+        found = dict()
+        for field in self.fields:
+            if field.requires and field.requires not in found:
+                continue
+            tag = soup.find(field.name, attrs=field.attrs or {})
+            if tag:
+                found[field.key] = tag
+        return self._values(found, url)
+
+    def _values(self, found: dict, url: str) -> dict:
+        result = dict()
+        for field in self.fields:
+            if field.requires and field.requires not in found:
+                continue
+            tag = found.get(field.key)
+            if tag is None:
+                logging.error('{} not found in url=[{}]'.format(field.label or _label(field), url))
+                continue
+            if field.key not in self.wanted:
+                continue
+            value = tag.get(field.attr) if field.attr else tag.text
+            try:
+                for process in field.process or ():
+                    if value is None:
+                        break
+                    value = process(value)
+            except ValueError:
+                value = None
+            result[field.key] = value
+        return result
+
+
+_plans = dict()
+
+
+def plan_for(cls, specs: list, wanted: set) -> Plan:
+    '''план для класса парсера и набора полей, строится один раз'''
+    key = (cls, frozenset(wanted))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = Plan.compile(specs, wanted)
+    return plan
@@ -0,0 +1,83 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+отпечатки содержимого страниц товаров.
+
+между загрузкой и разбором считается хеш нужной части страницы (областей
+PARSE_REGIONS, если они заданы) после удаления изменчивых фрагментов
+(FINGERPRINT_STRIP парсера). если отпечаток совпал с сохраненным, дерево не
+строится, а берется прошлый результат parse_product со свежим parsed_at.
+
+    parser.set_fingerprints(FingerprintStore('state/fingerprints.sqlite3'))
+'''
+
+from collections import namedtuple
+from hashlib import blake2b
+import json
+import logging
+import re
+
+from .sqlite import SqliteDatabase
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fingerprint (
+    url TEXT PRIMARY KEY,
+    fields TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+'''
+
+re_spaces = re.compile('\\s+')
+
+Fingerprint = namedtuple('Fingerprint', 'url fields digest result')
+
+
+def fingerprint(text: str, strip: list = ()) -> str:
+    '''хеш текста после удаления изменчивых фрагментов strip (регулярные выражения) и лишних пробелов'''
+    for pattern in strip:
+        text = re.sub(pattern, '', text)
+    text = re_spaces.sub(' ', text)
+    return blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def fields_key(fields: set) -> str:
+    return ','.join(sorted(fields))
+
+
+class FingerprintStore:
+    '''Отпечатки и результаты разбора в файле SQLite'''
+
+    def __init__(self, path: str):
+        self._db = SqliteDatabase(path, SCHEMA)
+        self.reused = 0
+        self.parsed = 0
+
+    def get(self, url: str) -> [Fingerprint, None]:
+        rows = self._db.execute('SELECT url, fields, digest, result FROM fingerprint WHERE url = ?', (url,))
+        if not rows:
+            return None
+        url, fields, digest, result = rows[0]
+        return Fingerprint(url, fields, digest, json.loads(result))
+
+    def put(self, url: str, fields: str, digest: str, result: dict) -> None:
+        try:
+            result = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logging.warning('result for [{}] is not stored: {}'.format(url, e))
+            return
+        with self._db.transaction() as c:
+            c.execute('INSERT OR REPLACE INTO fingerprint (url, fields, digest, result) VALUES (?, ?, ?, ?)',
+                      (url, fields, digest, result))
+
+    def stats(self) -> dict:
+        return {'reused': self.reused, 'parsed': self.parsed}
+
+    def __str__(self):
+        return 'FingerprintStore: {} reused, {} parsed'.format(self.reused, self.parsed)
@@ -0,0 +1,225 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+гибридная загрузка: сначала requests, браузер - только когда он нужен.
+
+страница, загруженная через requests, отправляется в браузер (SeleniumParser),
+если сервер ее заблокировал (BLOCK_STATUSES), вернул проверку "вы не робот"
+(CHALLENGE_MARKERS) или на ней нет нужных областей (REQUIRED_REGIONS, по
+умолчанию PARSE_REGIONS) - страница строится скриптами. для каждого хоста или
+шаблона пути (MODE_PATTERNS) запоминается, какой способ работает: после
+ESCALATE_AFTER неудач requests страницы сразу загружаются браузером, а каждая
+RECHECK_EVERY-я снова пробуется через requests.
+'''
+
+from urllib.parse import urlsplit
+import json
+import logging
+import os
+import re
+import threading
+
+from .base import ProxyData
+from .markup import extract_regions
+from .simple_parser import SimpleParser
+
+MODE_HTTP = 'http'
+MODE_BROWSER = 'browser'
+
+# маркеры страниц проверки. общие строки вроде 'g-recaptcha' (формы обратной связи)
+# или 'Please enable JavaScript' (блоки <noscript>) есть и на обычных страницах магазинов
+DEFAULT_CHALLENGE_MARKERS = (
+    'cf-browser-verification', 'challenge-platform', 'cf_chl_', 'Checking your browser',
+    'ddos-guard', '__qrator', 'smartcaptcha',
+)
+
+re_title = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+class FetchModes:
+    '''
+    Запоминает способ загрузки по хосту или шаблону пути.
+
+    * patterns -- регулярные выражения для пути URL. страницы, путь которых
+      подходит под шаблон, учитываются отдельно от остальных страниц хоста
+    * escalate_after -- после скольких неудач requests подряд переходить на браузер
+    * recheck_every -- в режиме браузера каждая recheck_every-я страница пробуется через requests
+    * path -- файл JSON, в котором режимы сохраняются между обходами
+    '''
+
+    def __init__(self, patterns=(), escalate_after: int = 2, recheck_every: int = 50, path: str = None):
+        self._patterns = [re.compile(x) for x in patterns]
+        self._escalate_after = escalate_after
+        self._recheck_every = recheck_every
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = dict()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    def key(self, url: str) -> str:
+        parts = urlsplit(url)
+        for pattern in self._patterns:
+            if pattern.search(parts.path):
+                return parts.netloc + ' ' + pattern.pattern
+        return parts.netloc
+
+    def _entry(self, key: str) -> dict:
+        return self._entries.setdefault(key, {'mode': MODE_HTTP, 'failures': 0, 'since': 0,
+                                              'http_ok': 0, 'http_fail': 0, 'browser_ok': 0, 'browser_fail': 0})
+
+    def mode(self, url: str) -> str:
+        '''каким способом загружать url'''
+        with self._lock:
+            entry = self._entries.get(self.key(url))
+            if not entry or entry['mode'] != MODE_BROWSER:
+                return MODE_HTTP
+            entry['since'] += 1
+            if self._recheck_every and entry['since'] >= self._recheck_every:
+                entry['since'] = 0
+                return MODE_HTTP
+            return MODE_BROWSER
+
+    def record(self, url: str, mode: str, ok: bool) -> None:
+        '''учитывает результат загрузки url способом mode'''
+        with self._lock:
+            entry = self._entry(self.key(url))
+            entry['{}_{}'.format(mode, 'ok' if ok else 'fail')] += 1
+            if mode != MODE_HTTP:
+                return
+            if ok:
+                entry['mode'] = MODE_HTTP
+                entry['failures'] = 0
+                return
+            entry['failures'] += 1
+            if entry['failures'] >= self._escalate_after and entry['mode'] != MODE_BROWSER:
+                logging.info('switch {} to browser'.format(self.key(url)))
+                entry['mode'] = MODE_BROWSER
+                entry['since'] = 0
+
+    def save(self):
+        if not self._path:
+            return
+        with self._lock:
+            data = json.dumps(self._entries, ensure_ascii=False, indent=1)
+        with open(self._path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._entries.items()}
+
+    def __str__(self):
+        return 'FetchModes: ' + str({key: entry['mode'] for key, entry in self.stats().items()})
+
+
+class HybridParser(SimpleParser):
+    '''
+    Парсер, загружающий страницы через requests и при необходимости браузером.
+    Браузер (BROWSER_CLASS, по умолчанию SeleniumParser) запускается при первой
+    такой странице и закрывается в __exit__. Запросы к нему выполняются по одному.
+    '''
+
+    BROWSER_CLASS = None  # подкласс SeleniumParser с READY, BLOCK_RESOURCES и т.д.
+    BLOCK_STATUSES = {401, 403, 429, 503}
+    CHALLENGE_MARKERS = DEFAULT_CHALLENGE_MARKERS
+    # маркеры ищутся во всей странице, только если она не длиннее (страница проверки короткая), иначе - в <title>
+    CHALLENGE_MAX_SIZE = 32768
+    # области, которые должны быть на странице типа 'C', 'P', ... (по умолчанию PARSE_REGIONS)
+    REQUIRED_REGIONS = None
+    MODE_PATTERNS = []
+    ESCALATE_AFTER = 2
+    RECHECK_EVERY = 50
+
+    def __init__(self, base_url, virtual_display=False, proxy:ProxyData=None, browser_pool=None, modes_path=None):
+        '''
+        * browser_pool -- multiparser.browser_pool.BrowserPool для браузера
+        * modes_path -- файл, в котором сохраняются способы загрузки (FetchModes)
+        '''
+        super().__init__(base_url, virtual_display, proxy)
+        self._browser_proxy = proxy
+        self._browser_pool = browser_pool
+        self._browser = None
+        self._browser_lock = threading.Lock()
+        self._modes = FetchModes(self.MODE_PATTERNS, self.ESCALATE_AFTER, self.RECHECK_EVERY, modes_path)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._browser_lock:
+            if self._browser:
+                self._browser.__exit__(None, None, None)
+                self._browser = None
+        self._modes.save()
+        logging.info(str(self._modes))
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+    def create_browser(self):
+        '''создает браузер для страниц, которые не загружаются через requests'''
+        browser_class = self.BROWSER_CLASS
+        if browser_class is None:
+            from .selenium_parser import SeleniumParser
+            browser_class = SeleniumParser
+        browser = browser_class(self._base_url, self._virtual_display, self._browser_proxy, pool=self._browser_pool)
+        browser.base_url = self.base_url
+        browser.set_rate_limiter(self._rate_limiter)
+        return browser.__enter__()
+
+    def needs_browser(self, url, text, typ=None) -> bool:
+        '''
+        Проверяет результат загрузки через requests: True, если страница заблокирована,
+        это проверка на робота или на ней нет нужных областей
+        '''
+        if self._status_code in self.BLOCK_STATUSES:
+            return True
+        if text is None:
+            return False
+        if self.is_challenge(text):
+            logging.info('challenge page at [{}]'.format(url))
+            return True
+        required = self.REQUIRED_REGIONS if self.REQUIRED_REGIONS is not None else self.PARSE_REGIONS
+        regions = required.get(typ)
+        if regions and extract_regions(text, regions) is None:
+            logging.info('required regions for type {} not found at [{}]'.format(typ, url))
+            return True
+        return False
+
+    def is_challenge(self, text: str) -> bool:
+        '''страница проверки: маркер в короткой странице или в ее заголовке'''
+        if len(text) > self.CHALLENGE_MAX_SIZE:
+            title = re_title.search(text, 0, self.CHALLENGE_MAX_SIZE)
+            if not title:
+                return False
+            text = title.group(1)
+        return any(marker in text for marker in self.CHALLENGE_MARKERS)
+
+    def http_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
+        if self._modes.mode(url) == MODE_HTTP:
+            text = super().http_get_text(url, referrer, encoding, typ)
+            escalate = self.needs_browser(url, text, typ)
+            if text is not None or escalate:
+                # ошибка соединения или статус вроде 404 ничего не говорит о способе загрузки
+                self._modes.record(url, MODE_HTTP, not escalate)
+            if not escalate:
+                return text
+        return self.browser_get_text(url, referrer, encoding, typ)
+
+    def browser_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
+        '''загружает страницу браузером'''
+        with self._browser_lock:
+            if self._browser is None:
+                self._browser = self.create_browser()
+            logging.info("browser_get({}) {}".format(url, self.__class__))
+            text = self._browser.http_get_text(url, referrer, encoding, typ)
+            self._status_code = self._browser.http_last_status()
+        self._modes.record(url, MODE_BROWSER, text is not None)
+        return text
+
+    def fetch_modes(self) -> dict:
+        '''статистика способов загрузки по хостам и шаблонам'''
+        return self._modes.stats()
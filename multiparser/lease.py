@@ -0,0 +1,390 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+общая очередь нескольких серверов (узлов) в одной базе: SQLite или PostgreSQL.
+
+ссылка, выбранная из очереди, сдается в аренду узлу. узел раз в heartbeat
+секунд отмечается в таблице lease_node; если отметки нет дольше ttl секунд,
+узел считается упавшим, и его ссылки забирает любой другой узел. ссылку,
+которая в аренде у живого узла дольше steal_after секунд (по умолчанию
+STEAL_AFTER_TTL * ttl), может забрать свободный узел (work stealing): кто первым
+сохранит результат, того он и будет. так зависший, но живой узел не держит
+ссылки, которых ждут остальные узлы, дольше steal_after.
+
+результат товара сохраняется в lease_result и ссылка удаляется из очереди
+одной транзакцией (done), после того как результат принял on_product
+walk_site_pool, поэтому на каждую постановку ссылки в очередь в базе остается
+ровно один результат. если ссылку уже обработал другой узел, observe не
+передает результат в on_product. ссылку, которую одновременно обрабатывают два
+узла (steal_after), on_product может получить на обоих, в lease_result она
+попадет один раз. выгрузка может читать результаты из базы (results) и
+удалять выгруженные (prune); reset очищает lease_result вместе с очередью.
+
+    queue, history = open_lease_state('state/shared.sqlite3')  # или 'postgresql://user@host/db'
+    parser.set_state(queue, history)
+    parser.walk_site_pool(...)  # на каждом узле, reset=True - только на одном
+    queue.close()
+
+имя узла - settings.SERVER_NAME и номер процесса, чтобы несколько процессов
+одного сервера (manage.py supervise) были разными узлами.
+'''
+
+from contextlib import contextmanager
+from time import time
+from typing import List
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from .base import Link, BaseHistory, BaseQueue
+from .sinks import dumps
+from .sqlite import SqliteDatabase
+
+STEAL_AFTER_TTL = 10  # steal_after по умолчанию, в единицах ttl
+
+SCHEMA_SQLITE = '''
+CREATE TABLE IF NOT EXISTS lease_node (
+    node TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lease_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    node TEXT,
+    leased_at REAL,
+    UNIQUE (type, id)
+);
+CREATE INDEX IF NOT EXISTS lease_queue_node ON lease_queue (type, node, seq);
+CREATE TABLE IF NOT EXISTS lease_history (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+);
+CREATE TABLE IF NOT EXISTS lease_result (
+    seq INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    node TEXT NOT NULL,
+    result TEXT NOT NULL,
+    committed_at REAL NOT NULL
+);
+'''
+
+SCHEMA_POSTGRES = SCHEMA_SQLITE.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'BIGSERIAL PRIMARY KEY') \
+    .replace('seq INTEGER PRIMARY KEY', 'seq BIGINT PRIMARY KEY').replace('REAL', 'DOUBLE PRECISION')
+
+
+class PostgresDatabase:
+    '''
+    Соединение с PostgreSQL (pip install psycopg2) с интерфейсом SqliteDatabase:
+    transaction и execute, параметры запросов - '?'
+    '''
+
+    def __init__(self, dsn: str, schema: str = SCHEMA_POSTGRES):
+        import psycopg2
+        self.lock = threading.RLock()
+        self.connection = psycopg2.connect(dsn)
+        with self.transaction() as c:
+            for statement in schema.split(';'):
+                if statement.strip():
+                    c.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            cursor = _PostgresCursor(self.connection.cursor())
+            try:
+                yield cursor
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
+
+    def execute(self, sql, params=()) -> list:
+        with self.transaction() as c:
+            return c.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class _PostgresCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace('?', '%s'), params)
+        return self
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(sql.replace('?', '%s'), rows)
+        return self
+
+    def fetchall(self) -> list:
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    def fetchone(self):
+        return self._cursor.fetchone() if self._cursor.description else None
+
+
+def open_lease_state(location: str, node: str = None, ttl: float = 60, steal_after: float = None) \
+        -> ('LeaseQueue', 'LeaseHistory'):
+    '''открывает общую очередь и историю: location - файл SQLite или postgresql://...'''
+    if location.startswith(('postgres://', 'postgresql://')):
+        db = PostgresDatabase(location)
+    else:
+        db = SqliteDatabase(location, SCHEMA_SQLITE)
+    return LeaseQueue(db, node, ttl, steal_after), LeaseHistory(db)
+
+
+def default_node() -> str:
+    return '{}:{}'.format(getattr(settings, 'SERVER_NAME', None) or 'node', os.getpid())
+
+
+def _links(links, canonical) -> list:
+    if type(links) != list:
+        links = [links]
+    return [(x.type, str(x.id)) for x in (canonical(link) for link in links)]
+
+
+def _in(values) -> str:
+    return '({})'.format(', '.join('?' * len(values)))
+
+
+class LeaseQueue(BaseQueue):
+    '''
+    Очередь с арендой ссылок.
+
+    * db -- SqliteDatabase или PostgresDatabase со схемой lease_*
+    * node -- имя узла, по умолчанию SERVER_NAME:pid
+    * ttl -- через сколько секунд без отметки узел считается упавшим
+    * steal_after -- через сколько секунд аренды ссылку живого узла может забрать другой,
+      по умолчанию STEAL_AFTER_TTL * ttl
+    '''
+
+    def __init__(self, db, node: str = None, ttl: float = 60, steal_after: float = None):
+        super(BaseQueue).__init__()
+        self._db = db
+        self.node = node or default_node()
+        self._ttl = ttl
+        self._steal_after = steal_after or ttl * STEAL_AFTER_TTL
+        self._leases = dict()  # (type, id): seq ссылок, взятых этим узлом
+        self._results = dict()  # (type, id): результат, который сохранится в done
+        self._lock = threading.Lock()
+        self.stolen = 0
+        self.committed = 0
+        self.rejected = 0
+        self._beat()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='LeaseQueue', daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        with self._db.transaction() as c:
+            c.execute('INSERT INTO lease_node (node, heartbeat_at) VALUES (?, ?) '
+                      'ON CONFLICT (node) DO UPDATE SET heartbeat_at = excluded.heartbeat_at', (self.node, time()))
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self._ttl / 3):
+            try:
+                self._beat()
+            except Exception as e:
+                logging.error('heartbeat failed for node {}: {}'.format(self.node, e))
+
+    def _available(self, typ: str = None) -> (str, list):
+        '''условие для ссылок, которые узел может взять: свободные, упавших узлов и взятые дольше steal_after'''
+        now = time()
+        sql = '(node IS NULL OR node NOT IN (SELECT node FROM lease_node WHERE heartbeat_at >= ?)' \
+              ' OR node <> ? AND leased_at < ?)'
+        params = [now - self._ttl, self.node, now - self._steal_after]
+        if typ is not None:
+            sql += ' AND type = ?'
+            params.append(typ)
+        return sql, params
+
+    def reset(self):
+        '''очищает очередь и результаты прошлого обхода'''
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM lease_queue')
+            c.execute('DELETE FROM lease_result')
+        with self._lock:
+            self._leases.clear()
+            self._results.clear()
+
+    def put(self, links:[Link, List[Link]]) -> None:
+        '''добавляет ссылки, которых еще нет в очереди'''
+        with self._db.transaction() as c:
+            c.executemany('INSERT INTO lease_queue (type, id) VALUES (?, ?) ON CONFLICT (type, id) DO NOTHING',
+                          _links(links, self.canonical))
+
+    def has(self, typ: str = None) -> bool:
+        '''
+        есть ли в очереди ссылки, в том числе взятые другими узлами: пока они не обработаны,
+        узел ждет их в walk_site_pool, чтобы забрать, если их узел упадет
+        '''
+        if typ is not None:
+            return bool(self._db.execute('SELECT 1 FROM lease_queue WHERE type = ? LIMIT 1', (typ,)))
+        return bool(self._db.execute('SELECT 1 FROM lease_queue LIMIT 1'))
+
+    def pop(self, cnt: int = 1, typ: str = None) -> list:
+        '''берет в аренду cnt ссылок: сначала свободные, затем упавших узлов и давно взятые'''
+        sql, params = self._available(typ)
+        lock = ' FOR UPDATE SKIP LOCKED' if isinstance(self._db, PostgresDatabase) else ''
+        with self._db.transaction() as c:
+            rows = c.execute('SELECT seq, type, id, node FROM lease_queue WHERE ' + sql +
+                             ' ORDER BY node IS NOT NULL, seq LIMIT ?' + lock, params + [cnt]).fetchall()
+            if rows:
+                c.execute('UPDATE lease_queue SET node = ?, leased_at = ? WHERE seq IN ' + _in(rows),
+                          [self.node, time()] + [row[0] for row in rows])
+        stolen = sum(1 for row in rows if row[3] is not None)
+        if stolen:
+            logging.info('node {} took {} leased links'.format(self.node, stolen))
+        with self._lock:
+            self.stolen += stolen
+            for row in rows:
+                self._leases[(row[1], row[2])] = row[0]
+        return [Link(type=row[1], id=row[2]) for row in rows]
+
+    def _seqs(self, links) -> list:
+        '''[(seq, результат)] ссылок, взятых этим узлом'''
+        with self._lock:
+            return [(self._leases.pop(key), self._results.pop(key, None))
+                    for key in _links(links, self.canonical) if key in self._leases]
+
+    def done(self, links:[Link, List[Link]]) -> None:
+        '''
+        Удаляет из очереди ссылки, взятые этим узлом, и сохраняет их результаты (observe)
+        одной транзакцией. Если ссылку уже обработал другой узел, результат не сохраняется
+        '''
+        seqs = self._seqs(links)
+        if not seqs:
+            return
+        committed = rejected = 0
+        with self._db.transaction() as c:
+            for seq, result in seqs:
+                if result is None:
+                    c.execute('DELETE FROM lease_queue WHERE seq = ?', (seq,))
+                    continue
+                row = c.execute('SELECT type, id FROM lease_queue WHERE seq = ?', (seq,)).fetchone()
+                if row is None:
+                    rejected += 1
+                    continue
+                c.execute('INSERT INTO lease_result (seq, type, id, node, result, committed_at) '
+                          'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (seq) DO NOTHING',
+                          (seq, row[0], row[1], self.node, dumps(result), time()))
+                c.execute('DELETE FROM lease_queue WHERE seq = ?', (seq,))
+                committed += 1
+        with self._lock:
+            self.committed += committed
+            self.rejected += rejected
+
+    def observe(self, link: Link, result: dict) -> bool:
+        '''
+        Запоминает результат товара до done. False - ссылку уже обработал другой узел
+        (или она не была взята этим узлом), результат не передается в on_product
+        '''
+        key = _links(link, self.canonical)[0]
+        with self._lock:
+            seq = self._leases.get(key)
+        if seq is not None and self._db.execute('SELECT 1 FROM lease_queue WHERE seq = ?', (seq,)):
+            with self._lock:
+                self._results[key] = result
+            return True
+        with self._lock:
+            self._leases.pop(key, None)
+            self.rejected += 1
+        return False
+
+    def forget(self, link: Link) -> None:
+        '''результат не принят: сохраненный observe результат отбрасывается, аренда сохраняется до повтора или done'''
+        key = _links(link, self.canonical)[0]
+        with self._lock:
+            self._results.pop(key, None)
+
+    def results(self, after: int = 0, limit: int = 1000) -> list:
+        '''сохраненные результаты [(seq, Link, result)] с seq больше after, для выгрузки'''
+        rows = self._db.execute('SELECT seq, type, id, result FROM lease_result WHERE seq > ? ORDER BY seq LIMIT ?',
+                                (after, limit))
+        return [(row[0], Link(type=row[1], id=row[2]), json.loads(row[3])) for row in rows]
+
+    def prune(self, upto: int) -> None:
+        '''удаляет выгруженные результаты с seq не больше upto'''
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM lease_result WHERE seq <= ?', (upto,))
+
+    def save(self):
+        '''каждая операция сохраняется сразу'''
+        pass
+
+    def restore(self):
+        '''освобождает ссылки этого узла и упавших узлов'''
+        with self._db.transaction() as c:
+            c.execute('UPDATE lease_queue SET node = NULL, leased_at = NULL WHERE node = ? OR node NOT IN '
+                      '(SELECT node FROM lease_node WHERE heartbeat_at >= ?)', (self.node, time() - self._ttl))
+        with self._lock:
+            self._leases.clear()
+            self._results.clear()
+
+    def contains(self, link: Link) -> bool:
+        canonical = self.canonical(link)
+        if not self._db.execute('SELECT 1 FROM lease_queue WHERE type = ? AND id = ?',
+                                (canonical.type, str(canonical.id))):
+            return False
+        self._found(link, canonical)
+        return True
+
+    def close(self):
+        '''останавливает отметки и освобождает ссылки узла, чтобы их сразу взяли другие'''
+        self._stop.set()
+        self._heartbeat.join()
+        with self._db.transaction() as c:
+            c.execute('UPDATE lease_queue SET node = NULL, leased_at = NULL WHERE node = ?', (self.node,))
+            c.execute('DELETE FROM lease_node WHERE node = ?', (self.node,))
+
+    def stats(self) -> dict:
+        rows = self._db.execute('SELECT node IS NULL, COUNT(*) FROM lease_queue GROUP BY node IS NULL')
+        counts = {bool(free): n for free, n in rows}
+        return {'node': self.node, 'pending': counts.get(True, 0), 'leased': counts.get(False, 0),
+                'committed': self.committed, 'rejected': self.rejected, 'stolen': self.stolen}
+
+    def __str__(self):
+        return 'LeaseQueue: ' + str(self.stats())
+
+
+class LeaseHistory(BaseHistory):
+    '''История парсинга в той же базе, общая для всех узлов'''
+
+    def __init__(self, db):
+        super(LeaseHistory).__init__()
+        self._db = db
+
+    def reset(self):
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM lease_history')
+
+    def put(self, links:[Link, List[Link]]) -> None:
+        with self._db.transaction() as c:
+            c.executemany('INSERT INTO lease_history (type, id) VALUES (?, ?) ON CONFLICT (type, id) DO NOTHING',
+                          _links(links, self.canonical))
+
+    def contains(self, link: Link) -> bool:
+        canonical = self.canonical(link)
+        if not self._db.execute('SELECT 1 FROM lease_history WHERE type = ? AND id = ?',
+                                (canonical.type, str(canonical.id))):
+            return False
+        self._found(link, canonical)
+        return True
+
+    def __str__(self):
+        return 'History: {} items'.format(self._db.execute('SELECT COUNT(*) FROM lease_history')[0][0])
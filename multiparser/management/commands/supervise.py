@@ -0,0 +1,46 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+обход магазинов из settings.CRAWL_SHOPS несколькими процессами, см. multiparser.supervisor
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from multiparser.supervisor import Supervisor, configured_shops, DEFAULT_TASK
+
+
+class Command(BaseCommand):
+    help = 'обход магазинов несколькими процессами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='процессов-исполнителей')
+        parser.add_argument('--shops', help='магазины через запятую, по умолчанию все из CRAWL_SHOPS')
+        parser.add_argument('--task', default=DEFAULT_TASK, help='функция задания task(shop) -> bool')
+        parser.add_argument('--concurrency', type=int, default=1, help='заданий одного магазина одновременно')
+        parser.add_argument('--max-runs', type=int, default=20, help='запусков задания магазина подряд')
+        parser.add_argument('--max-jobs', type=int, default=None, help='заданий до перезапуска процесса')
+
+    def handle(self, *args, **options):
+        try:
+            shops = configured_shops(options['shops'].split(',') if options['shops'] else None)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not shops:
+            raise CommandError('no shops to crawl, see CRAWL_SHOPS')
+        try:
+            supervisor = Supervisor(shops, processes=options['processes'], task=options['task'],
+                                    concurrency=options['concurrency'], max_runs=options['max_runs'],
+                                    max_jobs=options['max_jobs'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        stats = supervisor.run()
+        for name, shop in stats['shops'].items():
+            self.stdout.write('{:<20} runs {:>4} errors {:>4} {:>8.1f}s'.format(name, shop['runs'], shop['errors'],
+                                                                               shop['seconds']))
+        self.stdout.write('restarts {}, total {}s'.format(stats['restarts'], stats['seconds']))
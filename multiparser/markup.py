@@ -0,0 +1,286 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+построение дерева страницы.
+
+построитель выбирается по имени:
+
+* 'lxml' -- BeautifulSoup на lxml, быстрый
+* 'html.parser' -- BeautifulSoup на встроенном парсере python
+* 'html5lib' -- BeautifulSoup на html5lib, медленный, но разбирает все, как браузер
+* 'lexbor' -- selectolax (lexbor) за адаптером LexborTag, самый быстрый
+
+если страница не разобралась выбранным построителем, она разбирается html5lib.
+
+частичный разбор: парсер может перечислить области страницы (Region), которые ему
+нужны. страница просматривается на уровне тегов, без построения дерева, и в дерево
+попадают только найденные области. в режиме extract_links дерево не строится вовсе,
+собираются только href ссылок внутри областей.
+'''
+
+from collections import namedtuple
+from html import unescape
+import logging
+import re
+from bs4 import BeautifulSoup
+
+#  тип 'Region' - описание области страницы, которая нужна парсеру
+#  key - имя области (ключ в результате extract_links)
+#  name - имя тега, attrs - атрибуты тега как в BeautifulSoup.find ({'class': 'pager-bottom'})
+Region = namedtuple('Region', 'key name attrs', defaults=(None,))
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+             'track', 'wbr'}
+
+re_attr = re.compile('([^\\s=/>]+)(?:\\s*=\\s*(?:"([^"]*)"|\'([^\']*)\'|([^\\s>]+)))?')
+
+BUILDER_LXML = 'lxml'
+BUILDER_HTML_PARSER = 'html.parser'
+BUILDER_HTML5LIB = 'html5lib'
+BUILDER_LEXBOR = 'lexbor'
+
+FALLBACK_BUILDER = BUILDER_HTML5LIB
+
+
+def make_soup(text: str, builder: str = BUILDER_LXML, url: str = None, fallback: str = FALLBACK_BUILDER):
+    '''
+    Строит дерево страницы.
+
+    Возвращает BeautifulSoup (или LexborTag для 'lexbor'), либо None, если страницу
+    не удалось разобрать ни выбранным построителем, ни построителем fallback.
+    '''
+    soup = _build(text, builder, url)
+    if soup is None and fallback and fallback != builder:
+        logging.warning('{} failed, fallback to {} at [{}]'.format(builder, fallback, url))
+        soup = _build(text, fallback, url)
+    if soup is None:
+        logging.error('soup failed at [{}]'.format(url))
+    return soup
+
+
+def _build(text, builder, url):
+    try:
+        if builder == BUILDER_LEXBOR:
+            from selectolax.lexbor import LexborHTMLParser
+            root = LexborHTMLParser(text).root
+            if root is None or root.css_first('body') is None:
+                return None
+            return LexborTag(root)
+        soup = BeautifulSoup(text, builder)
+    except Exception as e:
+        logging.error('{} exception at [{}] {}'.format(builder, url, e))
+        return None
+    # lxml на битых страницах может вернуть пустое дерево, это считается ошибкой разбора
+    if text and text.strip() and soup.find() is None:
+        return None
+    return soup
+
+
+def extract_regions(text: str, regions: list) -> [str, None]:
+    '''
+    Вырезает из страницы области regions и возвращает их как отдельный html документ.
+    Если ни одной области не найдено, возвращает None.
+    '''
+    scanner = RegionScanner(text, regions)
+    scanner.scan()
+    if not scanner.fragments:
+        return None
+    return '<html><body>' + ''.join(scanner.fragments) + '</body></html>'
+
+
+def extract_links(text: str, regions: list) -> dict:
+    '''
+    Собирает href ссылок внутри областей regions без построения дерева.
+
+    Возвращает dict вида {region.key: [href, href, ...], ...}, порядок ссылок как на странице.
+    '''
+    scanner = RegionScanner(text, regions, links=True)
+    scanner.scan()
+    return scanner.links
+
+
+def _match(region: Region, name: str, attrs: dict) -> bool:
+    if region.name != name:
+        return False
+    if not region.attrs:
+        return True
+    for key, value in region.attrs.items():
+        if key not in attrs:
+            return False
+        if value is True:
+            continue
+        if key == 'class':
+            if not set(value.split()) <= set((attrs[key] or '').split()):
+                return False
+        elif attrs[key] != value:
+            return False
+    return True
+
+
+def _attrs(text: str) -> dict:
+    attrs = dict()
+    for m in re_attr.finditer(text):
+        value = m.group(2) if m.group(2) is not None else m.group(3) if m.group(3) is not None else m.group(4)
+        attrs[m.group(1).lower()] = unescape(value) if value else value
+    return attrs
+
+
+class RegionScanner:
+    '''
+    Просмотр страницы на уровне тегов регулярным выражением: рассматриваются только
+    теги областей и ссылки, комментарии и содержимое script/style пропускаются.
+    Запоминает границы областей верхнего уровня (вложенные области входят в объемлющую)
+    и, если нужно, href ссылок внутри каждой области.
+    '''
+
+    def __init__(self, text: str, regions: list, links=False):
+        self._text = text
+        self._regions = regions
+        self._collect_links = links
+        names = {region.name for region in regions}
+        if links:
+            names.add('a')
+        self._re_tag = re.compile('<!--.*?-->|<(script|style)\\b.*?</\\1\\s*>|<(/?)({})(?=[\\s/>])([^>]*)>'.format(
+            '|'.join(re.escape(x) for x in sorted(names))), re.S | re.I)
+        self._active = []  # [region, start offset, depth]
+        self.fragments = []
+        self.links = {region.key: [] for region in regions}
+
+    def scan(self):
+        for m in self._re_tag.finditer(self._text):
+            if not m.group(3):
+                continue
+            tag = m.group(3).lower()
+            if m.group(2):
+                self._end(tag, m.end())
+            else:
+                self._start(tag, m.group(4), m.start(), m.end())
+        # незакрытые области продолжаются до конца страницы
+        for region, start, depth in self._active:
+            if start is not None:
+                self.fragments.append(self._text[start:])
+        self._active = []
+
+    def _start(self, tag, attrs_text, start, end):
+        attrs = None
+        for active in self._active:
+            if active[0].name == tag:
+                active[2] += 1
+        for region in self._regions:
+            if region.name != tag:
+                continue
+            if attrs is None:
+                attrs = _attrs(attrs_text)
+            if not _match(region, tag, attrs):
+                continue
+            # вложенная область уже входит в текст объемлющей
+            region_start = None if self._active else start
+            if tag in VOID_TAGS or attrs_text.endswith('/'):
+                if region_start is not None:
+                    self.fragments.append(self._text[start:end])
+            else:
+                self._active.append([region, region_start, 1])
+        if tag == 'a' and self._collect_links and self._active:
+            if attrs is None:
+                attrs = _attrs(attrs_text)
+            href = attrs.get('href')
+            if href:
+                for region, region_start, depth in self._active:
+                    self.links[region.key].append(href.strip())
+        if attrs_text.endswith('/') and tag not in VOID_TAGS:
+            self._end(tag, end)
+
+    def _end(self, tag, end):
+        closed = []
+        for active in self._active:
+            if active[0].name == tag:
+                active[2] -= 1
+                if active[2] == 0:
+                    closed.append(active)
+        for active in closed:
+            self._active.remove(active)
+            if active[1] is not None:
+                self.fragments.append(self._text[active[1]:end])
+
+
+def _selector(name=None, attrs=None, **kwargs) -> str:
+    '''строит css селектор из аргументов в стиле BeautifulSoup.find'''
+    attrs = dict(attrs or {})
+    for key, value in kwargs.items():
+        attrs[key.rstrip('_')] = value
+    selector = name or '*'
+    for key, value in attrs.items():
+        if value is True:
+            selector += '[{}]'.format(key)
+            continue
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        if key == 'class' and ' ' not in value:
+            selector += '[class~="{}"]'.format(value)
+        else:
+            selector += '[{}="{}"]'.format(key, value)
+    return selector
+
+
+class LexborTag:
+    '''
+    Адаптер узла selectolax с частью интерфейса bs4.Tag, которой пользуются парсеры:
+    find, findAll/find_all, get, attrs, name, text, get_text.
+    Поиск поддерживает имя тега и точные значения атрибутов (без регулярных выражений).
+    '''
+
+    def __init__(self, node):
+        self._node = node
+
+    def find(self, name=None, attrs=None, **kwargs) -> ['LexborTag', None]:
+        node = self._node.css_first(_selector(name, attrs, **kwargs))
+        if node is None:
+            return None
+        return LexborTag(node)
+
+    def find_all(self, name=None, attrs=None, limit=None, **kwargs) -> list:
+        nodes = self._node.css(_selector(name, attrs, **kwargs))
+        if limit:
+            nodes = nodes[:limit]
+        return [LexborTag(node) for node in nodes]
+
+    findAll = find_all
+
+    def select(self, selector) -> list:
+        return [LexborTag(node) for node in self._node.css(selector)]
+
+    def select_one(self, selector) -> ['LexborTag', None]:
+        node = self._node.css_first(selector)
+        if node is None:
+            return None
+        return LexborTag(node)
+
+    @property
+    def name(self):
+        return self._node.tag
+
+    @property
+    def attrs(self) -> dict:
+        return dict(self._node.attributes)
+
+    def get(self, key, default=None):
+        value = self._node.attributes.get(key, default)
+        return default if value is None else value
+
+    def get_text(self, separator='', strip=False) -> str:
+        return self._node.text(deep=True, separator=separator, strip=strip)
+
+    @property
+    def text(self) -> str:
+        return self._node.text(deep=True)
+
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        return self._node.html or ''
@@ -10,14 +10,37 @@
 
 from ..simple_parser import SimpleParser
 from ..base import Link, ProxyData
+from ..markup import Region
+from ..extract import Field, clean_text, parse_price
 import logging
 from typing import List
 from time import time
-import re
-
-re_price = re.compile('[^0-9,.]')
 
 class ParserDuim24Ru(SimpleParser):
+    CANONICAL_URL = {}
+    RATE_LIMIT = 4
+    RATE_BURST = 4
+    PARSE_REGIONS = {
+        'C': [
+            Region('pages', 'div', {'class': 'pager-bottom'}),
+            Region('products', 'div', {'class': 'tovar-descript'}),
+        ],
+        'P': [
+            Region('name', 'h1', {'itemprop': 'name'}),
+            Region('tobasket', 'div', {'class': 'popup-tobasket'}),
+            Region('sku', 'span', {'itemprop': 'sku'}),
+            Region('price', 'span', {'itemprop': 'price'}),
+        ],
+    }
+    PRODUCT_FIELDS = [
+        Field(SimpleParser.FIELD_NAME, 'h1', {'itemprop': 'name'}, process=[clean_text]),
+        Field('tobasket', 'div', {'class': 'popup-tobasket'}),
+        Field(SimpleParser.FIELD_ARTICUL, 'span', {'itemprop': 'sku'}, process=[clean_text], requires='tobasket',
+              label='span.sku'),
+        Field(SimpleParser.FIELD_PRICE, 'span', {'itemprop': 'price'}, attr='content', process=[parse_price],
+              requires='tobasket', label='span.price'),
+    ]
+
     def __init__(self, base_url='https://www.duim24.ru'):
         super().__init__(base_url)
 
@@ -64,38 +87,24 @@ class ParserDuim24Ru(SimpleParser):
         url = self.url(link)
         if self.PARSED_URL in fields:
             result[self.PARSED_URL] = url
-        soup = self.http_get(url, self.base_url())
-        if not soup:
+        links = self.http_get_links(url, self.base_url(), link.type)
+        if links is None:
             return
-        div_tag = soup.find('div', attrs={'class': 'pager-bottom'})
-        if not div_tag:
-            logging.warning('(3) div[class="pager-bottom"] not found at [{}]'.format(url))
+        if not links['pages']:
+            logging.warning('(3) a in div[class="pager-bottom"] not found at [{}]'.format(url))
         else:
-            a_tags = div_tag.findAll('a')
-            if not a_tags:
-                logging.warning('(4) a not found at [{}]'.format(url))
-            result['pages'] = set()
-            for a in a_tags:
-                href = a.get('href')
-                if href:
-                    result['pages'].add(href.strip())
+            result['pages'] = set(links['pages'])
 
-        div_tags = soup.findAll('div', attrs={'class': 'tovar-descript'})
-        if not div_tags:
-            logging.warning('(3) div[class="tovar-descript"] not found at [{}]'.format(url))
+        if not links['products']:
+            logging.warning('(3) a in div[class="tovar-descript"] not found at [{}]'.format(url))
         else:
             result['products'] = dict()
-            for div_tag in div_tags:
-                a_tags = div_tag.findAll('a')
-                if not a_tags:
-                    logging.warning('(5) a not found at [{}]'.format(url))
-                for a in a_tags:
-                    href = a.get('href')
-                    if href and href[:9]=='/catalog/':
-                        result['products'][href.strip()] = dict()
+            for href in links['products']:
+                if href[:9]=='/catalog/':
+                    result['products'][href] = dict()
         return result
 
-    def walk_site(self, reset=False):
+    def walk_site(self, reset=False, workers=None):
         '''
         Выполняет полный обход сайта.
         В парсер в идеале умеет сохранять свое состояние, - то есть он может быть прерван,
@@ -106,32 +115,8 @@ class ParserDuim24Ru(SimpleParser):
         categories_products_fields = {self.FIELD_URL}
         products_fields = {self.PARSED_TIME, self.PARSED_URL, self.FIELD_URL, self.FIELD_PRICE}
 
-        if reset:
-            self.build_initial_list()
-
-        while self._queue.has(typ='C'):
-            #print('1-1:', str(self._queue))
-            links = self._queue.pop(typ='C', cnt=1)
-            #print('1-1 links=', str(links)),
-            #print('1-1:', str(self._queue))
-            self._history.put(links)
-            result = self.parse_categories(links, categories_fields, categories_products_fields)
-            for link in result:
-                if type(result[link]) == dict:
-                    if 'products' in result[link]:
-                        for url in result[link]['products']:
-                            product_link = Link(type='P', id=url)
-                            if product_link not in self._history and product_link not in self._queue:
-                                self._queue.put(product_link)
-                    if 'pages' in result[link]:
-                        for url in result[link]['pages']:
-                            page_link = Link(type='C', id=url)
-                            if page_link not in self._history and page_link not in self._queue:
-                                self._queue.put(page_link)
-
-        while self._queue.has(typ='P'):
-            links = self._queue.pop(typ='P', cnt=1)
-            parsed = self.parse_products(links, products_fields)
+        self.walk_site_pool(categories_fields, categories_products_fields, products_fields,
+                            reset=reset, workers=workers)
 
     def parse_products(self, links:[Link, List[Link]], fields: set) -> [dict, None]:
         logging.info('parse_products')
@@ -139,7 +124,7 @@ class ParserDuim24Ru(SimpleParser):
             links = [links]
         results = dict()
         for link in links:
-            result = self.parse_product(link, fields)
+            result = self.parse_product_cached(link, fields)
             if result:
                 results[link] = result
         return results
@@ -154,9 +139,13 @@ class ParserDuim24Ru(SimpleParser):
         result = {x:None for x in fields} # результат должен содержать все требуемые параметры, даже если они не найдены
 
         url = self.url(link)
-        soup = self.http_get(url, self.base_url())
+        soup = self.http_get(url, self.base_url(), typ=link.type)
+        if soup is None:
+            return  # http_last_status покажет, стоит ли повторить
         if self.PARSED_STATUS in fields:
-            result[self.PARSED_STATUS] = self.http_last_status()
+            result[self.PARSED_STATUS] = self.result_status()
+        if self.PARSED_CACHED in fields:
+            result[self.PARSED_CACHED] = self.result_cached()
         if self.PARSED_PROXY in fields:
             result[self.PARSED_PROXY] = self.proxy_string()
         if self.PARSED_TIME in fields:
@@ -164,36 +153,7 @@ class ParserDuim24Ru(SimpleParser):
         if self.PARSED_URL in fields:
             result[self.PARSED_URL] = url
 
-        if self.FIELD_NAME in fields:
-            h1_tag = soup.find('h1', attrs={'itemprop': 'name'})
-            if not h1_tag:
-                logging.error('h1 not found in url=[{}]'.format(url))
-            else:
-                result[self.FIELD_NAME] = h1_tag.text.strip().replace(';', '.')
-        if self.FIELD_ARTICUL in fields or self.FIELD_PRICE in fields:
-            div_tag = soup.find('div', attrs={'class': 'popup-tobasket'})
-            if not div_tag:
-                logging.error('div.popup-tobasket not found url=[{}]'.format(url))
-            else:
-                if self.FIELD_ARTICUL in fields:
-                    span_tag = soup.find('span', attrs={'itemprop': 'sku'})
-                    if not span_tag:
-                        logging.error('span.sku not found in url=[{}]'.format(url))
-                    else:
-                        result[self.FIELD_ARTICUL] = span_tag.text.strip().replace(';', '.')
-                if self.FIELD_PRICE in fields:
-                    span_tag = soup.find('span', attrs={'itemprop': 'price'})
-                    if not span_tag:
-                        logging.error('span.price not found in url=[{}]'.format(url))
-                    else:
-                        price = span_tag.get('content').strip()
-                        price = re_price.sub('', price).replace(',','.')
-                        try:
-                            result[self.FIELD_PRICE] = float(price)
-                        except ValueError:
-                            pass
-
-
+        result.update(self.extract_fields(soup, fields, url))
         return result
 
         # nav_tag = soup.find('nav', attrs={'class': 'breadcrumbs'})
@@ -0,0 +1,187 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+пул прокси с оценкой качества.
+
+прокси проверяются параллельно запросом к PROXY_CHECKER_URL (так же, как
+BaseParser.get_ip). каждый прокси получает оценку по доле успешных запросов и
+задержке; прокси выбирается случайно с весом по оценке, поэтому нагрузка
+распределяется, а хорошие прокси получают больше запросов. после max_errors
+ошибок подряд прокси уходит в карантин, каждый следующий карантин вдвое дольше.
+
+    from multiparser.base import ROTATE_REQUEST
+
+    pool = ProxyPool(proxies)
+    pool.check_all()
+    parser.set_proxy_pool(pool, rotate=ROTATE_REQUEST)
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from time import monotonic
+from typing import List
+import logging
+import random
+import threading
+
+import requests
+from django.conf import settings
+
+from .base import ProxyData, format_proxy, find_checker_ip
+from .markup import make_soup, BUILDER_LXML
+
+ProxyCheck = namedtuple('ProxyCheck', 'proxy ip seconds error')
+
+
+def requests_proxies(proxy: ProxyData) -> dict:
+    '''параметр proxies для requests. https-прокси подключается как http (CONNECT)'''
+    if proxy.type == 'https':
+        proxy = proxy._replace(type='http')
+    return {'http': format_proxy(proxy), 'https': format_proxy(proxy)}
+
+
+def check_proxy(proxy: ProxyData, checker_url: str = None, timeout: float = 15) -> ProxyCheck:
+    '''загружает страницу проверки через proxy и возвращает видимый сайтам IP и время ответа'''
+    checker_url = checker_url or settings.PROXY_CHECKER_URL
+    started = monotonic()
+    try:
+        response = requests.get(checker_url, proxies=requests_proxies(proxy), timeout=timeout)
+        seconds = monotonic() - started
+        if response.status_code != 200:
+            return ProxyCheck(proxy, None, seconds, 'status code {}'.format(response.status_code))
+        ip = find_checker_ip(make_soup(response.text, BUILDER_LXML, checker_url))
+        if not ip:
+            return ProxyCheck(proxy, None, seconds, 'no IP at checker page')
+        return ProxyCheck(proxy, ip, seconds, None)
+    except Exception as e:
+        return ProxyCheck(proxy, None, monotonic() - started, str(e))
+
+
+class ProxyState:
+    '''счетчики прокси'''
+
+    def __init__(self, proxy: ProxyData):
+        self.proxy = proxy
+        self.ip = None
+        self.ok = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.latency = None  # экспоненциальное среднее, секунд
+        self.quarantined_until = 0.0
+        self.quarantines = 0
+        self.first_used = None
+        self.last_used = None
+
+
+class ProxyPool:
+    '''
+    * proxies -- список ProxyData
+    * checker_url -- страница проверки, по умолчанию settings.PROXY_CHECKER_URL
+    * max_errors -- ошибок подряд до карантина
+    * quarantine -- длительность первого карантина, секунд
+    '''
+
+    LATENCY_WEIGHT = 0.2  # вес нового замера в среднем времени ответа
+    DEFAULT_LATENCY = 1.0  # время ответа непроверенного прокси
+
+    def __init__(self, proxies: List[ProxyData], checker_url: str = None, max_errors: int = 3,
+                 quarantine: float = 300):
+        self._checker_url = checker_url
+        self._max_errors = max_errors
+        self._quarantine = quarantine
+        self._lock = threading.Lock()
+        self._states = {proxy: ProxyState(proxy) for proxy in proxies}
+
+    def check_all(self, workers: int = 16, timeout: float = 15) -> List[ProxyCheck]:
+        '''проверяет все прокси параллельно. непрошедшие проверку уходят в карантин'''
+        proxies = list(self._states)
+        if not proxies:
+            return []
+        with ThreadPoolExecutor(max_workers=min(workers, len(proxies))) as executor:
+            checks = list(executor.map(lambda x: check_proxy(x, self._checker_url, timeout), proxies))
+        for check in checks:
+            if check.error:
+                logging.warning('proxy {} failed check: {}'.format(format_proxy(check.proxy), check.error))
+            else:
+                with self._lock:
+                    self._states[check.proxy].ip = check.ip
+            self.report(check.proxy, check.error is None, check.seconds)
+        logging.info('{} of {} proxies passed check'.format(sum(1 for x in checks if not x.error), len(checks)))
+        return checks
+
+    def score(self, state: ProxyState) -> float:
+        '''доля успешных запросов (с априорной оценкой 1/2) в квадрате, деленная на время ответа'''
+        success = (state.ok + 1) / (state.ok + state.errors + 2)
+        return success * success / (state.latency or self.DEFAULT_LATENCY)
+
+    def available(self, proxy: ProxyData) -> bool:
+        with self._lock:
+            state = self._states.get(proxy)
+            return state is not None and state.quarantined_until <= monotonic()
+
+    def acquire(self, exclude: ProxyData = None) -> [ProxyData, None]:
+        '''выбирает прокси вне карантина с вероятностью, пропорциональной оценке'''
+        now = monotonic()
+        with self._lock:
+            states = [x for x in self._states.values() if x.quarantined_until <= now and x.proxy != exclude]
+            if not states and exclude is not None and exclude in self._states:
+                state = self._states[exclude]
+                states = [state] if state.quarantined_until <= now else []
+            if not states:
+                return None
+            return random.choices(states, weights=[self.score(x) for x in states])[0].proxy
+
+    def report(self, proxy: ProxyData, ok: bool, seconds: float = None) -> None:
+        '''учитывает результат запроса через proxy'''
+        now = monotonic()
+        with self._lock:
+            state = self._states.get(proxy)
+            if state is None:
+                return
+            state.first_used = state.first_used or now
+            state.last_used = now
+            if ok:
+                state.ok += 1
+                state.consecutive_errors = 0
+                if seconds is not None:
+                    if state.latency is None:
+                        state.latency = seconds
+                    else:
+                        state.latency += self.LATENCY_WEIGHT * (seconds - state.latency)
+                return
+            state.errors += 1
+            state.consecutive_errors += 1
+            if state.consecutive_errors >= self._max_errors or state.ok == 0:
+                duration = self._quarantine * (2 ** state.quarantines)
+                state.quarantines += 1
+                state.consecutive_errors = 0
+                state.quarantined_until = now + duration
+                logging.warning('proxy {} quarantined for {}s'.format(format_proxy(proxy), int(duration)))
+
+    def stats(self) -> dict:
+        '''{прокси: счетчики, оценка и запросов в секунду за время использования}'''
+        now = monotonic()
+        result = dict()
+        with self._lock:
+            for proxy, state in self._states.items():
+                elapsed = (state.last_used - state.first_used) if state.first_used else 0
+                result[format_proxy(proxy)] = {
+                    'ip': state.ip,
+                    'ok': state.ok,
+                    'errors': state.errors,
+                    'latency': round(state.latency, 3) if state.latency is not None else None,
+                    'score': round(self.score(state), 3),
+                    'throughput': round(state.ok / elapsed, 3) if elapsed > 0 else None,
+                    'quarantined': state.quarantined_until > now,
+                }
+        return result
+
+    def __str__(self):
+        stats = self.stats()
+        return 'ProxyPool: {} proxies, {} quarantined'.format(len(stats), sum(1 for x in stats.values() if x['quarantined']))
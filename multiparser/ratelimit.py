@@ -0,0 +1,154 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+ограничение частоты запросов.
+
+для каждого хоста и каждого прокси заводится "ведро с жетонами": жетоны
+пополняются со скоростью rate в секунду, в ведре помещается не больше burst.
+запрос забирает жетон, при пустом ведре поток ждет. один RateLimiter разделяют
+все потоки парсера, поэтому ограничение общее для всех воркеров.
+'''
+
+from time import monotonic, sleep
+from urllib.robotparser import RobotFileParser
+import threading
+
+
+class TokenBucket:
+    '''Ведро с жетонами. Жетон резервируется сразу, поэтому ожидающие потоки идут по очереди'''
+
+    def __init__(self, rate: float, burst: float = 1):
+        self._rate = rate
+        self._burst = max(1.0, burst)
+        self._tokens = self._burst
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+        self.requests = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        '''забирает жетон и возвращает, сколько секунд нужно подождать до его появления'''
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            self.requests += 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+            self.waited += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            sleep(wait)
+
+
+class RateLimiter:
+    '''
+    Ограничитель частоты запросов по хостам и прокси.
+
+    * rate -- запросов в секунду к одному хосту, None - без ограничения
+    * burst -- сколько запросов подряд можно сделать без ожидания
+    * proxy_rate -- запросов в секунду через один прокси, None - без ограничения
+    * host_rates -- ограничения для отдельных хостов {'www.ozon.ru': 0.5}
+    '''
+
+    def __init__(self, rate: float = None, burst: float = 1, proxy_rate: float = None, host_rates: dict = None):
+        self._rate = rate
+        self._burst = burst
+        self._proxy_rate = proxy_rate
+        self._host_rates = dict(host_rates or {})
+        self._hosts = dict()
+        self._proxies = dict()
+        self._robots = dict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, buckets: dict, key: str, rate: float) -> [TokenBucket, None]:
+        '''вызывается под _lock'''
+        if not rate:
+            return None
+        if key not in buckets:
+            buckets[key] = TokenBucket(rate, self._burst)
+        return buckets[key]
+
+    def wait(self, host: str, proxy: str = None):
+        '''ждет разрешения на запрос к host через proxy'''
+        with self._lock:
+            bucket = self._bucket(self._hosts, host, self._host_rates.get(host, self._rate))
+            proxy_bucket = self._bucket(self._proxies, proxy, self._proxy_rate) if proxy else None
+        wait = max(bucket.reserve() if bucket else 0, proxy_bucket.reserve() if proxy_bucket else 0)
+        if wait > 0:
+            sleep(wait)
+
+    def claim_robots(self, host: str) -> bool:
+        '''
+        True для первого вызова по хосту: этот поток загружает robots.txt и затем вызывает
+        release_robots. остальные потоки ждут release_robots и получают False
+        '''
+        with self._lock:
+            loaded = self._robots.get(host)
+            if loaded is None:
+                self._robots[host] = threading.Event()
+                return True
+        loaded.wait()
+        return False
+
+    def release_robots(self, host: str):
+        '''robots.txt хоста загружен (или не удалось загрузить), ожидающие потоки продолжают'''
+        with self._lock:
+            loaded = self._robots.get(host)
+        if loaded:
+            loaded.set()
+
+    def apply_robots(self, host: str, robots_text: str, user_agent: str = '*') -> [float, None]:
+        '''
+        Учитывает Crawl-delay и Request-rate из robots.txt, если они строже заданного ограничения.
+        Возвращает установленную частоту или None.
+        '''
+        robots = RobotFileParser()
+        robots.parse(robots_text.splitlines())
+        rate = None
+        delay = robots.crawl_delay(user_agent)
+        if delay:
+            rate = 1 / float(delay)
+        request_rate = robots.request_rate(user_agent)
+        if request_rate and request_rate.requests:
+            rate = min(rate or float('inf'), request_rate.requests / request_rate.seconds)
+        if not rate:
+            return None
+        with self._lock:
+            current = self._host_rates.get(host, self._rate)
+            if current and current <= rate:
+                return current
+            self._host_rates[host] = rate
+            if host in self._hosts:
+                self._hosts[host].set_rate(rate)
+        return rate
+
+    def stats(self) -> dict:
+        '''{хост или прокси: (запросов, секунд ожидания)}'''
+        with self._lock:
+            buckets = list(self._hosts.items()) + list(self._proxies.items())
+        return {key: (bucket.requests, round(bucket.waited, 3)) for key, bucket in buckets}
+
+    def __str__(self):
+        return 'RateLimiter: ' + str(self.stats())
@@ -0,0 +1,191 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+блокировка ресурсов страниц в SeleniumParser.
+
+парсеру нужен только document.body.outerHTML, поэтому картинки, шрифты, видео,
+счетчики и реклама загружаются зря. политика задается в классе парсера:
+
+    BLOCK_RESOURCES = {RESOURCE_IMAGE, RESOURCE_FONT, RESOURCE_MEDIA}
+    BLOCK_URLS = ['*mc.yandex.ru*', '*google-analytics.com*', '*doubleclick.net*']
+
+без авторизации на прокси типы ресурсов отключаются настройками профиля Firefox,
+а BLOCK_URLS - сценарием автонастройки прокси (PAC), который отправляет запросы
+к ним на закрытый порт. для https в PAC виден только адрес сайта, поэтому шаблоны
+сравниваются со схемой и хостом. с авторизацией на прокси (seleniumwire) запросы
+перехватываются ResourceInterceptor целиком.
+'''
+
+from fnmatch import fnmatchcase
+from urllib.parse import quote, urlsplit
+import json
+import threading
+
+RESOURCE_IMAGE = 'image'
+RESOURCE_FONT = 'font'
+RESOURCE_MEDIA = 'media'
+RESOURCE_STYLESHEET = 'stylesheet'
+RESOURCE_SCRIPT = 'script'
+
+# настройки профиля Firefox, отключающие загрузку типа ресурсов
+PROFILE_PREFERENCES = {
+    RESOURCE_IMAGE: {'permissions.default.image': 2},
+    RESOURCE_FONT: {'gfx.downloadable_fonts.enabled': False, 'browser.display.use_document_fonts': 0},
+    RESOURCE_MEDIA: {'media.autoplay.default': 5, 'media.preload.default': 0},
+    RESOURCE_STYLESHEET: {'permissions.default.stylesheet': 2},
+    RESOURCE_SCRIPT: {'javascript.enabled': False},
+}
+
+# значения заголовка Sec-Fetch-Dest и расширения файлов по типам ресурсов
+FETCH_DEST = {
+    RESOURCE_IMAGE: {'image'},
+    RESOURCE_FONT: {'font'},
+    RESOURCE_MEDIA: {'video', 'audio', 'track'},
+    RESOURCE_STYLESHEET: {'style'},
+    RESOURCE_SCRIPT: {'script'},
+}
+EXTENSIONS = {
+    RESOURCE_IMAGE: {'jpg', 'jpeg', 'png', 'gif', 'webp', 'svg', 'ico', 'bmp', 'avif'},
+    RESOURCE_FONT: {'woff', 'woff2', 'ttf', 'otf', 'eot'},
+    RESOURCE_MEDIA: {'mp4', 'webm', 'ogg', 'mp3', 'm3u8', 'ts'},
+    RESOURCE_STYLESHEET: {'css'},
+    RESOURCE_SCRIPT: {'js'},
+}
+
+BLACKHOLE = 'PROXY 127.0.0.1:9'
+PAC_PROXY_TYPES = {'https': 'PROXY', 'http': 'PROXY', 'socks4': 'SOCKS4', 'socks5': 'SOCKS5'}
+
+# объем и длительность загрузки страницы по Performance API: [байт, ресурсов]
+STATS_SCRIPT = '''
+var nav = performance.getEntriesByType('navigation')[0];
+var res = performance.getEntriesByType('resource');
+var bytes = nav ? nav.transferSize : 0;
+for (var i = 0; i < res.length; i++) { bytes += res[i].transferSize || 0; }
+return [bytes, res.length];
+'''
+
+
+def profile_preferences(types) -> dict:
+    '''настройки профиля Firefox для блокируемых типов ресурсов'''
+    preferences = dict()
+    for typ in types:
+        preferences.update(PROFILE_PREFERENCES[typ])
+    return preferences
+
+
+def pac_script(patterns, proxy=None) -> str:
+    '''
+    Сценарий автонастройки прокси: адреса по шаблонам patterns уходят на закрытый порт,
+    остальные - напрямую или через proxy (multiparser.base.ProxyData)
+    '''
+    route = 'DIRECT'
+    if proxy:
+        route = '{} {}:{}'.format(PAC_PROXY_TYPES[proxy.type], proxy.ip, proxy.port)
+    return ('function FindProxyForURL(url, host) {{\n'
+            '  var patterns = {};\n'
+            '  for (var i = 0; i < patterns.length; i++) {{\n'
+            '    if (shExpMatch(url, patterns[i])) return "{}";\n'
+            '  }}\n'
+            '  return "{}";\n'
+            '}}\n').format(json.dumps(list(patterns)), BLACKHOLE, route)
+
+
+def pac_preferences(patterns, proxy=None) -> dict:
+    '''настройки профиля Firefox, подключающие pac_script'''
+    return {
+        'network.proxy.type': 2,
+        'network.proxy.autoconfig_url': 'data:application/x-ns-proxy-autoconfig,' + quote(pac_script(patterns, proxy)),
+    }
+
+
+def resource_type(url: str, fetch_dest: str = None) -> [str, None]:
+    '''тип ресурса по заголовку Sec-Fetch-Dest, а если его нет - по расширению файла'''
+    if fetch_dest:
+        for typ, values in FETCH_DEST.items():
+            if fetch_dest in values:
+                return typ
+        return None
+    path = urlsplit(url).path
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path.rsplit('/', 1)[-1] else ''
+    for typ, values in EXTENSIONS.items():
+        if extension in values:
+            return typ
+    return None
+
+
+class ResourceInterceptor:
+    '''request_interceptor для seleniumwire: прерывает запросы блокируемых типов и адресов'''
+
+    def __init__(self, types=(), patterns=()):
+        self._types = set(types)
+        self._patterns = list(patterns)
+        self._lock = threading.Lock()
+        self.enabled = True
+        self.blocked = 0
+
+    def blocks(self, url: str, fetch_dest: str = None) -> bool:
+        if fetch_dest == 'document':
+            return False
+        if any(fnmatchcase(url, x) for x in self._patterns):
+            return True
+        return resource_type(url, fetch_dest) in self._types
+
+    def __call__(self, request):
+        if not self.enabled or not self.blocks(request.url, request.headers.get('Sec-Fetch-Dest')):
+            return
+        with self._lock:
+            self.blocked += 1
+        request.abort()
+
+    def take(self) -> int:
+        '''возвращает количество заблокированных запросов и обнуляет счетчик'''
+        with self._lock:
+            blocked, self.blocked = self.blocked, 0
+        return blocked
+
+
+class ResourceStats:
+    '''
+    Объем и время загрузки страниц.
+    Страницы, загруженные без блокировки (baseline), дают оценку сэкономленного
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages = {True: [0, 0, 0.0], False: [0, 0, 0.0]}  # blocked: [страниц, байт, секунд]
+        self.requests_blocked = 0
+
+    def add(self, bytes_loaded: int, seconds: float, blocked: bool = True, requests_blocked: int = 0):
+        with self._lock:
+            pages = self._pages[blocked]
+            pages[0] += 1
+            pages[1] += bytes_loaded
+            pages[2] += seconds
+            self.requests_blocked += requests_blocked
+
+    def pages(self) -> int:
+        '''сколько страниц учтено, с блокировкой и без'''
+        with self._lock:
+            return self._pages[True][0] + self._pages[False][0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            blocked = list(self._pages[True])
+            baseline = list(self._pages[False])
+            result = {'pages': blocked[0], 'requests_blocked': self.requests_blocked}
+        if blocked[0]:
+            result['avg_bytes'] = blocked[1] // blocked[0]
+            result['avg_seconds'] = round(blocked[2] / blocked[0], 3)
+        if blocked[0] and baseline[0]:
+            result['saved_bytes_per_page'] = baseline[1] // baseline[0] - result['avg_bytes']
+            result['saved_seconds_per_page'] = round(baseline[2] / baseline[0] - result['avg_seconds'], 3)
+        return result
+
+    def __str__(self):
+        return 'ResourceStats: ' + str(self.stats())
@@ -0,0 +1,120 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+отложенные повторы неудачных загрузок.
+
+ссылка, которая не разобралась из-за временной ошибки (статус из statuses:
+599 - нет соединения, 598 - таймаут, 597 - страница не разобралась, 429, 5xx),
+откладывается на время, растущее экспоненциально со случайной добавкой. пока
+она ждет, воркеры заняты другими ссылками; walk_site_pool возвращается к ней,
+когда время подошло, и дожидается всех отложенных ссылок перед завершением
+этапа. на каждый хост отводится не больше host_budget повторов за обход.
+'''
+
+from collections import namedtuple
+from time import monotonic
+from urllib.parse import urlsplit
+import heapq
+import logging
+import random
+
+DEFAULT_STATUSES = frozenset({429, 500, 502, 503, 504, 597, 598, 599})
+
+Failure = namedtuple('Failure', 'link status attempts')
+
+
+class RetryQueue:
+    '''
+    * statuses -- статусы http_last_status, при которых ссылка повторяется
+    * attempts -- сколько всего попыток на ссылку
+    * base_delay -- задержка перед первым повтором, секунд. дальше удваивается
+    * max_delay -- наибольшая задержка
+    * host_budget -- сколько повторов за обход допускается на один хост
+    '''
+
+    def __init__(self, statuses=DEFAULT_STATUSES, attempts: int = 4, base_delay: float = 5,
+                 max_delay: float = 300, host_budget: int = 200):
+        self._statuses = frozenset(statuses)
+        self._attempts = attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._host_budget = host_budget
+        self._heap = []
+        self._seq = 0
+        self._tries = dict()  # link: сделано попыток
+        self._budgets = dict()  # хост: сделано повторов
+        self.retried = 0
+        self.failed = []
+
+    def delay(self, attempt: int) -> float:
+        '''задержка перед повтором номер attempt (с 1): половина фиксирована, половина случайна'''
+        delay = min(self._max_delay, self._base_delay * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def retryable(self, status) -> bool:
+        return status in self._statuses
+
+    def defer(self, link, status, url: str = None) -> bool:
+        '''
+        Откладывает ссылку, если статус временный и попытки и бюджет хоста не исчерпаны.
+        Иначе ссылка попадает в failed. Возвращает True, если ссылка отложена
+        '''
+        attempts = self._tries.get(link, 0) + 1
+        if not self.retryable(status):
+            self._tries.pop(link, None)
+            return False
+        host = urlsplit(url).netloc if url else ''
+        if attempts >= self._attempts or self._budgets.get(host, 0) >= self._host_budget:
+            logging.error('giving up {} after {} attempts, status {}'.format(link, attempts, status))
+            self._tries.pop(link, None)
+            self.failed.append(Failure(link, status, attempts))
+            return False
+        self._tries[link] = attempts
+        self._budgets[host] = self._budgets.get(host, 0) + 1
+        delay = self.delay(attempts)
+        logging.warning('retry {} in {:.1f}s, status {}, attempt {}'.format(link, delay, status, attempts + 1))
+        self._seq += 1
+        heapq.heappush(self._heap, (monotonic() + delay, self._seq, link))
+        return True
+
+    def succeeded(self, link) -> None:
+        if self._tries.pop(link, None):
+            self.retried += 1
+
+    def waiting(self, typ: str = None) -> bool:
+        '''есть ли отложенные ссылки типа typ'''
+        return any(typ is None or x[2].type == typ for x in self._heap)
+
+    def due(self, typ: str = None, cnt: int = 1) -> list:
+        '''выбирает не больше cnt ссылок типа typ, время повтора которых подошло'''
+        now = monotonic()
+        result = []
+        rest = []
+        while self._heap and self._heap[0][0] <= now and len(result) < cnt:
+            item = heapq.heappop(self._heap)
+            if typ is None or item[2].type == typ:
+                result.append(item[2])
+            else:
+                rest.append(item)
+        for item in rest:
+            heapq.heappush(self._heap, item)
+        return result
+
+    def wait_time(self, typ: str = None) -> [float, None]:
+        '''сколько секунд до ближайшего повтора ссылки типа typ, None - таких нет'''
+        times = [x[0] for x in self._heap if typ is None or x[2].type == typ]
+        if not times:
+            return None
+        return max(0.0, min(times) - monotonic())
+
+    def stats(self) -> dict:
+        return {'waiting': len(self._heap), 'retried': self.retried, 'failed': len(self.failed)}
+
+    def __str__(self):
+        return 'RetryQueue: ' + str(self.stats())
@@ -0,0 +1,211 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+очередь с адаптивным повторным обходом товаров.
+
+для каждого товара хранится история наблюдений цены и остатка и оценка частоты
+их изменения (изменений в сутки). за один обход загружается не больше budget
+товаров: сначала новые, затем известные - в порядке ожидаемого количества
+изменений с последнего посещения (частота * прошедшее время). товары, у которых
+цена и остаток часто меняются, посещаются чаще стабильных.
+
+    queue = RevisitQueue('state/duim24-revisit.sqlite3', budget=5000)
+    parser.set_state(queue, SimpleHistory())
+'''
+
+from time import time
+from typing import List
+
+from .base import Link, BaseQueue, BaseParser
+from .sqlite import SqliteDatabase
+
+STATE_IDLE = 0
+STATE_QUEUED = 1
+STATE_TAKEN = 2
+
+# априорная оценка частоты: одно изменение за PRIOR_DAYS суток
+PRIOR_CHANGES = 1.0
+PRIOR_DAYS = 7.0
+DAY = 86400.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS revisit (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    price TEXT,
+    stock TEXT,
+    visits INTEGER NOT NULL DEFAULT 0,
+    changes INTEGER NOT NULL DEFAULT 0,
+    first_visit REAL,
+    last_visit REAL,
+    rate REAL NOT NULL DEFAULT 0,
+    UNIQUE (type, id)
+);
+CREATE INDEX IF NOT EXISTS revisit_state ON revisit (state, type, seq);
+'''
+
+
+def _value(value) -> [str, None]:
+    return None if value is None else repr(value)
+
+
+class RevisitQueue(BaseQueue):
+    '''
+    Очередь с приоритетом по частоте изменения цены и остатка.
+
+    * path -- файл SQLite, наблюдения сохраняются между обходами
+    * budget -- сколько товаров загружать за один обход
+    * min_interval -- не посещать товар чаще, чем раз в min_interval секунд
+    * types -- типы ссылок, для которых ведется расписание. остальные типы
+      (категории) обрабатываются как обычная очередь
+    '''
+
+    def __init__(self, path: str, budget: int = 1000, min_interval: float = 3600, types=('P',)):
+        super(BaseQueue).__init__()
+        self._db = SqliteDatabase(path, SCHEMA)
+        self._budget = budget
+        self._min_interval = min_interval
+        self._types = tuple(types)
+        self._planned = False
+
+    def _tracked(self, typ) -> bool:
+        return typ in self._types
+
+    def reset(self):
+        '''Очищает очередь текущего обхода. Наблюдения за товарами сохраняются'''
+        with self._db.transaction() as c:
+            c.execute('UPDATE revisit SET state = ?', (STATE_IDLE,))
+        self._planned = False
+
+    def put(self, links:[Link, List[Link]])->None:
+        '''
+        Добавляет в очередь. Новые ссылки ставятся в очередь сразу, известные ссылки
+        отслеживаемых типов - только по расписанию (plan)
+        '''
+        if type(links) != list:
+            links = [links]
+        links = [self.canonical(x) for x in links]
+        with self._db.transaction() as c:
+            c.executemany('INSERT OR IGNORE INTO revisit (type, id, state) VALUES (?, ?, ?)',
+                          [(x.type, str(x.id), STATE_QUEUED) for x in links])
+            c.executemany('UPDATE revisit SET state = ? WHERE type = ? AND id = ? AND state = ?',
+                          [(STATE_QUEUED, x.type, str(x.id), STATE_IDLE) for x in links if not self._tracked(x.type)])
+
+    def plan(self, now: float = None) -> int:
+        '''
+        Добавляет в очередь известные товары, пока очередь не достигнет budget.
+        Возвращает количество добавленных товаров.
+        '''
+        now = now or time()
+        self._planned = True
+        placeholders = ','.join('?' * len(self._types))
+        with self._db.transaction() as c:
+            queued = c.execute('SELECT COUNT(*) FROM revisit WHERE state != ? AND type IN ({})'.format(placeholders),
+                               (STATE_IDLE,) + self._types).fetchone()[0]
+            free = self._budget - queued
+            if free <= 0:
+                return 0
+            c.execute('UPDATE revisit SET state = ? WHERE seq IN ('
+                      ' SELECT seq FROM revisit WHERE state = ? AND type IN ({})'
+                      ' AND (last_visit IS NULL OR last_visit <= ?)'
+                      ' ORDER BY last_visit IS NOT NULL, rate * (? - last_visit) DESC LIMIT ?)'.format(placeholders),
+                      (STATE_QUEUED, STATE_IDLE) + self._types + (now - self._min_interval, now, free))
+            return c.execute('SELECT changes()').fetchone()[0]
+
+    def has(self, typ: str = None) -> bool:
+        '''проверяет наличие в очереди требуемых объектов'''
+        if not self._planned and (typ is None or self._tracked(typ)):
+            self.plan()
+        if typ != None:
+            rows = self._db.execute('SELECT EXISTS (SELECT 1 FROM revisit WHERE state = ? AND type = ?)',
+                                    (STATE_QUEUED, typ))
+        else:
+            rows = self._db.execute('SELECT EXISTS (SELECT 1 FROM revisit WHERE state = ?)', (STATE_QUEUED,))
+        return bool(rows[0][0])
+
+    def pop(self, cnt: int = 1, typ: str = None) -> list:
+        '''выбирает из очереди требуемое количество объектов и отмечает их "в работе"'''
+        if not self._planned and (typ is None or self._tracked(typ)):
+            self.plan()
+        with self._db.transaction() as c:
+            if typ != None:
+                rows = c.execute('SELECT seq, type, id FROM revisit WHERE state = ? AND type = ? ORDER BY seq LIMIT ?',
+                                 (STATE_QUEUED, typ, cnt)).fetchall()
+            else:
+                rows = c.execute('SELECT seq, type, id FROM revisit WHERE state = ? ORDER BY seq LIMIT ?',
+                                 (STATE_QUEUED, cnt)).fetchall()
+            c.executemany('UPDATE revisit SET state = ? WHERE seq = ?', [(STATE_TAKEN, row[0]) for row in rows])
+        return [Link(type=row[1], id=row[2]) for row in rows]
+
+    def done(self, links:[Link, List[Link]]) -> None:
+        if type(links) != list:
+            links = [links]
+        links = [self.canonical(x) for x in links]
+        with self._db.transaction() as c:
+            c.executemany('UPDATE revisit SET state = ? WHERE type = ? AND id = ?',
+                          [(STATE_IDLE, x.type, str(x.id)) for x in links])
+
+    def observe(self, link: Link, result: dict) -> None:
+        '''
+        Учитывает результат разбора товара: если цена или остаток изменились с прошлого
+        посещения, это изменение. Частота изменений оценивается как
+        (изменений + PRIOR_CHANGES) / (суток наблюдения + PRIOR_DAYS)
+        '''
+        if not self._tracked(link.type) or not result:
+            return
+        link = self.canonical(link)
+        now = time()
+        price = _value(result.get(BaseParser.FIELD_PRICE))
+        stock = _value(result.get(BaseParser.FIELD_STOCK))
+        with self._db.transaction() as c:
+            row = c.execute('SELECT price, stock, visits, changes, first_visit FROM revisit WHERE type = ? AND id = ?',
+                            (link.type, str(link.id))).fetchone()
+            if row is None:
+                return
+            old_price, old_stock, visits, changes, first_visit = row
+            if visits and (price != old_price or stock != old_stock):
+                changes += 1
+            first_visit = first_visit or now
+            rate = (changes + PRIOR_CHANGES) / ((now - first_visit) / DAY + PRIOR_DAYS)
+            c.execute('UPDATE revisit SET price = ?, stock = ?, visits = ?, changes = ?, first_visit = ?,'
+                      ' last_visit = ?, rate = ? WHERE type = ? AND id = ?',
+                      (price, stock, visits + 1, changes, first_visit, now, rate, link.type, str(link.id)))
+
+    def save(self):
+        pass
+
+    def restore(self):
+        '''возвращает в очередь ссылки, взятые в работу прерванным обходом'''
+        with self._db.transaction() as c:
+            c.execute('UPDATE revisit SET state = ? WHERE state = ?', (STATE_QUEUED, STATE_TAKEN))
+        self._planned = False
+
+    def contains(self, link: Link) -> bool:
+        '''
+        Проверяет наличие в очереди. Известные ссылки отслеживаемых типов считаются
+        находящимися в очереди всегда - их посещениями управляет расписание
+        '''
+        canonical = self.canonical(link)
+        rows = self._db.execute('SELECT state FROM revisit WHERE type = ? AND id = ?',
+                                (canonical.type, str(canonical.id)))
+        if not rows or (rows[0][0] == STATE_IDLE and not self._tracked(canonical.type)):
+            return False
+        self._found(link, canonical)
+        return True
+
+    def rates(self, limit: int = 10) -> list:
+        '''самые изменчивые товары: [(id, изменений в сутки, посещений, изменений), ...]'''
+        return self._db.execute('SELECT id, rate, visits, changes FROM revisit WHERE visits > 0'
+                                ' ORDER BY rate DESC LIMIT ?', (limit,))
+
+    def __str__(self):
+        rows = self._db.execute('SELECT type, COUNT(*) FROM revisit WHERE state = ? GROUP BY type', (STATE_QUEUED,))
+        return 'Queue: ' + str({t: n for t, n in rows})
@@ -0,0 +1,158 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+снимки экрана SeleniumParser.
+
+в потоке обхода браузер только отдает снимок в base64. декодирование и запись
+PNG выполняет фоновый поток. снимки успешных страниц делаются выборочно (ok_rate),
+снимки ошибок - всегда. в каталоге хранится не больше max_files снимков:
+при записи нового самые старые удаляются.
+'''
+
+from base64 import b64decode
+from queue import Queue, Full
+from time import time
+import logging
+import os
+import random
+import threading
+
+from django.conf import settings
+
+KIND_OK = 'ok'
+KIND_ERROR = 'err'
+PREFIX = 'scr-'
+
+
+class ScreenshotWriter:
+    '''
+    * directory -- каталог снимков
+    * ok_rate -- доля успешных страниц, для которых делается снимок (0 - никогда, 1 - всегда)
+    * on_error -- делать снимки при ошибках
+    * max_files -- сколько снимков хранить в каталоге
+    * queue_size -- сколько снимков может ждать записи. снимок успешной страницы
+      при полной очереди пропускается, снимок ошибки ждет места в очереди
+    '''
+
+    def __init__(self, directory: str = 'logs', ok_rate: float = 0.0, on_error: bool = True,
+                 max_files: int = 200, queue_size: int = 16):
+        self._directory = directory
+        self._ok_rate = ok_rate
+        self._on_error = on_error
+        self._max_files = max_files
+        self._queue = Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._files = None
+        self._thread = None
+        self.saved = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def wanted(self, kind: str) -> bool:
+        '''нужен ли снимок страницы: ошибки - если включены, успешные - с вероятностью ok_rate'''
+        if kind == KIND_ERROR:
+            return self._on_error
+        return self._ok_rate > 0 and random.random() < self._ok_rate
+
+    def capture(self, driver, kind: str = KIND_OK, url: str = None) -> bool:
+        '''снимает экран driver, если снимок нужен, и ставит его в очередь на запись'''
+        if not self.wanted(kind):
+            self.skipped += 1
+            return False
+        try:
+            data = driver.get_screenshot_as_base64()
+        except Exception as e:
+            logging.error('failed to take screenshot at [{}]: {}'.format(url, e))
+            return False
+        self._start()
+        item = (kind, time(), url, data)
+        try:
+            if kind == KIND_ERROR:
+                self._queue.put(item)
+            else:
+                self._queue.put_nowait(item)
+        except Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='screenshots', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                logging.error('failed to save screenshot: {}'.format(e))
+            finally:
+                self._queue.task_done()
+
+    def _existing(self) -> list:
+        names = [x for x in os.listdir(self._directory) if x.startswith(PREFIX) and x.endswith('.png')]
+        paths = [os.path.join(self._directory, x) for x in names]
+        return sorted(paths, key=os.path.getmtime)
+
+    def _write(self, kind, created, url, data):
+        if self._files is None:
+            os.makedirs(self._directory, exist_ok=True)
+            self._files = self._existing()
+        path = os.path.join(self._directory, '{}{}-{}.png'.format(PREFIX, kind, str(created).replace('.', '-')))
+        with open(path, 'wb') as f:
+            f.write(b64decode(data))
+        self.saved += 1
+        logging.debug('screenshot {} for [{}]'.format(path, url))
+        self._files.append(path)
+        while len(self._files) > self._max_files:
+            old = self._files.pop(0)
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def flush(self):
+        '''ждет записи всех снимков из очереди'''
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        '''дописывает очередь и останавливает фоновый поток'''
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        return {'saved': self.saved, 'skipped': self.skipped, 'dropped': self.dropped}
+
+    def __str__(self):
+        return 'ScreenshotWriter: ' + str(self.stats())
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_writer() -> ScreenshotWriter:
+    '''общий для процесса ScreenshotWriter с параметрами из settings'''
+    global _default
+    with _default_lock:
+        if _default is None:
+            ok_rate = settings.SELENIUM_SCREENSHOT_OK_RATE if settings.SELENIUM_SAVE_SCREENSHOT_ON_OK else 0.0
+            _default = ScreenshotWriter(directory=settings.SELENIUM_SCREENSHOT_DIR, ok_rate=ok_rate,
+                                        on_error=settings.SELENIUM_SAVE_SCREENSHOT_ON_ERROR,
+                                        max_files=settings.SELENIUM_SCREENSHOT_MAX_FILES)
+        return _default
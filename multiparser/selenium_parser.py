@@ -20,36 +20,166 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.proxy import Proxy, ProxyType
-from time import time, sleep
+from selenium.webdriver import DesiredCapabilities
+from time import time, sleep, monotonic
 from django.conf import settings
 
 from .base import BaseParser, Link, ProxyData, ParserException, format_proxy
 from .simple import SimpleHistory, SimpleQueue
+from .screenshots import default_writer, KIND_OK, KIND_ERROR
+from .resources import ResourceInterceptor, ResourceStats, profile_preferences, pac_preferences, STATS_SCRIPT
 from base64 import b64encode
 
 #from pyvirtualdisplay import Display
 #display = Display(visible=0, size=(1280, 1024))
 #display.start()
 
+# стратегии загрузки страницы (pageLoadStrategy): driver.get возвращается
+# после события load, после DOMContentLoaded или сразу
+PAGE_LOAD_NORMAL = 'normal'
+PAGE_LOAD_EAGER = 'eager'
+PAGE_LOAD_NONE = 'none'
+
+
+class Ready:
+    '''
+    Условие готовности страницы для SeleniumParser.READY.
+    condition() возвращает функцию для WebDriverWait.until
+    '''
+
+    def condition(self):
+        return self.check
+
+    def check(self, driver) -> bool:
+        pass
+
+
+class ReadySelector(Ready):
+    '''на странице есть элемент css (если visible - видимый)'''
+
+    def __init__(self, css: str, visible: bool = False):
+        self._css = css
+        self._visible = visible
+
+    def check(self, driver) -> bool:
+        elements = driver.find_elements(By.CSS_SELECTOR, self._css)
+        if self._visible:
+            return any(x.is_displayed() for x in elements)
+        return len(elements) > 0
+
+    def __repr__(self):
+        return 'ReadySelector({!r})'.format(self._css)
+
+
+class ReadyScript(Ready):
+    '''выражение JavaScript истинно, например "window.jQuery && jQuery.active == 0"'''
+
+    def __init__(self, script: str):
+        self._script = script
+
+    def check(self, driver) -> bool:
+        return bool(driver.execute_script('return !!(' + self._script + ')'))
+
+    def __repr__(self):
+        return 'ReadyScript({!r})'.format(self._script)
+
+
+class ReadyDocument(Ready):
+    '''document.readyState достиг state ('interactive' или 'complete')'''
+
+    def __init__(self, state: str = 'complete'):
+        self._states = ('interactive', 'complete') if state == 'interactive' else ('complete',)
+
+    def check(self, driver) -> bool:
+        return driver.execute_script('return document.readyState') in self._states
+
+    def __repr__(self):
+        return 'ReadyDocument({!r})'.format(self._states[0])
+
+
+class ReadyNetworkIdle(Ready):
+    '''документ загружен и в течение idle секунд не начиналась загрузка новых ресурсов (Performance API)'''
+
+    SCRIPT = "return [document.readyState, performance.getEntriesByType('resource').length]"
+
+    def __init__(self, idle: float = 0.5):
+        self._idle = idle
+
+    def condition(self):
+        last = {'count': None, 'since': monotonic()}
+
+        def check(driver) -> bool:
+            state, count = driver.execute_script(self.SCRIPT)
+            now = monotonic()
+            if state == 'loading' or count != last['count']:
+                last['count'] = count
+                last['since'] = now
+                return False
+            return now - last['since'] >= self._idle
+        return check
+
+    def __repr__(self):
+        return 'ReadyNetworkIdle({})'.format(self._idle)
+
 
 class SeleniumParser(BaseParser):
 
-    def __init__(self, base_url=None, virtual_display=False, proxy:ProxyData=None):
+    PAGE_LOAD_STRATEGY = PAGE_LOAD_NORMAL
+    PAGE_LOAD_TIMEOUT = 60
+    IMPLICIT_WAIT = 0  # неявное ожидание элементов, секунд. готовность страницы задается в READY
+    # условия готовности страницы по типу ссылки: {'P': [ReadySelector('h1[itemprop=name]')], '*': [...]}
+    # '*' - для остальных типов. страница возвращается, как только выполнены все условия
+    # или истек READY_TIMEOUT (по умолчанию settings.SELENIUM_WAIT_TO_LOAD)
+    READY = {}
+    READY_TIMEOUT = None
+    READY_POLL = 0.2
+    # блокируемые типы ресурсов (RESOURCE_IMAGE, ...) и шаблоны адресов, см. multiparser.resources
+    BLOCK_RESOURCES = set()
+    BLOCK_URLS = []
+    # с авторизацией на прокси каждая BLOCK_BASELINE-я страница загружается без блокировки,
+    # чтобы оценить сэкономленные байты и время. 0 - не загружать
+    BLOCK_BASELINE = 0
+
+    def __init__(self, base_url=None, virtual_display=False, proxy:ProxyData=None, pool=None, screenshots=None):
+        '''
+        * pool -- multiparser.browser_pool.BrowserPool. если задан, драйвер берется из пула
+          и возвращается в него в __exit__, виртуальный дисплей принадлежит пулу
+        * screenshots -- multiparser.screenshots.ScreenshotWriter, по умолчанию общий, настроенный из settings
+        '''
         super().__init__(base_url, virtual_display, proxy)
         self._base_url = base_url
-        self._history = SimpleHistory()
-        self._queue = SimpleQueue()
+        self.set_state(SimpleQueue(), SimpleHistory())
         self._driver = None
         self._display = None
         self._last_status = None
         self._skip_base_url = False
+        self._pool = pool
+        self._lease = None
+        self._warming = False
+        self._resource_stats = ResourceStats()
+        self._screenshots = screenshots or default_writer()
 
     def __enter__(self):
-        if self._virtual_display:
-            from pyvirtualdisplay import Display
-            self._display = Display(visible=0, size=(1920, 1080))
-            self._display.start()
+        if self._pool:
+            self._lease = self._pool.lease(self)
+            self._driver = self._lease.driver
+        else:
+            if self._virtual_display:
+                from pyvirtualdisplay import Display
+                self._display = Display(visible=0, size=(1920, 1080))
+                self._display.start()
+            self._driver = self.create_driver()
+        try:
+            self.warm_up()
+        except ParserException:
+            if self._lease:
+                self._pool.release(self._lease, broken=True)
+                self._lease = None
+            raise
+        return self
 
+    def create_driver(self):
+        '''создает и настраивает Firefox с прокси парсера'''
         options = None
         if self._proxy and self._proxy.auth:
             from seleniumwire import webdriver
@@ -83,7 +213,10 @@ class SeleniumParser(BaseParser):
                 }
             fp.set_preference("http.response.timeout", 30)
             fp.set_preference("dom.max_script_run_time", 30)
-            self._driver = webdriver.Firefox(firefox_profile=fp, seleniumwire_options=options)
+            driver = webdriver.Firefox(firefox_profile=fp, seleniumwire_options=options,
+                                       capabilities=self._capabilities())
+            if self.BLOCK_RESOURCES or self.BLOCK_URLS:
+                driver.request_interceptor = ResourceInterceptor(self.BLOCK_RESOURCES, self.BLOCK_URLS)
         elif self._proxy:
             from selenium import webdriver
             fp = webdriver.FirefoxProfile()
@@ -111,20 +244,62 @@ class SeleniumParser(BaseParser):
                 fp.update_preferences()
             fp.set_preference("http.response.timeout", 30)
             fp.set_preference("dom.max_script_run_time", 30)
-            self._driver = webdriver.Firefox(firefox_profile=fp)
+            self._block_preferences(fp)
+            driver = webdriver.Firefox(firefox_profile=fp, capabilities=self._capabilities())
         else:
             from selenium import webdriver
             fp = webdriver.FirefoxProfile()
             fp.set_preference("http.response.timeout", 30)
             fp.set_preference("dom.max_script_run_time", 30)
-            self._driver = webdriver.Firefox(firefox_profile=fp)
+            self._block_preferences(fp)
+            driver = webdriver.Firefox(firefox_profile=fp, capabilities=self._capabilities())
+
+        driver.set_page_load_timeout(self.PAGE_LOAD_TIMEOUT)
+        driver.implicitly_wait(self.IMPLICIT_WAIT)
+        driver.maximize_window()
+        return driver
+
+    def _block_preferences(self, fp):
+        '''настройки профиля, блокирующие BLOCK_RESOURCES и BLOCK_URLS (без seleniumwire)'''
+        preferences = profile_preferences(self.BLOCK_RESOURCES)
+        if self.BLOCK_URLS:
+            preferences.update(pac_preferences(self.BLOCK_URLS, self._proxy))
+        for name, value in preferences.items():
+            fp.set_preference(name, value)
+        fp.update_preferences()
+
+    def _interceptor(self) -> [ResourceInterceptor, None]:
+        interceptor = getattr(self._driver, 'request_interceptor', None)
+        return interceptor if isinstance(interceptor, ResourceInterceptor) else None
+
+    def _record_resources(self, url, started, interceptor, baseline):
+        '''учитывает объем и время загрузки страницы'''
+        try:
+            bytes_loaded, resources = self._driver.execute_script(STATS_SCRIPT)
+        except WebDriverException:
+            return
+        blocked = interceptor.take() if interceptor else 0
+        seconds = monotonic() - started
+        self._resource_stats.add(bytes_loaded, seconds, not baseline, blocked)
+        logging.debug('{}[{}]: {} bytes in {} resources, {:.2f}s, {} requests blocked'.format(
+            'baseline ' if baseline else '', url, bytes_loaded, resources, seconds, blocked))
 
-        self._driver.set_page_load_timeout(60)
-        self._driver.implicitly_wait(30)
-        self._driver.maximize_window()
+    def resource_stats(self) -> dict:
+        '''объем и время загрузки страниц, сэкономленное блокировкой (если есть baseline)'''
+        return self._resource_stats.stats()
 
-        if not self._skip_base_url:
-            root_url = self.base_url()
+    def warm_up(self):
+        '''
+        Открывает главную страницу сайта (до трех попыток).
+        Драйвер из пула прогревается для сайта один раз
+        '''
+        if self._skip_base_url:
+            return
+        root_url = self.base_url()
+        if self._lease and root_url in self._lease.warmed:
+            return
+        self._warming = True
+        try:
             soup = self.http_get(root_url, root_url)
             if not soup:
                 soup = self.http_get(root_url, root_url)
@@ -135,11 +310,65 @@ class SeleniumParser(BaseParser):
                         logging.error(s)
 
                         raise ParserException(s)
+        finally:
+            self._warming = False
+        if self._lease:
+            self._lease.warmed.add(root_url)
 
-        return self
+    def _capabilities(self) -> dict:
+        capabilities = DesiredCapabilities.FIREFOX.copy()
+        capabilities['pageLoadStrategy'] = self.PAGE_LOAD_STRATEGY
+        return capabilities
+
+    def ready_conditions(self, typ=None) -> list:
+        '''условия готовности для страницы типа typ'''
+        conditions = self.READY.get(typ) or self.READY.get('*') or []
+        if not conditions and self.PAGE_LOAD_STRATEGY == PAGE_LOAD_NONE:
+            conditions = [ReadyDocument('interactive')]
+        return conditions
+
+    def wait_ready(self, url, typ=None) -> bool:
+        '''
+        Ждет выполнения условий готовности страницы.
+        Возвращает False, если за READY_TIMEOUT они не выполнились
+        '''
+        conditions = self.ready_conditions(typ)
+        if not conditions:
+            return True
+        timeout = self.READY_TIMEOUT or settings.SELENIUM_WAIT_TO_LOAD
+        deadline = monotonic() + timeout
+        for ready in conditions:
+            try:
+                WebDriverWait(self._driver, max(0, deadline - monotonic()), poll_frequency=self.READY_POLL)\
+                    .until(ready.condition())
+            except TimeoutException:
+                logging.warning('{} is not ready in {}s at [{}]'.format(ready, timeout, url))
+                return False
+        return True
+
+    def browser_key(self) -> tuple:
+        '''драйверы в пуле взаимозаменяемы для парсеров с одинаковым ключом'''
+        return (self.proxy_string(), self.PAGE_LOAD_STRATEGY,
+                tuple(sorted(self.BLOCK_RESOURCES)), tuple(self.BLOCK_URLS))
+
+    def _check_lease(self):
+        '''заменяет драйвер из пула, отработавший свой срок'''
+        if not self._lease or self._warming or not self._pool.expired(self._lease):
+            return
+        self._pool.release(self._lease)
+        self._lease = self._pool.lease(self)
+        self._driver = self._lease.driver
+        self.warm_up()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._driver.close()
+        if self.BLOCK_RESOURCES or self.BLOCK_URLS:
+            logging.info(str(self._resource_stats))
+        self._screenshots.flush()
+        if self._lease:
+            self._pool.release(self._lease)
+            self._lease = None
+        else:
+            self._driver.close()
         if self._display:
             self._display.stop()
         if exc_val:
@@ -151,35 +380,58 @@ class SeleniumParser(BaseParser):
         while n>0:
             soup = self.http_get(url, referrer)
             if soup: return soup
+            n -= 1
         return None
 
-    def http_get(self, url, referrer, encoding=None)->[BeautifulSoup, None]:
+    def http_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
+        self._check_lease()
+        self.rate_limit(url)
+        blocking = bool(self.BLOCK_RESOURCES or self.BLOCK_URLS)
+        interceptor = self._interceptor()
+        baseline = False
+        if interceptor:
+            interceptor.take()
+            baseline = bool(self.BLOCK_BASELINE) and self._resource_stats.pages() % self.BLOCK_BASELINE == 0
+            interceptor.enabled = not baseline
+        started = monotonic()
         try:
             res = self._driver.get(url)
-            self.sleep(5)
+            self.wait_ready(url, typ)
             content = self._driver.execute_script("return document.body.outerHTML")
-            soup = BeautifulSoup(content, 'html5lib')
-            if not soup:
-                logging.error('soup failed at [{}]'.format(url))
-                if settings.SELENIUM_SAVE_SCREENSHOT_ON_ERROR:
-                    self._driver.save_screenshot('logs/scr-err-' + str(time()).replace('.','-') + '.png')
-                self._last_status = 597
-                return None
             self._last_status = 200
-            self._driver.save_screenshot('logs/scr-ok-' + str(time()).replace('.', '-') + '.png')
-            return soup
+            if blocking:
+                self._record_resources(url, started, interceptor, baseline)
+            if self._lease:
+                self._lease.pages += 1
+            return content
         except TimeoutException as e:
             logging.error('selenium TimeoutException at [{}] {}'.format(url, str(e)))
             self._last_status = 598
-            if settings.SELENIUM_SAVE_SCREENSHOT_ON_ERROR:
-                self._driver.save_screenshot('scr-' + str(time()).replace('.','-') + '.png')
+            if self._lease:
+                self._lease.errors += 1
+            self._screenshots.capture(self._driver, KIND_ERROR, url)
             return None
         except WebDriverException as e:
             logging.error('selenium WebDriverException at [{}] {}'.format(url, str(e)))
             self._last_status = 599
-            if settings.SELENIUM_SAVE_SCREENSHOT_ON_ERROR:
-                self._driver.save_screenshot('scr-' + str(time()).replace('.','-') + '.png')
+            if self._lease:
+                self._lease.errors += 1
+            self._screenshots.capture(self._driver, KIND_ERROR, url)
+            return None
+
+    def http_get(self, url, referrer, encoding=None, builder=None, typ=None)->[BeautifulSoup, None]:
+        content = self.http_get_text(url, referrer, encoding, typ)
+        if content is None:
+            return None
+        soup = self.make_soup(content, url, builder, typ)
+        if soup is None and self.page_unchanged():
+            return None  # страница не изменилась, см. parse_product_cached
+        if not soup:
+            self._screenshots.capture(self._driver, KIND_ERROR, url)
+            self._last_status = 597
             return None
+        self._screenshots.capture(self._driver, KIND_OK, url)
+        return soup
 
     def http_last_status(self):
         return self._last_status
@@ -190,7 +442,7 @@ class SeleniumParser(BaseParser):
             links = [links]
         results = dict()
         for link in links:
-            result = self.parse_product(link, fields)
+            result = self.parse_product_cached(link, fields)
             if result:
                 results[link] = result
         return results
@@ -39,11 +39,13 @@ class SimpleQueue(BaseQueue):
 
         if type(links) != list:
             links = [links]
-        for link in links:
+        for raw in links:
+            link = self.canonical(raw)
             if link.type not in self._s:
                 self._q[link.type] = deque()
                 self._s[link.type] = set()
             if link in self._s[link.type]:
+                self._found(raw, link)
                 continue
             self._s[link.type].add(link)
             self._q[link.type].append(link)
@@ -75,9 +77,11 @@ class SimpleQueue(BaseQueue):
 
     def contains(self, link: Link) -> bool:
         '''проверяет наличи в списке'''
-        if link.type not in self._s:
+        canonical = self.canonical(link)
+        if canonical.type not in self._s or canonical not in self._s[canonical.type]:
             return False
-        return link in self._s[link.type]
+        self._found(link, canonical)
+        return True
 
     def __str__(self):
         return 'Queue: ' + str({t: len(self._q[t]) for t in self._q})
@@ -97,11 +101,15 @@ class SimpleHistory(BaseHistory):
         if type(links) != list:
             links = [links]
         for link in links:
-            self._s.add(link)
+            self._s.add(self.canonical(link))
 
     def contains(self,link: Link) -> bool:
         '''проверяет наличи в истории'''
-        return link in self._s
+        canonical = self.canonical(link)
+        if canonical not in self._s:
+            return False
+        self._found(link, canonical)
+        return True
 
     def __str__(self):
         return str('History: {} items'.format(len(self._s)))
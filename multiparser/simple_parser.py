@@ -11,9 +11,14 @@
 from typing import List
 from socket import gaierror
 from .base import BaseParser, Link, ProxyData, ParserException, format_proxy
+from .base import STATUS_CACHE_FRESH, STATUS_CACHE_VALIDATED, PROXY_FAIL_STATUSES
+from .proxy_pool import requests_proxies
+from .transport import Transport
 from .simple import SimpleHistory, SimpleQueue
+from time import time, monotonic
 import requests
 import logging
+import threading
 from bs4 import BeautifulSoup
 from requests.exceptions import ConnectionError
 import brotli
@@ -22,17 +27,23 @@ from .base import BaseParser, Link, ProxyData, ParserException
 from .simple import SimpleHistory, SimpleQueue
 from django.conf import settings
 from requests.adapters import HTTPAdapter
-requests.adapters.DEFAULT_RETRIES = 30
 
 class SimpleParser(BaseParser):
+
+    POOL_MAXSIZE = None  # соединений на хост, по умолчанию max(число потоков, 10), см. set_workers
+    HTTP2 = False  # HTTP/2 через httpx, см. multiparser.transport
+
     def __init__(self, base_url, virtual_display=False, proxy:ProxyData=None):
         super().__init__(base_url, virtual_display, proxy)
         self._base_url = base_url
-        self._history = SimpleHistory()
-        self._queue = SimpleQueue()
+        self.set_state(SimpleQueue(), SimpleHistory())
+        self._local = threading.local()
         self._session = None
         self._result = None
         self._status_code = 0
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        self._workers = self.WORKERS
         self._proxy = None
         if proxy:
             if proxy.type == 'https':
@@ -42,63 +53,181 @@ class SimpleParser(BaseParser):
 
             logging.info("proxy used: {}".format(format_proxy(self._proxy)))
 
+    # сессия, последний ответ и его статус у каждого потока свои,
+    # поэтому один экземпляр парсера можно использовать из нескольких воркеров
+
+    @property
+    def _session(self):
+        return getattr(self._local, 'session', None)
+
+    @_session.setter
+    def _session(self, value):
+        self._local.session = value
+
+    @property
+    def _result(self):
+        return getattr(self._local, 'result', None)
+
+    @_result.setter
+    def _result(self, value):
+        self._local.result = value
+
+    @property
+    def _status_code(self):
+        return getattr(self._local, 'status_code', 0)
+
+    @_status_code.setter
+    def _status_code(self, value):
+        self._local.status_code = value
+
     def _start_session(self):
-        self._session = requests.session()
+        '''открывает сессию текущего потока на транспорте парсера, пулы соединений общие для всех потоков'''
+        with self._transport_lock:
+            if self._transport is None:
+                self._transport = Transport(self.mozilla_headers(), self._pool_maxsize(),
+                                            http2=self.HTTP2)
+                if self._proxy:
+                    self._transport.session.proxies.update({
+                        "https": format_proxy(self._proxy),
+                        "http": format_proxy(self._proxy),
+                    })
+            self._session = self._transport.thread_session()
         if not self._session:
             raise ParserException("requests.session failed")
 
-        if self._proxy:
-            self._session.proxies.update({
-                "https": format_proxy(self._proxy),
-                "http": format_proxy(self._proxy),
-            })
-
-    def mozilla_headers(self):
-        return {
-            'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
-            'accept-encoding': 'gzip, deflate, br',
-            'accept-language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
-            'cache-control': 'max-age=0',
-            'sec-fetch-dest': 'document',
-            'sec-fetch-mode': 'navigate',
-            'sec-fetch-site': 'none',
-            'upgrade-insecure-requests': '1',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/85.0.4183.121 Safari/537.36 OPR/71.0.3770.284',
-        }
-
-    def http_get_text(self, url, referrer)->[str, None]:
-        self._session.headers.update(self.mozilla_headers())
-        self._session.headers.update({'referer': referrer})
+    def _request_proxies(self, proxy) -> [dict, None]:
+        '''прокси из пула передается в каждый запрос, постоянный прокси задан в сессии'''
+        if self._proxy_pool is None or proxy is None:
+            return None
+        return requests_proxies(proxy)
+
+    def start_session(self):
+        '''открывает сессию для текущего потока'''
+        if not self._session:
+            self._start_session()
+
+    def _pool_maxsize(self) -> int:
+        return self.POOL_MAXSIZE or max(self._workers, 10)
+
+    def set_workers(self, workers: int):
+        '''пул соединений растет до числа потоков обхода, если POOL_MAXSIZE не задан'''
+        self._workers = workers
+        with self._transport_lock:
+            if self._transport is not None:
+                self._transport.grow(self._pool_maxsize())
+
+    def http_get_text(self, url, referrer, encoding=None, typ=None)->[str, None]:
+        '''
+        Загружает страницу. Если подключен кеш (set_cache), страница в пределах
+        CACHE_TTL[typ] берется из кеша, иначе отправляется условный запрос.
+        '''
+        self._status_code = 0
+        key, entry = self._cache_lookup(url, typ)
+        if entry and self._status_code == STATUS_CACHE_FRESH:
+            return entry.text
+        headers = {'referer': referrer}
+        headers.update(self._cache_headers(entry))
+        proxy = None
         try:
-            self._result = self._session.get(url, timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
-            if not self._result:
+            proxy = self.next_proxy()
+            self.rate_limit(url)
+            started = monotonic()
+            self._result = self._session.get(url, headers=headers, proxies=self._request_proxies(proxy),
+                                             timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
+            if self._result is not None:
+                self.report_proxy(proxy, self._result.status_code not in PROXY_FAIL_STATUSES, monotonic() - started)
+            if self._result is None:
                 self._status_code = 599
                 logging.error('URL failed no result at [{}] '.format(url))
                 return None
             self._status_code = self._result.status_code
+            if self._status_code == STATUS_CACHE_VALIDATED and entry:
+                self._cache.touch(key)
+                return entry.text
             if self._status_code != 200:
                 logging.error('URL failed status code=[{}] at [{}] '.format(self._status_code, url))
                 return None
+            if encoding:
+                self._result.encoding = encoding
             result_text = self._result.text
+            self._cache_store(key, result_text, self._result.headers, typ)
             return result_text
+        except requests.Timeout as e:
+            self._status_code = 598
+            self.report_proxy(proxy, False)
+            logging.error('Timeout at [{}] {}'.format(url, e))
+            return None
         except ConnectionError as e:
             self._status_code = 599
+            self.report_proxy(proxy, False)
             logging.error('ConnectionError at [{}] {}'.format(url, e))
             return None
         except gaierror as e:
             self._status_code = 599
+            self.report_proxy(proxy, False)
             logging.error('socket.gaierror at [{}] {}'.format(url, e))
             return None
+        except requests.RequestException as e:
+            self._status_code = 599
+            self.report_proxy(proxy, False)
+            logging.error('RequestException at [{}] {}'.format(url, e))
+            return None
+        except ParserException as e:
+            self._status_code = 599
+            logging.error('{} at [{}]'.format(e, url))
+            return None
+
+    def _cache_lookup(self, url, typ=None) -> (str, object):
+        '''
+        ключ и запись кеша для url. если запись моложе CACHE_TTL[typ], статус - STATUS_CACHE_FRESH
+        и запись можно вернуть без запроса
+        '''
+        key = self.cache_key(url)
+        entry = self._cache.get(key) if self._cache else None
+        if entry and time() - entry.fetched_at < self.CACHE_TTL.get(typ, 0):
+            self._status_code = STATUS_CACHE_FRESH
+            self._cache.hit()
+        return key, entry
 
+    def _cache_headers(self, entry) -> dict:
+        '''заголовки условного запроса для записи кеша'''
+        headers = dict()
+        if entry and entry.etag:
+            headers['if-none-match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['if-modified-since'] = entry.last_modified
+        return headers
 
-    def http_get(self, url, referrer, encoding=None)->[BeautifulSoup, None]:
+    def _cache_store(self, key, text, response_headers, typ=None):
+        '''сохраняет ответ 200 в кеш, если его можно проверить условным запросом или задан CACHE_TTL[typ]'''
+        if not self._cache:
+            return
+        self._cache.miss()
+        etag = response_headers.get('etag')
+        last_modified = response_headers.get('last-modified')
+        if etag or last_modified or self.CACHE_TTL.get(typ, 0):
+            self._cache.put(key, text, etag, last_modified)
+
+    def http_get(self, url, referrer, encoding=None, builder=None, typ=None)->[BeautifulSoup, None]:
         logging.info("http_get({}) {}".format(url, self.__class__))
-        self._session.headers.update(self.mozilla_headers())
-        self._session.headers.update({'referer': referrer})
+        text = self.http_get_text(url, referrer, encoding, typ)
+        if text is None:
+            return None
+        return self.make_soup(text, url, builder, typ)
+
+    def http_post(self, url, referrer, form_data=None, builder=None, typ=None)->[BeautifulSoup, None]:
+        self._status_code = 0
+        proxy = None
         try:
-            logging.info("{} {} {}".format(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT, self.__class__))
-            self._result = self._session.get(url, timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
-            if not self._result:
+            proxy = self.next_proxy()
+            self.rate_limit(url)
+            started = monotonic()
+            self._result = self._session.post(url, data=form_data, headers={'referer': referrer},
+                                              proxies=self._request_proxies(proxy),
+                                              timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
+            if self._result is not None:
+                self.report_proxy(proxy, self._result.status_code not in PROXY_FAIL_STATUSES, monotonic() - started)
+            if self._result is None:
                 self._status_code = 599
                 logging.error('URL failed no result at [{}] '.format(url))
                 return None
@@ -106,47 +235,30 @@ class SimpleParser(BaseParser):
             if self._status_code != 200:
                 logging.error('URL failed status code=[{}] at [{}] '.format(self._status_code, url))
                 return None
-            if encoding:
-                self._result.encoding = encoding
-            soup = BeautifulSoup(self._result.text, 'html5lib')
-            if not soup:
-                logging.error('soup failed at [{}]'.format(url))
-                return None
-            return soup
+            return self.make_soup(self._result.text, url, builder, typ)
+        except requests.Timeout as e:
+            self._status_code = 598
+            self.report_proxy(proxy, False)
+            logging.error('Timeout at [{}] {}'.format(url, e))
+            return None
         except ConnectionError as e:
             self._status_code = 599
+            self.report_proxy(proxy, False)
             logging.error('ConnectionError at [{}] {}'.format(url, e))
             return None
         except gaierror as e:
             self._status_code = 599
+            self.report_proxy(proxy, False)
             logging.error('socket.gaierror at [{}] {}'.format(url, e))
             return None
-
-    def http_post(self, url, referrer, form_data=None)->[BeautifulSoup, None]:
-        self._session.headers.update(self.mozilla_headers())
-        self._session.headers.update({'referer': referrer})
-        try:
-            self._result = self._session.post(url, data=form_data, timeout=(settings.REQUESTS_CONNECTION_TIMEOUT, settings.REQUESTS_DATA_TIMEOUT))
-            if not self._result:
-                self._status_code = 599
-                logging.error('URL failed no result at [{}] '.format(url))
-                return None
-            self._status_code = self._result.status_code
-            if self._status_code != 200:
-                logging.error('URL failed status code=[{}] at [{}] '.format(self._status_code, url))
-                return None
-            soup = BeautifulSoup(self._result.text, 'html5lib')
-            if not soup:
-                logging.error('soup failed at [{}]'.format(url))
-                return None
-            return soup
-        except ConnectionError as e:
+        except requests.RequestException as e:
             self._status_code = 599
-            logging.error('ConnectionError at [{}] {}'.format(url, e))
+            self.report_proxy(proxy, False)
+            logging.error('RequestException at [{}] {}'.format(url, e))
             return None
-        except gaierror as e:
+        except ParserException as e:
             self._status_code = 599
-            logging.error('socket.gaierror at [{}] {}'.format(url, e))
+            logging.error('{} at [{}]'.format(e, url))
             return None
 
     def http_last_status(self):
@@ -157,9 +269,19 @@ class SimpleParser(BaseParser):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._transport:
+            logging.info(str(self._transport))
+            self._transport.close()
+            self._transport = None
         if exc_val:
             raise
 
+    def pool_stats(self) -> dict:
+        '''запросы по открытым соединениям (hits) и открытые соединения (misses) по хостам'''
+        if self._transport:
+            return self._transport.stats()
+        return {}
+
     def __str__(self):
         return('{}({})'.format(self.__class__.__name__, self._base_url))
 
@@ -170,7 +292,7 @@ class SimpleParser(BaseParser):
             links = [links]
         results = dict()
         for link in links:
-            result = self.parse_product(link, fields)
+            result = self.parse_product_cached(link, fields)
             if result:
                 results[link] = result
         return results
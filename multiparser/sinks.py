@@ -0,0 +1,311 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+приемники результатов разбора.
+
+результаты товаров не копятся в памяти: каждый (Link, result) передается в
+SinkWriter, который через ограниченный буфер отдает его приемникам в отдельном
+потоке. запись в файл, базу или по HTTP идет параллельно с загрузкой страниц,
+а если приемник не успевает, обход ждет, пока в буфере освободится место.
+
+    with SinkWriter([JsonlSink('out/duim24.jsonl'), SqliteSink('out/results.sqlite3')]) as writer:
+        parser.walk_site_pool(..., on_product=writer.put)
+
+или то же самое: parser.stream_products(sinks, ...). для обработки в своем коде
+есть генератор parser.iter_products(...).
+'''
+
+from time import time
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+
+import requests
+
+from .sqlite import SqliteDatabase
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS result (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (type, id)
+);
+'''
+
+
+def json_default(value):
+    '''множества (например pages) сохраняются списками, остальное - строкой'''
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=json_default)
+
+
+def _makedirs(path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+class BaseSink:
+    '''Базовый виртуальный класс приемника результатов. write вызывается из одного потока SinkWriter'''
+
+    def write(self, link, result: dict) -> None:
+        '''
+        Сохраняет результат товара
+
+        * виртуальный метод.
+        '''
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class JsonlSink(BaseSink):
+    '''по строке JSON на результат: {"type": ..., "id": ..., "result": {...}}'''
+
+    def __init__(self, path: str, append: bool = True):
+        _makedirs(path)
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, link, result: dict) -> None:
+        self._file.write(dumps({'type': link.type, 'id': link.id, 'result': result}) + '\n')
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CsvSink(BaseSink):
+    '''
+    CSV с колонками type, id и fields. если fields не заданы, берутся поля первого результата.
+    списки и словари записываются в JSON
+    '''
+
+    def __init__(self, path: str, fields: list = None, delimiter: str = ';'):
+        _makedirs(path)
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        self._csv = csv.writer(self._file, delimiter=delimiter)
+        self._fields = sorted(fields) if fields else None
+        self._header = not exists
+
+    def write(self, link, result: dict) -> None:
+        if self._fields is None:
+            self._fields = sorted(result)
+        if self._header:
+            self._csv.writerow(['type', 'id'] + self._fields)
+            self._header = False
+        row = [link.type, link.id]
+        for field in self._fields:
+            value = result.get(field)
+            if isinstance(value, (dict, list, tuple, set, frozenset)):
+                value = dumps(value)
+            row.append('' if value is None else value)
+        self._csv.writerow(row)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class SqliteSink(BaseSink):
+    '''результаты в таблице result файла SQLite, по batch записей в транзакции. повторный разбор заменяет запись'''
+
+    def __init__(self, path: str, batch: int = 200):
+        self._db = SqliteDatabase(path, SCHEMA)
+        self._batch = batch
+        self._rows = []
+
+    def write(self, link, result: dict) -> None:
+        self._rows.append((link.type, str(link.id), dumps(result), time()))
+        if len(self._rows) >= self._batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        with self._db.transaction() as c:
+            c.executemany('INSERT OR REPLACE INTO result (type, id, result, saved_at) VALUES (?, ?, ?, ?)', rows)
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
+
+
+class HttpSink(BaseSink):
+    '''
+    отправляет результаты POST-запросом пачками по batch: JSON-список записей как в JsonlSink.
+
+    неотправленная пачка остается в памяти и уходит вместе со следующей, пока в памяти
+    не больше max_pending записей, более старые теряются (lost). после ошибки write не
+    отправляет пачки retry_seconds секунд, flush пробует всегда. записи, не отправленные
+    к close, теряются. для API результатов с сохранением на диск - multiparser.uploader.ResultUploader
+    '''
+
+    def __init__(self, url: str, batch: int = 100, headers: dict = None, timeout: float = 60,
+                 max_pending: int = None, retry_seconds: float = 30):
+        self._url = url
+        self._batch = batch
+        self._timeout = timeout
+        self._max_pending = max_pending or batch * 10
+        self._retry_seconds = retry_seconds
+        self._retry_at = 0.0
+        self._session = requests.session()
+        self._session.headers.update(headers or {})
+        self._records = []
+        self.sent = 0
+        self.failed = 0  # записей в неудачных отправках, включая повторные
+        self.lost = 0
+
+    def write(self, link, result: dict) -> None:
+        self._records.append({'type': link.type, 'id': link.id, 'result': result})
+        if len(self._records) >= self._batch and time() >= self._retry_at:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._records:
+            return
+        records, self._records = self._records, []
+        try:
+            response = self._session.post(self._url, data=dumps(records).encode('utf-8'), timeout=self._timeout,
+                                          headers={'Content-Type': 'application/json'})
+            response.raise_for_status()
+            self.sent += len(records)
+            self._retry_at = 0.0
+        except requests.RequestException as e:
+            self.failed += len(records)
+            self._retry_at = time() + self._retry_seconds
+            self._records = records + self._records
+            logging.error('{} results are not sent, will retry: {} [{}]'.format(len(records), e, self._url))
+            overflow = len(self._records) - self._max_pending
+            if overflow > 0:
+                self._records = self._records[overflow:]
+                self.lost += overflow
+                logging.error('{} results are lost [{}]'.format(overflow, self._url))
+
+    def close(self) -> None:
+        self.flush()
+        if self._records:
+            self.lost += len(self._records)
+            logging.error('{} results are lost [{}]'.format(len(self._records), self._url))
+            self._records = []
+        self._session.close()
+
+
+class SinkWriter:
+    '''
+    Передает результаты приемникам в отдельном потоке.
+
+    * sinks -- список приемников (BaseSink)
+    * maxsize -- размер буфера. put ждет, если в буфере maxsize результатов
+    * flush_every -- вызывать flush приемников не реже, чем раз в столько секунд
+    '''
+
+    def __init__(self, sinks: list, maxsize: int = 100, flush_every: float = 5):
+        self._sinks = list(sinks)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._flush_every = flush_every
+        self._closed = False
+        self.written = 0
+        self.errors = 0
+        self.waited = 0.0  # сколько секунд put ждал места в буфере
+        self._thread = threading.Thread(target=self._run, name='SinkWriter', daemon=True)
+        self._thread.start()
+
+    def put(self, link, result: dict) -> None:
+        '''передает результат приемникам. подходит как on_product для walk_site_pool'''
+        if self._closed:
+            raise RuntimeError('SinkWriter is closed')
+        try:
+            self._queue.put_nowait((link, result))
+        except queue.Full:
+            started = time()
+            self._queue.put((link, result))
+            self.waited += time() - started
+
+    def _run(self):
+        flushed = time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self._flush_every)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                for sink in self._sinks:
+                    try:
+                        sink.write(*item)
+                    except Exception as e:
+                        self.errors += 1
+                        logging.exception('sink {} failed on {}: {}'.format(sink.__class__.__name__, item[0], e))
+                self.written += 1
+            if time() - flushed >= self._flush_every:
+                self._flush()
+                flushed = time()
+        self._flush()
+
+    def _flush(self):
+        for sink in self._sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                self.errors += 1
+                logging.exception('sink {} flush failed: {}'.format(sink.__class__.__name__, e))
+
+    def close(self) -> None:
+        '''дожидается записи всех результатов и закрывает приемники'''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        for sink in self._sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                self.errors += 1
+                logging.exception('sink {} close failed: {}'.format(sink.__class__.__name__, e))
+        logging.info(str(self))
+
+    def stats(self) -> dict:
+        return {'written': self.written, 'errors': self.errors, 'waited': round(self.waited, 3)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __str__(self):
+        return 'SinkWriter: ' + str(self.stats())
@@ -0,0 +1,241 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+снимки цен и остатков по магазинам и дням (pip install numpy).
+
+результаты товаров хранятся по колонкам в файлах root/<магазин>/<ГГГГ-ММ-ДД>.npz,
+строки отсортированы по ссылке. несколько обходов за день сливаются в один
+снимок (побеждает более поздний результат). сравнение двух снимков -
+пересечение отсортированных массивов ссылок и поэлементное сравнение колонок,
+без цикла по товарам, поэтому сотни тысяч строк сравниваются за доли секунды.
+
+    store = SnapshotStore('state/snapshots')
+    with store.writer('duim24') as writer:
+        parser.stream_products([writer], ...)
+    print(store.diff('duim24'))  # два последних дня
+'''
+
+from datetime import date, datetime
+import logging
+import os
+
+import numpy as np
+
+STOCK_UNKNOWN = -1  # остаток не указан на странице
+
+# колонки снимка: имя, поле результата, тип
+COLUMNS = (
+    ('url', None, 'S'),
+    ('articul', 'articul', 'S'),
+    ('name', 'name', 'S'),
+    ('price', 'price', np.float64),
+    ('stock', 'stock', np.int64),
+    ('parsed_at', 'parsed_at', np.float64),
+)
+
+
+def _text(value) -> bytes:
+    return b'' if value is None else str(value).encode('utf-8')
+
+
+def _number(value, default):
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Snapshot:
+    '''колонки (numpy-массивы одной длины), отсортированные по url'''
+
+    def __init__(self, columns: dict):
+        order = np.argsort(columns['url'], kind='stable')
+        self.columns = {name: np.asarray(columns[name])[order] for name, _, _ in COLUMNS}
+
+    @classmethod
+    def empty(cls) -> 'Snapshot':
+        return cls({name: np.array([], dtype=typ) for name, _, typ in COLUMNS})
+
+    @classmethod
+    def from_results(cls, results) -> 'Snapshot':
+        '''снимок из пар (url, результат parse_product). для повторяющихся url берется последний'''
+        rows = dict()
+        for url, result in results:
+            rows[url] = result
+        columns = {
+            'url': np.array([_text(x) for x in rows], dtype='S'),
+            'articul': np.array([_text(x.get('articul')) for x in rows.values()], dtype='S'),
+            'name': np.array([_text(x.get('name')) for x in rows.values()], dtype='S'),
+            'price': np.array([_number(x.get('price'), np.nan) for x in rows.values()], dtype=np.float64),
+            'stock': np.array([_number(x.get('stock'), STOCK_UNKNOWN) for x in rows.values()], dtype=np.int64),
+            'parsed_at': np.array([_number(x.get('parsed_at'), np.nan) for x in rows.values()], dtype=np.float64),
+        }
+        return cls(columns)
+
+    @classmethod
+    def load(cls, path: str) -> 'Snapshot':
+        with np.load(path, allow_pickle=False) as data:
+            return cls({name: data[name] for name, _, _ in COLUMNS})
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp = path + '.tmp.npz'
+        np.savez_compressed(temp, **self.columns)
+        os.replace(temp, path)
+
+    def merge(self, newer: 'Snapshot') -> 'Snapshot':
+        '''объединение снимков: строки newer заменяют строки с теми же url'''
+        keep = ~np.isin(self.columns['url'], newer.columns['url'], assume_unique=True)
+        return Snapshot({name: np.concatenate([self.columns[name][keep], newer.columns[name]])
+                         for name, _, _ in COLUMNS})
+
+    def __len__(self):
+        return len(self.columns['url'])
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.columns[name]
+
+
+class SnapshotDiff:
+    '''
+    Различия снимков old и new. Все поля - numpy-массивы:
+
+    * added, removed -- url новых и пропавших товаров
+    * price_url, price_old, price_new -- товары, у которых изменилась цена (в т.ч. появилась или пропала)
+    * stock_out -- url товаров, остаток которых стал нулевым
+    * back_in_stock -- url товаров, которые снова появились в наличии
+      (товары с неизвестным остатком в одном из снимков в stock_out и back_in_stock не попадают)
+    '''
+
+    def __init__(self, old: Snapshot, new: Snapshot):
+        urls_old, urls_new = old['url'], new['url']
+        common, i_old, i_new = np.intersect1d(urls_old, urls_new, assume_unique=True, return_indices=True)
+        self.added = np.setdiff1d(urls_new, urls_old, assume_unique=True)
+        self.removed = np.setdiff1d(urls_old, urls_new, assume_unique=True)
+
+        price_old, price_new = old['price'][i_old], new['price'][i_new]
+        nan_old, nan_new = np.isnan(price_old), np.isnan(price_new)
+        changed = (nan_old != nan_new) | (~nan_old & ~nan_new & ~np.isclose(price_old, price_new, rtol=0, atol=0.005))
+        self.price_url = common[changed]
+        self.price_old = price_old[changed]
+        self.price_new = price_new[changed]
+
+        # строки с неизвестным остатком (STOCK_UNKNOWN) в одном из снимков не сравниваются
+        stock_old, stock_new = old['stock'][i_old], new['stock'][i_new]
+        known = (stock_old != STOCK_UNKNOWN) & (stock_new != STOCK_UNKNOWN)
+        self.stock_out = common[known & (stock_old > 0) & (stock_new == 0)]
+        self.back_in_stock = common[known & (stock_old == 0) & (stock_new > 0)]
+
+    def price_changes(self) -> list:
+        '''[(url, старая цена, новая цена)], None - цены нет'''
+        def value(x):
+            return None if np.isnan(x) else float(x)
+        return [(url.decode('utf-8'), value(a), value(b))
+                for url, a, b in zip(self.price_url, self.price_old, self.price_new)]
+
+    def stats(self) -> dict:
+        return {'added': len(self.added), 'removed': len(self.removed), 'price_changed': len(self.price_url),
+                'stock_out': len(self.stock_out), 'back_in_stock': len(self.back_in_stock)}
+
+    def __str__(self):
+        return 'SnapshotDiff: ' + str(self.stats())
+
+
+class SnapshotWriter:
+    '''
+    Собирает результаты обхода магазина и при закрытии сливает их со снимком дня.
+    Подходит как приемник для SinkWriter и stream_products (write, flush, close)
+    '''
+
+    def __init__(self, store: 'SnapshotStore', shop: str, day: date = None):
+        self._store = store
+        self._shop = shop
+        self._day = day or date.today()
+        self._rows = []
+
+    def write(self, link, result: dict) -> None:
+        self._rows.append((link.id, result))
+
+    def put(self, url: str, result: dict) -> None:
+        self._rows.append((url, result))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        self._store.put(self._shop, Snapshot.from_results(rows), self._day)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SnapshotStore:
+    '''Снимки в каталоге root: root/<shop>/<ГГГГ-ММ-ДД>.npz'''
+
+    def __init__(self, root: str):
+        self._root = root
+
+    def path(self, shop: str, day: date) -> str:
+        return os.path.join(self._root, shop, day.isoformat() + '.npz')
+
+    def shops(self) -> list:
+        if not os.path.isdir(self._root):
+            return []
+        return sorted(x for x in os.listdir(self._root) if os.path.isdir(os.path.join(self._root, x)))
+
+    def days(self, shop: str) -> list:
+        '''дни, за которые есть снимки магазина, по возрастанию'''
+        directory = os.path.join(self._root, shop)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(datetime.strptime(x[:-4], '%Y-%m-%d').date()
+                      for x in os.listdir(directory) if x.endswith('.npz') and not x.endswith('.tmp.npz'))
+
+    def load(self, shop: str, day: date) -> Snapshot:
+        path = self.path(shop, day)
+        if not os.path.exists(path):
+            return Snapshot.empty()
+        return Snapshot.load(path)
+
+    def put(self, shop: str, snapshot: Snapshot, day: date = None) -> None:
+        '''сливает snapshot со снимком магазина за день'''
+        day = day or date.today()
+        path = self.path(shop, day)
+        if os.path.exists(path):
+            snapshot = Snapshot.load(path).merge(snapshot)
+        snapshot.save(path)
+        logging.info('snapshot {} {}: {} products'.format(shop, day, len(snapshot)))
+
+    def writer(self, shop: str, day: date = None) -> SnapshotWriter:
+        return SnapshotWriter(self, shop, day)
+
+    def diff(self, shop: str, old: date = None, new: date = None) -> [SnapshotDiff, None]:
+        '''сравнивает снимки за дни old и new, по умолчанию два последних. None - снимков меньше двух'''
+        if old is None or new is None:
+            days = self.days(shop)
+            if new is None:
+                if not days:
+                    return None
+                new = days[-1]
+            if old is None:
+                earlier = [x for x in days if x < new]
+                if not earlier:
+                    return None
+                old = earlier[-1]
+        return SnapshotDiff(self.load(shop, old), self.load(shop, new))
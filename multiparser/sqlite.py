@@ -0,0 +1,195 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+очередь и история в файле SQLite (режим WAL).
+
+состояние обхода переживает остановку процесса: ссылки, выбранные из очереди,
+до вызова done считаются "в работе", и restore возвращает их в очередь.
+в память ничего не загружается, поэтому большая очередь не замедляет старт.
+
+    queue, history = open_sqlite_state('state/duim24.sqlite3')
+    parser.set_state(queue, history)
+    parser.walk_site(reset=False)  # продолжает прерванный обход
+'''
+
+from contextlib import contextmanager
+from typing import List
+import os
+import sqlite3
+import threading
+
+from .base import Link, BaseHistory, BaseQueue
+
+STATE_PENDING = 0
+STATE_TAKEN = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (type, id)
+);
+CREATE INDEX IF NOT EXISTS queue_pending ON queue (state, type, seq);
+CREATE TABLE IF NOT EXISTS history (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+'''
+
+
+class SqliteDatabase:
+    '''Соединение с файлом состояния, общее для очереди и истории (или для другой схемы)'''
+
+    def __init__(self, path: str, schema: str = SCHEMA):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(schema)
+
+    @contextmanager
+    def transaction(self):
+        '''транзакция с блокировкой на запись сразу (BEGIN IMMEDIATE)'''
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def execute(self, sql, params=()) -> list:
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def open_sqlite_state(path: str) -> ('SqliteQueue', 'SqliteHistory'):
+    '''открывает очередь и историю в одном файле'''
+    db = SqliteDatabase(path)
+    return SqliteQueue(db), SqliteHistory(db)
+
+
+def _links(links, canonical) -> list:
+    if type(links) != list:
+        links = [links]
+    result = []
+    for link in links:
+        link = canonical(link)
+        result.append((link.type, str(link.id)))
+    return result
+
+
+class SqliteQueue(BaseQueue):
+    '''
+    Очередь для парсинга в SQLite.
+    pop атомарно выбирает ссылки и отмечает их "в работе", done удаляет их из очереди.
+    contains учитывает и ожидающие, и взятые в работу ссылки.
+    '''
+
+    def __init__(self, db: SqliteDatabase):
+        super(BaseQueue).__init__()
+        self._db = db
+
+    def reset(self):
+        '''Очищает состояние очереди'''
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM queue')
+
+    def put(self, links:[Link, List[Link]])->None:
+        '''Добавляет в очередь для парсинга одной транзакцией, повторы пропускаются'''
+        with self._db.transaction() as c:
+            c.executemany('INSERT OR IGNORE INTO queue (type, id) VALUES (?, ?)', _links(links, self.canonical))
+
+    def has(self, typ: str = None) -> bool:
+        '''проверяет наличие в очереди требуемых объектов'''
+        if typ != None:
+            rows = self._db.execute('SELECT EXISTS (SELECT 1 FROM queue WHERE state = ? AND type = ?)',
+                                    (STATE_PENDING, typ))
+        else:
+            rows = self._db.execute('SELECT EXISTS (SELECT 1 FROM queue WHERE state = ?)', (STATE_PENDING,))
+        return bool(rows[0][0])
+
+    def pop(self, cnt: int = 1, typ: str = None) -> list:
+        '''выбирает из очереди требуемое количество объектов в порядке добавления и отмечает их "в работе"'''
+        with self._db.transaction() as c:
+            if typ != None:
+                rows = c.execute('SELECT seq, type, id FROM queue WHERE state = ? AND type = ? ORDER BY seq LIMIT ?',
+                                 (STATE_PENDING, typ, cnt)).fetchall()
+            else:
+                rows = c.execute('SELECT seq, type, id FROM queue WHERE state = ? ORDER BY seq LIMIT ?',
+                                 (STATE_PENDING, cnt)).fetchall()
+            c.executemany('UPDATE queue SET state = ? WHERE seq = ?', [(STATE_TAKEN, row[0]) for row in rows])
+        return [Link(type=row[1], id=row[2]) for row in rows]
+
+    def done(self, links:[Link, List[Link]]) -> None:
+        '''удаляет обработанные ссылки из очереди'''
+        with self._db.transaction() as c:
+            c.executemany('DELETE FROM queue WHERE type = ? AND id = ?', _links(links, self.canonical))
+
+    def save(self):
+        '''каждая операция сохраняется сразу, отдельного сохранения не требуется'''
+        pass
+
+    def restore(self):
+        '''возвращает в очередь ссылки, взятые в работу прерванным обходом'''
+        with self._db.transaction() as c:
+            c.execute('UPDATE queue SET state = ? WHERE state = ?', (STATE_PENDING, STATE_TAKEN))
+
+    def contains(self, link: Link) -> bool:
+        '''проверяет наличие в очереди'''
+        canonical = self.canonical(link)
+        if not self._db.execute('SELECT 1 FROM queue WHERE type = ? AND id = ?', (canonical.type, str(canonical.id))):
+            return False
+        self._found(link, canonical)
+        return True
+
+    def __str__(self):
+        rows = self._db.execute('SELECT type, COUNT(*) FROM queue WHERE state = ? GROUP BY type', (STATE_PENDING,))
+        return 'Queue: ' + str({t: n for t, n in rows})
+
+
+class SqliteHistory(BaseHistory):
+    '''История парсинга в SQLite'''
+
+    def __init__(self, db: SqliteDatabase):
+        super(SqliteHistory).__init__()
+        self._db = db
+
+    def reset(self):
+        '''сбрасывает историю парсинга'''
+        with self._db.transaction() as c:
+            c.execute('DELETE FROM history')
+
+    def put(self, links:[Link, List[Link]]) -> None:
+        '''добавляет в историю одной транзакцией'''
+        with self._db.transaction() as c:
+            c.executemany('INSERT OR IGNORE INTO history (type, id) VALUES (?, ?)', _links(links, self.canonical))
+
+    def contains(self, link: Link) -> bool:
+        '''проверяет наличие в истории'''
+        canonical = self.canonical(link)
+        if not self._db.execute('SELECT 1 FROM history WHERE type = ? AND id = ?', (canonical.type, str(canonical.id))):
+            return False
+        self._found(link, canonical)
+        return True
+
+    def __str__(self):
+        return str('History: {} items'.format(self._db.execute('SELECT COUNT(*) FROM history')[0][0]))
@@ -0,0 +1,322 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+обход магазинов несколькими процессами.
+
+вместо последовательных запусков manage.py parse supervisor запускает
+processes долгоживущих процессов (django и браузер поднимаются в процессе
+один раз) и раздает им задания по магазинам. магазин закреплен за процессом
+по хешу имени, чтобы сессии и браузер процесса обслуживали один и тот же
+сайт; если закрепленный процесс занят, задание берет свободный. одновременно
+по одному магазину выполняется не больше concurrency заданий. упавший процесс
+перезапускается, его задание повторяется (не больше max_attempts раз).
+
+задание - функция task(shop) -> bool, shop - описание магазина (dict) из
+settings.CRAWL_SHOPS. True значит, что у магазина осталась работа, и задание
+будет выполнено снова (не больше max_runs раз). по умолчанию task - crawl_shop,
+который обходит магазин порциями по shop['portion'] товаров.
+
+    python manage.py supervise --processes 4
+'''
+
+from time import monotonic
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import zlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .sinks import BaseSink
+
+DEFAULT_TASK = 'multiparser.supervisor.crawl_shop'
+
+
+class PortionLimit(BaseSink):
+    '''приемник-счетчик: после limit товаров устанавливает stop, и обход заканчивает начатые ссылки'''
+
+    def __init__(self, limit: int, stop: threading.Event):
+        self._limit = limit
+        self._stop = stop
+        self.count = 0
+
+    def write(self, link, result: dict) -> None:
+        self.count += 1
+        if self.count >= self._limit:
+            self._stop.set()
+
+
+def crawl_shop(shop: dict) -> bool:
+    '''
+    Обход магазина парсером shop['parser'] (полное имя класса). Необязательные ключи:
+    base_url, state (файл SQLite очереди), reset, workers, output (файл JSONL),
+    upload (выгружать в RESULTS_API_URL), spool (каталог для ResultUploader).
+
+    portion - товаров за одно задание (как один запуск manage.py parse в process.sh), нужен state.
+    задание возвращает True, если в очереди осталась работа, и supervisor запускает его снова.
+    reset начинает новый обход, только если очередь пуста (прошлый обход закончен).
+    задания одного магазина работают с одной очередью, поэтому concurrency магазина должно быть 1
+    '''
+    from .sinks import JsonlSink
+    from .sqlite import open_sqlite_state
+    parser_class = import_string(shop['parser'])
+    args = [shop['base_url']] if shop.get('base_url') else []
+    portion = shop.get('portion') if shop.get('state') else None
+    stop = threading.Event()
+    with parser_class(*args) as parser:
+        if shop.get('state'):
+            parser.set_state(*open_sqlite_state(shop['state']))
+            parser.restore()
+        reset = shop.get('reset', False) and not parser._queue.has()
+        sinks = []
+        if portion:
+            sinks.append(PortionLimit(portion, stop))
+        if shop.get('output'):
+            sinks.append(JsonlSink(shop['output']))
+        if shop.get('upload'):
+            from .uploader import ResultUploader
+            sinks.append(ResultUploader(spool_dir=shop.get('spool')))
+        failed = parser.stream_products(
+            sinks,
+            {parser.PARSED_URL, parser.FIELD_PAGES, parser.FIELD_PRODUCTS},
+            {parser.FIELD_URL},
+            set(shop.get('fields') or (parser.PARSED_TIME, parser.PARSED_URL, parser.FIELD_NAME,
+                                       parser.FIELD_ARTICUL, parser.FIELD_PRICE)),
+            reset=reset, workers=shop.get('workers'), stop=stop)
+        if failed:
+            logging.warning('shop {}: {} links failed'.format(shop['name'], len(failed)))
+        if not portion:
+            return False
+        parser.restore()  # отложенные для повтора ссылки возвращаются в очередь
+        return parser._queue.has()
+
+
+def _worker_main(index: int, task_path: str, jobs, results):
+    '''процесс-исполнитель: берет задания из своей очереди jobs, пока не получит None'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # остановкой управляет supervisor
+    import django
+    django.setup()
+    task = import_string(task_path)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        started = monotonic()
+        try:
+            more = bool(task(job))
+            results.put((index, job['name'], True, more, monotonic() - started, None))
+        except Exception as e:
+            logging.exception('task failed for shop {}: {}'.format(job['name'], e))
+            results.put((index, job['name'], False, False, monotonic() - started, repr(e)))
+
+
+class ShopState:
+    '''счетчики магазина в supervisor'''
+
+    def __init__(self, shop: dict, concurrency: int):
+        self.shop = shop
+        self.name = shop['name']
+        self.concurrency = shop.get('concurrency', concurrency)
+        self.waiting = self.concurrency  # заданий в ожидании
+        self.running = 0
+        self.runs = 0
+        self.errors = 0
+        self.attempts = 0  # перезапусков из-за падения процесса подряд
+        self.seconds = 0.0
+
+
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.jobs = None
+        self.shop = None  # имя магазина текущего задания
+        self.done = 0  # выполнено заданий текущим процессом
+        self.restarts = 0
+
+
+class Supervisor:
+    '''
+    * shops -- описания магазинов: {'name': ..., 'parser': ..., 'concurrency': ...}
+    * processes -- процессов-исполнителей
+    * task -- полное имя функции задания
+    * concurrency -- заданий одного магазина одновременно, если у магазина не указано свое
+    * max_runs -- сколько раз подряд выполнять задание магазина, у которого осталась работа
+    * max_attempts -- сколько раз повторять задание, во время которого упал процесс
+    * max_jobs -- после стольких заданий процесс перезапускается (утечки браузера). None - не перезапускается
+    '''
+
+    POLL = 0.5  # как часто проверять процессы, секунд
+
+    def __init__(self, shops: list, processes: int = 4, task: str = DEFAULT_TASK, concurrency: int = 1,
+                 max_runs: int = 20, max_attempts: int = 3, max_jobs: int = None):
+        if len({x['name'] for x in shops}) != len(shops):
+            raise ValueError('shop names must be unique')
+        if task == DEFAULT_TASK:
+            shared = [x['name'] for x in shops if x.get('concurrency', concurrency) > 1]
+            if shared:
+                raise ValueError('crawl_shop needs concurrency 1, shops: {}'.format(', '.join(shared)))
+        self._task = task
+        self._max_runs = max_runs
+        self._max_attempts = max_attempts
+        self._max_jobs = max_jobs
+        self._ctx = multiprocessing.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._shops = [ShopState(x, concurrency) for x in shops]
+        self._workers = [Worker(i) for i in range(max(1, processes))]
+        self._stopping = False
+
+    def shard(self, name: str) -> list:
+        '''номера процессов, закрепленных за магазином, в порядке предпочтения'''
+        count = len(self._workers)
+        first = zlib.crc32(name.encode('utf-8')) % count
+        return [(first + i) % count for i in range(count)]
+
+    def _start(self, worker: Worker):
+        worker.jobs = self._ctx.Queue()
+        worker.process = self._ctx.Process(target=_worker_main, name='crawl-worker-{}'.format(worker.index),
+                                           args=(worker.index, self._task, worker.jobs, self._results), daemon=True)
+        worker.process.start()
+        worker.done = 0
+
+    def _stop(self, worker: Worker):
+        if worker.process is None:
+            return
+        if worker.process.is_alive():
+            worker.jobs.put(None)
+            worker.process.join(30)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        worker.process = None
+
+    def _assign(self):
+        '''раздает ожидающие задания свободным процессам'''
+        if self._stopping:
+            return
+        for state in sorted(self._shops, key=lambda x: x.runs):
+            while state.waiting and state.running < state.concurrency:
+                idle = [i for i in self.shard(state.name) if self._workers[i].shop is None]
+                if not idle:
+                    return
+                worker = self._workers[idle[0]]
+                worker.shop = state.name
+                worker.jobs.put(state.shop)
+                state.waiting -= 1
+                state.running += 1
+                state.runs += 1
+
+    def _finished(self, index: int, name: str, ok: bool, more: bool, seconds: float, error):
+        worker = self._workers[index]
+        if worker.shop != name:
+            return  # процесс упал после отправки результата, задание уже возвращено в очередь
+        state = self._state(name)
+        worker.shop = None
+        worker.done += 1
+        state.running -= 1
+        state.seconds += seconds
+        state.attempts = 0
+        if not ok:
+            state.errors += 1
+            logging.error('shop {} failed: {}'.format(name, error))
+        elif more:
+            if state.runs < self._max_runs:
+                state.waiting += 1
+            else:
+                logging.warning('shop {} still has work after {} runs'.format(name, state.runs))
+        if self._max_jobs and worker.done >= self._max_jobs and not self._stopping:
+            self._stop(worker)
+            self._start(worker)
+
+    def _state(self, name: str) -> ShopState:
+        for state in self._shops:
+            if state.name == name:
+                return state
+        raise KeyError(name)
+
+    def _check(self):
+        '''перезапускает упавшие процессы и возвращает их задания в очередь'''
+        for worker in self._workers:
+            if worker.process is None or worker.process.is_alive():
+                continue
+            logging.error('worker {} exited with code {}'.format(worker.index, worker.process.exitcode))
+            worker.restarts += 1
+            if worker.shop is not None:
+                state = self._state(worker.shop)
+                state.running -= 1
+                state.attempts += 1
+                if state.attempts < self._max_attempts:
+                    state.runs -= 1
+                    state.waiting += 1
+                else:
+                    state.errors += 1
+                    logging.error('shop {} gave up after {} crashes'.format(state.name, state.attempts))
+                worker.shop = None
+            if self._stopping:
+                worker.process = None
+            else:
+                self._start(worker)
+
+    def _busy(self) -> bool:
+        if any(x.shop is not None for x in self._workers):
+            return True
+        return not self._stopping and any(x.waiting for x in self._shops)
+
+    def stop(self, *args):
+        '''новые задания не раздаются, выполняемые дорабатываются'''
+        if not self._stopping:
+            logging.info('supervisor is stopping')
+        self._stopping = True
+
+    def run(self) -> dict:
+        '''выполняет задания всех магазинов и возвращает stats()'''
+        started = monotonic()
+        handlers = dict()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            handlers[signum] = signal.signal(signum, self.stop)
+        try:
+            for worker in self._workers:
+                self._start(worker)
+            while self._busy():
+                self._assign()
+                try:
+                    self._finished(*self._results.get(timeout=self.POLL))
+                except queue.Empty:
+                    pass
+                self._check()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            for worker in self._workers:
+                self._stop(worker)
+        stats = self.stats()
+        stats['seconds'] = round(monotonic() - started, 1)
+        logging.info('Supervisor: {}'.format(stats))
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            'shops': {x.name: {'runs': x.runs, 'errors': x.errors, 'seconds': round(x.seconds, 1)}
+                      for x in self._shops},
+            'restarts': sum(x.restarts for x in self._workers),
+        }
+
+
+def configured_shops(names: list = None) -> list:
+    '''магазины из settings.CRAWL_SHOPS, при names - только перечисленные'''
+    shops = list(settings.CRAWL_SHOPS)
+    if names:
+        unknown = set(names) - {x['name'] for x in shops}
+        if unknown:
+            raise ValueError('unknown shops: {}'.format(', '.join(sorted(unknown))))
+        shops = [x for x in shops if x['name'] in names]
+    return shops
@@ -0,0 +1,226 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+транспорт SimpleParser: одна сессия на парсер с пулами соединений по хостам.
+
+у каждого потока своя requests.Session (cookies, прокси, состояние редиректов
+не делятся между потоками), но все они подключают один адаптер с пулами
+соединений, поэтому открытые соединения (и TLS-рукопожатия) переиспользуются
+между потоками. размер пула на хост равен числу потоков, заголовки задаются
+один раз при создании транспорта. с http2=True
+используется httpx (pip install httpx[http2]): запросы к хосту мультиплексируются
+в одном соединении. stats() показывает, сколько запросов ушло по уже открытым
+соединениям (hits) и сколько соединений открыто (misses).
+'''
+
+from urllib.parse import urlsplit
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+
+
+class PooledAdapter(HTTPAdapter):
+    '''HTTPAdapter со счетчиками соединений по пулам (хост или хост через прокси)'''
+
+    def __init__(self, pool_connections: int = 32, pool_maxsize: int = 10, pool_block: bool = False):
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self._lock = threading.Lock()
+        self._retired = dict()  # счетчики закрытых пулов
+
+    def _pools(self):
+        managers = [(None, self.poolmanager)] + list(self.proxy_manager.items())
+        for proxy, manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    yield proxy, pool
+
+    def stats(self) -> dict:
+        '''{хост: {'requests', 'hits', 'misses'}}, misses - открытые соединения'''
+        with self._lock:
+            result = {key: dict(value) for key, value in self._retired.items()}
+        for proxy, pool in self._pools():
+            key = '{}://{}:{}'.format(pool.scheme, pool.host, pool.port)
+            if proxy:
+                key += ' via ' + proxy
+            entry = result.setdefault(key, {'requests': 0, 'hits': 0, 'misses': 0})
+            entry['requests'] += pool.num_requests
+            entry['misses'] += pool.num_connections
+            entry['hits'] = max(0, entry['requests'] - entry['misses'])
+        return result
+
+    def grow(self, pool_maxsize: int):
+        '''увеличивает число соединений на хост. открытые пулы закрываются, их счетчики сохраняются'''
+        if pool_maxsize <= self._pool_maxsize:
+            return
+        retired = self.stats()
+        with self._lock:
+            self._retired = retired
+        self._pool_maxsize = pool_maxsize
+        for manager in [self.poolmanager] + list(self.proxy_manager.values()):
+            manager.connection_pool_kw['maxsize'] = pool_maxsize
+            manager.clear()
+
+    def close(self):
+        retired = self.stats()
+        with self._lock:
+            self._retired = retired
+        super().close()
+
+
+class Http2Session:
+    '''
+    Сессия на httpx с HTTP/2 и интерфейсом requests.Session, который использует SimpleParser:
+    headers, proxies, get, post. Ошибки соединения поднимаются как requests ConnectionError
+    '''
+
+    def __init__(self, pool_maxsize: int = 10, pool_connections: int = 32):
+        import httpx
+        self._httpx = httpx
+        self._pool_maxsize = pool_maxsize
+        self._pool_connections = pool_connections
+        self._limits = self._make_limits()
+        self._clients = dict()
+        self._lock = threading.Lock()
+        self._streams = dict()
+        self._stats = dict()
+        self.headers = dict()
+        self.proxies = dict()
+
+    def _make_limits(self):
+        connections = self._pool_maxsize * self._pool_connections
+        return self._httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    def grow(self, pool_maxsize: int):
+        '''увеличивает лимит соединений, клиенты создаются заново при следующем запросе'''
+        if pool_maxsize <= self._pool_maxsize:
+            return
+        self._pool_maxsize = pool_maxsize
+        self._limits = self._make_limits()
+        self.close()
+
+    def _client(self, proxy: str = None):
+        with self._lock:
+            if proxy not in self._clients:
+                self._clients[proxy] = self._httpx.Client(http2=True, proxy=proxy, limits=self._limits,
+                                                          headers=self.headers, follow_redirects=True)
+            return self._clients[proxy]
+
+    def _count(self, url: str, response):
+        '''соединение узнается по network_stream ответа: новый поток - новое соединение'''
+        key = '{}://{}'.format(*urlsplit(url)[:2])
+        stream = response.extensions.get('network_stream')
+        with self._lock:
+            entry = self._stats.setdefault(key, {'requests': 0, 'hits': 0, 'misses': 0})
+            entry['requests'] += 1
+            streams = self._streams.setdefault(key, set())
+            if stream is not None and id(stream) in streams:
+                entry['hits'] += 1
+            else:
+                entry['misses'] += 1
+                if stream is not None:
+                    streams.add(id(stream))
+
+    def request(self, method, url, headers=None, proxies=None, timeout=None, data=None):
+        proxy = (proxies or self.proxies).get(urlsplit(url).scheme)
+        if type(timeout) == tuple:
+            timeout = self._httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            response = self._client(proxy).request(method, url, headers=headers, data=data, timeout=timeout)
+        except self._httpx.TransportError as e:
+            raise ConnectionError(str(e))
+        self._count(url, response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {key: dict(value) for key, value in self._stats.items()}
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), dict()
+        for client in clients:
+            client.close()
+
+
+class Transport:
+    '''
+    Сессии парсера: session - общие настройки (заголовки, прокси) и адаптер,
+    thread_session() - сессия текущего потока.
+
+    * headers -- заголовки всех запросов
+    * pool_maxsize -- соединений в пуле на хост, обычно число потоков
+    * pool_connections -- сколько пулов (хостов) держать открытыми
+    * http2 -- использовать httpx с HTTP/2. если httpx не установлен - requests
+    '''
+
+    def __init__(self, headers: dict, pool_maxsize: int = 10, pool_connections: int = 32, http2: bool = False):
+        self.session = None
+        if http2:
+            try:
+                self.session = Http2Session(pool_maxsize, pool_connections)
+            except ImportError:
+                logging.warning('httpx is not installed, HTTP/2 is disabled')
+        if self.session is None:
+            self.session = requests.session()
+            self._adapter = PooledAdapter(pool_connections, pool_maxsize)
+            self.session.mount('http://', self._adapter)
+            self.session.mount('https://', self._adapter)
+        self.session.headers.update(headers)
+        self._local = threading.local()
+
+    def thread_session(self):
+        '''
+        Сессия текущего потока с заголовками и прокси session и общим адаптером.
+        Клиент httpx потокобезопасен, поэтому с HTTP/2 возвращается общая сессия
+        '''
+        if isinstance(self.session, Http2Session):
+            return self.session
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.session()
+            session.headers.clear()
+            session.headers.update(self.session.headers)
+            session.proxies.update(self.session.proxies)
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._local.session = session
+        return session
+
+    def grow(self, pool_maxsize: int):
+        '''увеличивает пул соединений на хост до pool_maxsize, вызывается до запуска потоков'''
+        if isinstance(self.session, Http2Session):
+            self.session.grow(pool_maxsize)
+        else:
+            self._adapter.grow(pool_maxsize)
+
+    def stats(self) -> dict:
+        if isinstance(self.session, Http2Session):
+            return self.session.stats()
+        return self._adapter.stats()
+
+    def close(self):
+        '''закрывает общий адаптер, а с ним соединения всех сессий потоков'''
+        self.session.close()
+
+    def __str__(self):
+        stats = self.stats()
+        requests_count = sum(x['requests'] for x in stats.values())
+        hits = sum(x['hits'] for x in stats.values())
+        return 'Transport: {} requests, {} reused connections, {} opened connections'.format(
+            requests_count, hits, sum(x['misses'] for x in stats.values()))
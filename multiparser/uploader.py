@@ -0,0 +1,296 @@
+'''
+    ____            _           _____
+   / ___|    ___   | |   ___   |_   _|   ___    _ __    _   _
+   \___ \   / _ \  | |  / _ \    | |    / _ \  | '_ \  | | | |
+    ___) | | (_) | | | | (_) |   | |   | (_) | | | | | | |_| |
+   |____/   \___/  |_|  \___/    |_|    \___/  |_| |_|  \__, |
+   2020 (c) SoloTony.com                                |___/
+   v 0.0.1 multi parser
+
+выгрузка результатов в API (RESULTS_API_URL, result/save).
+
+записи копятся в пачку, пачка отправляется, когда набралось batch_size записей
+или прошло batch_seconds секунд с первой записи. пачка - JSON-список записей,
+сжатый gzip (Content-Encoding: gzip). отправляют workers потоков через одну
+сессию с пулом соединений, поэтому обход не ждет ответа API.
+
+если API не отвечает или отвечает ошибкой, а также если очередь на отправку
+переполнена, пачка сохраняется в каталог spool_dir. сохраненные пачки
+отправляются повторно, когда API снова доступен, в том числе при следующем
+запуске. пачка удаляется с диска только после ответа 2xx. перед отправкой файл
+пачки переименовывается (.sending-<pid>-<номер>), поэтому несколько загрузчиков
+и процессов (manage.py supervise) могут работать с одним spool_dir и не
+отправляют пачку дважды; файлы, захваченные завершившимся процессом,
+возвращаются в spool_dir при следующем replay.
+
+    with ResultUploader(settings.RESULTS_API_URL, spool_dir='state/spool') as uploader:
+        parser.stream_products([uploader], ...)  # или uploader.put(record) для готовых записей
+'''
+
+from time import monotonic, time
+import gzip
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+
+from .sinks import BaseSink, dumps
+from .transport import Transport
+
+CLAIM_SUFFIX = '.sending-'  # имя захваченного файла: <имя пачки>.sending-<pid>-<номер загрузчика>
+
+
+class ResultUploader(BaseSink):
+    '''
+    * url -- адрес API, по умолчанию settings.RESULTS_API_URL
+    * batch_size -- записей в пачке
+    * batch_seconds -- наибольшее время ожидания неполной пачки
+    * compress -- сжимать пачки gzip
+    * spool_dir -- каталог для неотправленных пачек. None - неотправленные пачки теряются
+    * workers -- потоков отправки
+    * queue_size -- пачек в очереди на отправку, остальные сохраняются на диск
+    * retry_seconds -- пауза перед повторной отправкой после ошибки, удваивается до 32 раз
+    '''
+
+    def __init__(self, url: str = None, batch_size: int = 100, batch_seconds: float = 5, compress: bool = True,
+                 spool_dir: str = None, workers: int = 2, queue_size: int = 32, retry_seconds: float = 30,
+                 timeout: float = 60, headers: dict = None):
+        self._url = url or settings.RESULTS_API_URL
+        self._batch_size = batch_size
+        self._batch_seconds = batch_seconds
+        self._compress = compress
+        self._spool_dir = spool_dir
+        self._retry_seconds = retry_seconds
+        self._timeout = timeout
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._records = []
+        self._started = None  # когда в пачку попала первая запись
+        self._seq = 0
+        self._down_until = 0.0  # до какого времени API считается недоступным
+        self._failures = 0  # ошибок подряд
+        self._stats = {'records': 0, 'batches': 0, 'sent': 0, 'bytes': 0, 'raw_bytes': 0, 'packed_bytes': 0,
+                       'errors': 0, 'spooled': 0, 'replayed': 0, 'lost': 0}
+        self._transport = Transport(dict(headers or {}), pool_maxsize=workers)
+        self._batches = queue.Queue(maxsize=queue_size)
+        self._closing = threading.Event()
+        self._senders = [threading.Thread(target=self._send_loop, name='ResultUploader-{}'.format(i), daemon=True)
+                         for i in range(workers)]
+        for sender in self._senders:
+            sender.start()
+        self._timer = threading.Thread(target=self._timer_loop, name='ResultUploader-timer', daemon=True)
+        self._timer.start()
+
+    def record(self, link, result: dict) -> dict:
+        '''запись для API из результата parse_product. переопределяется под формат API'''
+        return dict(result, type=link.type, id=link.id)
+
+    def write(self, link, result: dict) -> None:
+        self.put(self.record(link, result))
+
+    def put(self, record: dict) -> None:
+        '''добавляет запись в текущую пачку. не ждет отправки'''
+        with self._lock:
+            if not self._records:
+                self._started = monotonic()
+            self._records.append(record)
+            self._stats['records'] += 1
+            batch = self._take() if len(self._records) >= self._batch_size else None
+        if batch:
+            self._enqueue(batch)
+
+    def _take(self) -> [list, None]:
+        '''забирает текущую пачку, вызывается под _lock'''
+        if not self._records:
+            return None
+        batch, self._records, self._started = self._records, [], None
+        return batch
+
+    def _encode(self, batch: list) -> bytes:
+        payload = dumps(batch).encode('utf-8')
+        raw_size = len(payload)
+        if self._compress:
+            payload = gzip.compress(payload, compresslevel=6)
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['raw_bytes'] += raw_size
+            self._stats['packed_bytes'] += len(payload)
+        return payload
+
+    def _enqueue(self, batch: list):
+        payload = self._encode(batch)
+        if monotonic() < self._down_until:
+            self._spool(payload, len(batch))
+            return
+        try:
+            self._batches.put_nowait((payload, len(batch)))
+        except queue.Full:
+            self._spool(payload, len(batch))
+
+    def flush(self) -> None:
+        '''отправляет неполную пачку'''
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._enqueue(batch)
+
+    def _send(self, payload: bytes) -> bool:
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if self._compress:
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            response = self._transport.thread_session().post(self._url, data=payload, headers=headers,
+                                                             timeout=self._timeout)
+            if 200 <= response.status_code < 300:
+                self._succeeded(len(payload))
+                return True
+            logging.error('results upload failed status code=[{}] at [{}]'.format(response.status_code, self._url))
+        except Exception as e:
+            logging.error('results upload failed: {} at [{}]'.format(e, self._url))
+        self._failed()
+        return False
+
+    def _succeeded(self, size: int):
+        with self._lock:
+            self._failures = 0
+            self._down_until = 0.0
+            self._stats['sent'] += 1
+            self._stats['bytes'] += size
+
+    def _failed(self):
+        with self._lock:
+            self._stats['errors'] += 1
+            self._down_until = monotonic() + self._retry_seconds * (2 ** min(self._failures, 5))
+            self._failures += 1
+
+    def _send_loop(self):
+        while True:
+            item = self._batches.get()
+            if item is None:
+                break
+            payload, count = item
+            if monotonic() < self._down_until or not self._send(payload):
+                self._spool(payload, count)
+
+    def _spool(self, payload: bytes, count: int):
+        if not self._spool_dir:
+            logging.error('{} results are lost, spool_dir is not set'.format(count))
+            with self._lock:
+                self._stats['lost'] += count
+            return
+        with self._lock:
+            self._seq += 1
+            name = '{:.6f}-{}-{}{}'.format(time(), os.getpid(), self._seq, '.json.gz' if self._compress else '.json')
+            self._stats['spooled'] += 1
+        path = os.path.join(self._spool_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+
+    def spooled(self) -> list:
+        '''файлы неотправленных пачек, от старых к новым'''
+        if not self._spool_dir:
+            return []
+        return sorted(x for x in os.listdir(self._spool_dir) if x.endswith('.json') or x.endswith('.json.gz'))
+
+    def _release_stale(self):
+        '''возвращает в spool_dir файлы, захваченные процессами, которых уже нет'''
+        for name in os.listdir(self._spool_dir):
+            if CLAIM_SUFFIX not in name:
+                continue
+            original, owner = name.rsplit(CLAIM_SUFFIX, 1)
+            try:
+                pid = int(owner.split('-')[0])
+                if pid == os.getpid():
+                    continue
+                os.kill(pid, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except (ValueError, PermissionError):
+                continue
+            try:
+                os.rename(os.path.join(self._spool_dir, name), os.path.join(self._spool_dir, original))
+            except FileNotFoundError:
+                pass  # вернул другой процесс
+
+    def replay(self) -> int:
+        '''отправляет сохраненные пачки до первой ошибки. возвращает число отправленных'''
+        sent = 0
+        self._release_stale()
+        for name in self.spooled():
+            if monotonic() < self._down_until:
+                break
+            path = os.path.join(self._spool_dir, name)
+            claimed = '{}{}{}-{}'.format(path, CLAIM_SUFFIX, os.getpid(), id(self))
+            try:
+                os.rename(path, claimed)
+                with open(claimed, 'rb') as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                continue  # захвачена другим загрузчиком
+            if name.endswith('.gz') != self._compress:
+                payload = gzip.compress(payload) if self._compress else gzip.decompress(payload)
+            if not self._send(payload):
+                os.rename(claimed, path)
+                break
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                pass
+            sent += 1
+            with self._lock:
+                self._stats['replayed'] += 1
+        return sent
+
+    def _timer_loop(self):
+        '''отправляет неполные пачки по времени и повторяет сохраненные, когда API доступен'''
+        tick = min(1.0, self._batch_seconds / 2)
+        while not self._closing.wait(tick):
+            try:
+                with self._lock:
+                    batch = None
+                    if self._started is not None and monotonic() - self._started >= self._batch_seconds:
+                        batch = self._take()
+                if batch:
+                    self._enqueue(batch)
+                if self._spool_dir and monotonic() >= self._down_until and self._batches.empty():
+                    self.replay()
+            except Exception as e:
+                logging.exception('results upload timer failed: {}'.format(e))
+
+    def close(self) -> None:
+        '''отправляет оставшиеся записи и дожидается отправки. неотправленное остается в spool_dir'''
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._timer.join()
+        with self._lock:
+            batch = self._take()
+        if batch:
+            payload = self._encode(batch)
+            self._batches.put((payload, len(batch)))
+        for _ in self._senders:
+            self._batches.put(None)
+        for sender in self._senders:
+            sender.join()
+        if monotonic() >= self._down_until:
+            self.replay()
+        self._transport.close()
+        logging.info(str(self))
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = dict(self._stats)
+        result['pending'] = len(self.spooled())
+        return result
+
+    def __str__(self):
+        stats = self.stats()
+        ratio = stats['packed_bytes'] / stats['raw_bytes'] if stats['raw_bytes'] else 1
+        return 'ResultUploader: {} records in {} batches, {} sent, {} spooled, {} replayed, {} pending, ' \
+               'compression {:.0%}'.format(stats['records'], stats['batches'], stats['sent'], stats['spooled'],
+                                           stats['replayed'], stats['pending'], ratio)